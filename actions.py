@@ -1,24 +1,88 @@
+import asyncio
 import platform
-import subprocess
-import time
+from concurrent.futures import Future
 from abc import ABC, abstractmethod
 from enum import Enum
-from time import sleep
 
 from core import Simpyt, ImproperlyConfiguredException
+from launcher import Launcher, split_command
+from metrics import mark
+from timing import Timer
 
 PLATFORM = platform.system()
 
 if PLATFORM == "Windows":
     from joystick_windows import Joystick
-    import pydirectinput as keyboard_lib
+    from keyboard_windows import Keyboard
 elif PLATFORM == "Linux":
     from joystick_linux import Joystick
-    import pyautogui as keyboard_lib
+    from keyboard_linux import Keyboard
 else:
     raise ValueError(f"Unsuported platform: {PLATFORM}")
 
 
+class Pacing:
+    """
+    How fast keys and buttons are sent to the system:
+
+        - hold (seconds): how long keys and buttons are held down when tapped (like in scripts).
+        - key_interval (seconds): time between each key of a chord, and each character of a
+          written text. With 0, the keys of a chord are sent all at once.
+
+    Values not specified (None) are taken from the global pacing of the running app, which can be
+    overridden per control.
+    """
+    # used when there's no running app to take the global pacing from
+    DEFAULT_HOLD = 0.05
+    DEFAULT_KEY_INTERVAL = 0
+
+    def __init__(self, hold=None, key_interval=None):
+        self.hold = hold
+        self.key_interval = key_interval
+
+    @property
+    def hold_seconds(self):
+        """
+        The time to hold keys or buttons down, in seconds.
+        """
+        if self.hold is not None:
+            return self.hold
+        if Simpyt.current is not None:
+            return Simpyt.current.keys_hold
+        return self.DEFAULT_HOLD
+
+    @property
+    def key_interval_seconds(self):
+        """
+        The time between consecutive keys, in seconds.
+        """
+        if self.key_interval is not None:
+            return self.key_interval
+        if Simpyt.current is not None:
+            return Simpyt.current.keys_interval
+        return self.DEFAULT_KEY_INTERVAL
+
+    @classmethod
+    def deserialize(cls, raw_config):
+        """
+        Read the 'pacing' attribute of a control, a dict with the hold and key_interval seconds.
+        """
+        try:
+            assert isinstance(raw_config, dict)
+            assert set(raw_config) <= {"hold", "key_interval"}
+
+            pacing_args = {name: float(seconds) for name, seconds in raw_config.items()}
+            assert all(seconds >= 0 for seconds in pacing_args.values())
+        except Exception as ex:
+            raise ImproperlyConfiguredException(
+                "The 'pacing' attribute of a control has an incorrect format. It can specify "
+                "'hold' and 'key_interval', in seconds (zero or more):\n"
+                f"pacing: {raw_config}"
+            ) from ex
+
+        return cls(**pacing_args)
+
+
 class Action(ABC):
     """
     Action that can be triggered in interactions with a Control.
@@ -33,6 +97,9 @@ class Action(ABC):
     CAN_BE_LINKED = False
     HAS_PARAMETERS = True
 
+    # the global pacing, unless the control using the action overrides it
+    pacing = Pacing()
+
     ACTIONS_BY_PREFIX = {}
 
     class Mode(Enum):
@@ -56,6 +123,27 @@ class Action(ABC):
         Overwrite this method with the logic to run a specific action.
         """
 
+    async def run_async(self, mode):
+        """
+        Run the action inside a script. Actions that need to wait for something should overwrite
+        this method to wait without blocking the scripts engine, as all scripts share its thread.
+        """
+        self.run(mode)
+
+    def waits_when_linked(self):
+        """
+        Does pressing or releasing this action in linked mode wait for something? If so, it's
+        better ran by the scripts engine, as a LinkedHold.
+        """
+        return False
+
+    def holds_same_as(self, other):
+        """
+        When linked, does this action hold down the same things as another one? If so, releasing
+        either of them releases what the other one pressed.
+        """
+        return False
+
     @classmethod
     def register(cls, action_class):
         """
@@ -68,29 +156,35 @@ class Action(ABC):
     def deserialize(cls, raw_config):
         """
         Deserialize a linked action, or a script of actions, or even both, defined for a control.
+        If the control specifies a pacing, it's used by all its actions.
         """
         linked_action = None
         script = None
 
         raw_linked_action = raw_config.pop("action", None)
         raw_script = raw_config.pop("script", None)
+        raw_pacing = raw_config.pop("pacing", None)
+
+        pacing = None
+        if raw_pacing is not None:
+            pacing = Pacing.deserialize(raw_pacing)
 
         if raw_linked_action:
-            linked_action = cls.find_and_deserialize(raw_linked_action)
+            linked_action = cls.find_and_deserialize(raw_linked_action, pacing)
 
         if raw_script:
             script = Script(
-                [cls.find_and_deserialize(script_action_raw_config)
+                [cls.find_and_deserialize(script_action_raw_config, pacing)
                  for script_action_raw_config in raw_script]
             )
 
         return linked_action, script
 
     @classmethod
-    def find_and_deserialize(cls, raw_config):
+    def find_and_deserialize(cls, raw_config, pacing=None):
         """
         Find the specific Action class from the prefix, and then deserialize it passing the rest
-        of the config.
+        of the config. If a pacing is specified, the action will use it instead of the global one.
         """
         try:
             parts = raw_config.split()
@@ -109,7 +203,11 @@ class Action(ABC):
             else:
                 action_raw_config = None
 
-            return action_class.deserialize(action_raw_config)
+            action = action_class.deserialize(action_raw_config)
+            if pacing is not None:
+                action.pacing = pacing
+
+            return action
 
         except ImproperlyConfiguredException:
             # if we got a nice error, just pass it around
@@ -124,24 +222,57 @@ class Action(ABC):
 class Script:
     """
     A sequence of actions to be called in unlinked mode.
+    Scripts are coroutines, ran by the scripts engine.
     """
     def __init__(self, actions):
         self.actions = actions
 
-    def run(self):
+    async def run(self):
         """
         Execute all the actions.
         """
         for action in self.actions:
-            action.run(Action.Mode.UNLINKED)
+            mark("action_start", action)
+            await action.run_async(Action.Mode.UNLINKED)
+
+
+class LinkedHold:
+    """
+    A press of a linked action, ran by the scripts engine until its control is released. Used for
+    linked actions that wait while pressing or releasing, so they don't block whoever handles the
+    control (like the dispatch of all the midi messages).
+    """
+    def __init__(self, action):
+        self.action = action
+        # done when the control is released, can be set from any thread
+        self.released = Future()
+
+    def release(self):
+        """
+        Let the action be released, after it finishes being pressed.
+        """
+        if not self.released.done():
+            self.released.set_result(None)
+
+    async def run(self):
+        """
+        Press the action, and release it once the control is released.
+        """
+        mark("action_start", self.action)
+        try:
+            await self.action.run_async(Action.Mode.LINKED_CONTROL_PRESS)
+            await asyncio.wrap_future(self.released)
+        finally:
+            # released even if the run is cancelled while the action is down
+            await self.action.run_async(Action.Mode.LINKED_CONTROL_RELEASE)
 
 
 @Action.register
 class KeysAction(Action):
     """
     Press specific keys from the keyboard.
-    When used in scripts, it just preses and releases the specified keys in a single step with the
-    specified interval in between them.
+    When used in scripts, it just preses and releases the specified keys in a single step, holding
+    them down for the hold time of the pacing.
     When used in linked mode, the up and down of the keys is linked to the up and down of the
     control using it.
 
@@ -193,19 +324,63 @@ class KeysAction(Action):
             if not key in cls.VALID_KEYS:
                 raise ValueError(f"Unknown or unsupported key: {key}")
 
+    def key_batches(self):
+        """
+        The batches in which the keys are pressed: all at once, or one by one if the pacing
+        specifies an interval between keys.
+        """
+        if self.pacing.key_interval_seconds:
+            return [[key] for key in self.keys]
+        else:
+            return [self.keys]
+
     def hold_down(self):
         """
         Hold down the defined keys.
         """
-        for key in self.keys:
-            keyboard_lib.keyDown(key)
+        for index, keys in enumerate(self.key_batches()):
+            if index:
+                Timer.get().sleep(self.pacing.key_interval_seconds)
+            Keyboard.get().press_keys(keys)
 
     def release(self):
         """
-        Release the defined keys.
+        Release the defined keys, in reverse order.
+        """
+        for index, keys in enumerate(reversed(self.key_batches())):
+            if index:
+                Timer.get().sleep(self.pacing.key_interval_seconds)
+            Keyboard.get().release_keys(keys)
+
+    def waits_when_linked(self):
+        """
+        Keys pressed one by one wait between them.
+        """
+        return len(self.key_batches()) > 1
+
+    def holds_same_as(self, other):
+        """
+        Same keys held down.
+        """
+        return isinstance(other, KeysAction) and other.keys == self.keys
+
+    async def hold_down_async(self):
+        """
+        Hold down the defined keys, without blocking the scripts engine.
         """
-        for key in reversed(self.keys):
-            keyboard_lib.keyUp(key)
+        for index, keys in enumerate(self.key_batches()):
+            if index:
+                await Timer.get().sleep_async(self.pacing.key_interval_seconds)
+            Keyboard.get().press_keys(keys)
+
+    async def release_async(self):
+        """
+        Release the defined keys, in reverse order, without blocking the scripts engine.
+        """
+        for index, keys in enumerate(reversed(self.key_batches())):
+            if index:
+                await Timer.get().sleep_async(self.pacing.key_interval_seconds)
+            Keyboard.get().release_keys(keys)
 
     def run(self, mode):
         """
@@ -213,13 +388,29 @@ class KeysAction(Action):
         """
         if mode == self.Mode.UNLINKED:
             self.hold_down()
-            sleep(0.1)
+            Timer.get().sleep(self.pacing.hold_seconds)
             self.release()
         elif mode == self.Mode.LINKED_CONTROL_PRESS:
             self.hold_down()
         elif mode == self.Mode.LINKED_CONTROL_RELEASE:
             self.release()
 
+    async def run_async(self, mode):
+        """
+        Execute the action inside a script.
+        """
+        if mode == self.Mode.UNLINKED:
+            try:
+                await self.hold_down_async()
+                await Timer.get().sleep_async(self.pacing.hold_seconds)
+            finally:
+                # keys are released even if the script is cancelled while they are down
+                await self.release_async()
+        elif mode == self.Mode.LINKED_CONTROL_PRESS:
+            await self.hold_down_async()
+        elif mode == self.Mode.LINKED_CONTROL_RELEASE:
+            await self.release_async()
+
     @classmethod
     def deserialize(cls, raw_config):
         """
@@ -252,7 +443,13 @@ class Write(Action):
         """
         # if used in linked mode, execute the action in the control release
         if mode in (self.Mode.UNLINKED, self.Mode.LINKED_CONTROL_RELEASE):
-            keyboard_lib.write(self.text)
+            Keyboard.get().type_text(self.text, self.pacing.key_interval_seconds)
+
+    async def run_async(self, mode):
+        """
+        Execute the action inside a script. Typing takes time, so it's done in another thread.
+        """
+        await asyncio.to_thread(self.run, mode)
 
     @classmethod
     def deserialize(cls, raw_config):
@@ -273,10 +470,9 @@ class Wait(Action):
     Params:
         - seconds_to_wait (int|float): time in seconds to wait. Defaults to 0.5.
 
-
-    Minimun time in second is different between OSs
+    Waits are done with the high precision Timer, as the precision of time.sleep varies a lot
+    between OSs.
     Check https://stackoverflow.com/questions/1133857/how-accurate-is-pythons-time-sleep/
-
     """
     PREFIX = "wait"
 
@@ -289,7 +485,14 @@ class Wait(Action):
         """
         # if used in linked mode, execute the action in the control release
         if mode in (self.Mode.UNLINKED, self.Mode.LINKED_CONTROL_RELEASE):
-            time.sleep(self.seconds_to_wait)
+            Timer.get().sleep(self.seconds_to_wait)
+
+    async def run_async(self, mode):
+        """
+        Execute the action inside a script, without blocking the scripts engine.
+        """
+        if mode in (self.Mode.UNLINKED, self.Mode.LINKED_CONTROL_RELEASE):
+            await Timer.get().sleep_async(self.seconds_to_wait)
 
     @classmethod
     def deserialize(cls, raw_config):
@@ -303,6 +506,8 @@ class Wait(Action):
 class RunCommand(Action):
     """
     Run a specific command.
+    Commands are launched without a shell when they don't need one, and the amount of processes
+    running at once is limited by the Launcher.
 
     Params:
         - command (str): Command of the app to run.
@@ -311,6 +516,8 @@ class RunCommand(Action):
 
     def __init__(self, command):
         self.command = command
+        # None if the command needs a shell
+        self.args = split_command(command)
 
     def run(self, mode):
         """
@@ -318,7 +525,7 @@ class RunCommand(Action):
         """
         # if used in linked mode, execute the action in the control release
         if mode in (self.Mode.UNLINKED, self.Mode.LINKED_CONTROL_RELEASE):
-            subprocess.Popen(self.command, shell=True)
+            Launcher.get().launch(self.command, self.args)
 
     @classmethod
     def deserialize(cls, raw_config):
@@ -334,7 +541,8 @@ class JoystickAction(Action):
     Press specific buttons or move axes from a joystick.
 
     Butons behave just like keys in both modes (linked and unlinked).
-    Axes in linked mode require a value to be passed in the call.
+    Axes in linked move mode require a value to be passed in the call. When linked to a control
+    being pressed (like a web button), they move to the value specified in the config.
     Axes in unlinked mode require a value to be specified in the config, initially, and will
     allways be used.
 
@@ -364,6 +572,14 @@ class JoystickAction(Action):
 
         self.ensure_valid_controls()
 
+    def holds_same_as(self, other):
+        """
+        Same button (or axis) of the same joystick.
+        """
+        return (isinstance(other, JoystickAction)
+                and (other.joystick_id, other.control_type, other.control_id)
+                == (self.joystick_id, self.control_type, self.control_id))
+
     def ensure_valid_controls(self):
         """
         Ensure that the specified keys are valid, otherwise raise an error.
@@ -384,7 +600,7 @@ class JoystickAction(Action):
         if self.control_type == self.ControlType.BUTTON:
             if mode == self.Mode.UNLINKED:
                 self.joystick.press_button(self.control_id)
-                time.sleep(0.1)
+                Timer.get().sleep(self.pacing.hold_seconds)
                 self.joystick.release_button(self.control_id)
             elif mode == self.Mode.LINKED_CONTROL_PRESS:
                 self.joystick.press_button(self.control_id)
@@ -392,16 +608,31 @@ class JoystickAction(Action):
                 self.joystick.release_button(self.control_id)
 
         elif self.control_type == self.ControlType.AXIS:
-            if value and self.unlinked_axis_value is None:
+            if value is None and self.unlinked_axis_value is None:
                 raise ValueError("To use an axis not tied to an actual midi device axis, you must "
                                  f"specify a fixed value for it (joystick {self.joystick_id}, "
                                  f"axis {self.control_id})")
             if value is None:
                 value = self.unlinked_axis_value
 
-            if mode in (self.Mode.UNLINKED, self.Mode.LINKED_CONTROL_MOVE):
+            if mode in (self.Mode.UNLINKED, self.Mode.LINKED_CONTROL_MOVE,
+                        self.Mode.LINKED_CONTROL_PRESS):
                 self.joystick.move_axis(self.control_id, value)
 
+    async def run_async(self, mode):
+        """
+        Execute the action inside a script, without blocking the scripts engine.
+        """
+        if self.control_type == self.ControlType.BUTTON and mode == self.Mode.UNLINKED:
+            try:
+                self.joystick.press_button(self.control_id)
+                await Timer.get().sleep_async(self.pacing.hold_seconds)
+            finally:
+                # the button is released even if the script is cancelled while it's down
+                self.joystick.release_button(self.control_id)
+        else:
+            self.run(mode)
+
     @classmethod
     def deserialize(cls, raw_config):
         """
@@ -0,0 +1,274 @@
+"""
+Benchmark of the midi pipeline: synthetic midi messages are fed through in-memory ports into the
+real receiver and dispatch path, and the controls inject them into recording keyboard and
+joystick backends, so it can run headless (on linux).
+
+Reports the messages handled per second, and the p50 and p99 latency from the moment each
+message is received to the moment it reaches a backend. Fails if the results are worse than the
+stored baseline (beyond a tolerance).
+
+Baselines depend on the machine, so they aren't part of the repo: each machine (like a CI
+runner) stores its own with --save-baseline, and a run without a baseline to compare with fails.
+
+Usage, from the root of the repo:
+
+    python -m benchmarks.midi_pipeline                    # run and compare with the baseline
+    python -m benchmarks.midi_pipeline --save-baseline    # run and store the results as baseline
+    python -m benchmarks.midi_pipeline --baseline ci.json # use another baseline file
+"""
+from pathlib import Path
+from statistics import median
+from threading import Event, Thread
+from time import perf_counter
+import argparse
+import json
+import sys
+import tempfile
+
+import mido
+
+from core import Simpyt
+from joystick_linux import Joystick, RecordingUinputFile
+from keyboard_base import RecordingKeyboard
+from metrics import Metrics
+from midi import MidiControl, MidiDevice, MidiReceiver
+from timing import Timer
+import actions
+
+
+# default baseline file, ignored by git
+BASELINE_PATH = Path(__file__).parent / "midi_pipeline_baseline.json"
+
+# controls that don't match the benchmark messages, so the dispatch has to skip them
+FILLER_CONTROLS = 50
+
+# latencies can be worse than the baseline by this many milliseconds on top of the tolerance,
+# as sub-millisecond latencies vary a lot in relative terms with the load of the machine
+LATENCY_NOISE_FLOOR_MS = 0.5
+
+
+class FakeInputPort:
+    """
+    An in-memory midi input port, to which messages can be fed as if they came from a device.
+    """
+    def __init__(self, name, callback):
+        self.name = name
+        self.callback = callback
+
+    def feed(self, message):
+        """
+        Deliver a message, like the backends do from their own threads.
+        """
+        self.callback(message)
+
+
+class FakeMidiBackend:
+    """
+    A stand-in for a mido backend, opening in-memory ports.
+    """
+    def __init__(self):
+        self.ports = {}
+
+    def open_input(self, name, callback=None):
+        """
+        Open an in-memory port.
+        """
+        port = self.ports[name] = FakeInputPort(name, callback)
+        return port
+
+
+class RecordingMetrics(Metrics):
+    """
+    Metrics that also keep every latency from receiving a message to reaching a backend.
+    """
+    def __init__(self):
+        super().__init__()
+        self.backend_latencies = []
+        self.all_done = Event()
+        self.expected = None
+
+    def observe(self, metric_name, value, **labels):
+        super().observe(metric_name, value, **labels)
+
+        if metric_name == "simpyt_interaction_stage_seconds" and labels["stage"] == "backend":
+            self.backend_latencies.append(value)
+            if len(self.backend_latencies) == self.expected:
+                self.all_done.set()
+
+
+def build_device():
+    """
+    A device with a key linked to a note, an axis linked to a knob, and lots of other controls.
+    """
+    controls = [
+        MidiControl(when_note=40, when_value_between=(1, 1),
+                    linked_action=actions.Action.find_and_deserialize("keys ctrl a")),
+        MidiControl(when_control=7, when_value_between=(0, 127),
+                    linked_action=actions.Action.find_and_deserialize("joystick 1 axis 1")),
+    ]
+    for number in range(FILLER_CONTROLS):
+        controls.append(
+            MidiControl(when_control=20 + number, when_value_between=(0, 127),
+                        linked_action=actions.Action.find_and_deserialize("keys b"))
+        )
+
+    return MidiDevice(name="BENCHMARK-DEVICE", controls=controls)
+
+
+def build_messages(count):
+    """
+    A mix of key presses and releases, and knob movements.
+    """
+    messages = []
+    for index in range(count):
+        kind = index % 3
+        if kind == 0:
+            messages.append(mido.Message("note_on", note=40, velocity=100))
+        elif kind == 1:
+            messages.append(mido.Message("note_off", note=40, velocity=0))
+        else:
+            # a different value each time, or the joystick would skip it as redundant
+            messages.append(mido.Message("control_change", control=7, value=index % 128))
+
+    return messages
+
+
+def percentile(sorted_values, ratio):
+    """
+    Get a percentile from a sorted list of values.
+    """
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * ratio))]
+
+
+def run_benchmark(messages_count, rate):
+    """
+    Feed messages at a rate (per second, 0 for as fast as possible) and measure how they are
+    handled.
+    """
+    metrics = RecordingMetrics()
+    metrics.expected = messages_count
+    Metrics._current = metrics
+
+    actions.Keyboard._current = RecordingKeyboard()
+    Joystick.UINPUT_FILE_CLASS = RecordingUinputFile
+
+    device = build_device()
+    receiver = MidiReceiver(FakeMidiBackend(), use_callbacks=True)
+    receiver.connect(device)
+
+    def dispatch_loop():
+        for received_device, message, received_at in receiver:
+            if message is not None:
+                received_device.handle_message(message, received_at)
+
+    Thread(target=dispatch_loop, daemon=True).start()
+
+    messages = build_messages(messages_count)
+    timer = Timer(spin_seconds=0.001)
+    interval = 1 / rate if rate else 0
+
+    started_at = perf_counter()
+    for index, message in enumerate(messages):
+        if interval:
+            remaining = started_at + index * interval - perf_counter()
+            if remaining > 0:
+                timer.sleep(remaining)
+        device.port.feed(message)
+
+    if not metrics.all_done.wait(timeout=60):
+        raise RuntimeError(f"Only {len(metrics.backend_latencies)} of {messages_count} messages "
+                           "reached the backends")
+    elapsed = perf_counter() - started_at
+
+    latencies = sorted(metrics.backend_latencies)
+    return dict(
+        messages_per_second=messages_count / elapsed,
+        p50_ms=percentile(latencies, 0.5) * 1000,
+        p99_ms=percentile(latencies, 0.99) * 1000,
+    )
+
+
+def run_all(messages_count, rate, repeats):
+    """
+    Run the benchmarks: a burst of messages as fast as possible (for throughput), and messages
+    at a steady rate (for latency, without queues piling up). Each one is repeated several times,
+    keeping the median results, to reduce the noise of other processes in the machine.
+    """
+    bursts = [run_benchmark(messages_count, rate=0) for _ in range(repeats)]
+    steadies = [run_benchmark(messages_count, rate=rate) for _ in range(repeats)]
+
+    return dict(
+        burst_messages_per_second=median(burst["messages_per_second"] for burst in bursts),
+        steady_p50_ms=median(steady["p50_ms"] for steady in steadies),
+        steady_p99_ms=median(steady["p99_ms"] for steady in steadies),
+    )
+
+
+def find_regressions(results, baseline, tolerance):
+    """
+    Compare results with the baseline. Returns a list of descriptions of the regressions.
+    """
+    regressions = []
+
+    min_throughput = baseline["burst_messages_per_second"] * (1 - tolerance)
+    if results["burst_messages_per_second"] < min_throughput:
+        regressions.append("burst_messages_per_second is "
+                           f"{results['burst_messages_per_second']:.0f}, "
+                           f"expected at least {min_throughput:.0f}")
+
+    for name in ("steady_p50_ms", "steady_p99_ms"):
+        max_latency = baseline[name] * (1 + tolerance) + LATENCY_NOISE_FLOOR_MS
+        if results[name] > max_latency:
+            regressions.append(f"{name} is {results[name]:.3f}, "
+                               f"expected at most {max_latency:.3f}")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the midi pipeline of Simpyt.")
+    parser.add_argument("--messages", type=int, default=20000,
+                        help="amount of messages fed in each run")
+    parser.add_argument("--rate", type=int, default=2000,
+                        help="messages per second in the steady run")
+    parser.add_argument("--repeats", type=int, default=5,
+                        help="times each run is repeated, keeping the median results")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="how much worse than the baseline results can be, as a ratio")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH,
+                        help="file with the baseline to compare with (or to store)")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store the results as the new baseline")
+    args = parser.parse_args()
+
+    if not args.save_baseline and not args.baseline.exists():
+        # checked before running, so a missing baseline fails fast
+        print(f"Baseline not found: {args.baseline}\n"
+              "Run the benchmark with --save-baseline first to store one.")
+        sys.exit(1)
+
+    Simpyt.current = Simpyt(Path(tempfile.gettempdir()) / "simpyt_benchmark")
+
+    results = run_all(args.messages, args.rate, args.repeats)
+    for name, value in results.items():
+        print(f"{name}: {value:.3f}")
+
+    if args.save_baseline:
+        rounded_results = {name: round(value, 3) for name, value in results.items()}
+        args.baseline.write_text(json.dumps(rounded_results, indent=4) + "\n")
+        print("Baseline saved:", args.baseline)
+        return
+
+    baseline = json.loads(args.baseline.read_text())
+    regressions = find_regressions(results, baseline, args.tolerance)
+    if regressions:
+        print("Performance regressions found!")
+        for regression in regressions:
+            print("-", regression)
+        sys.exit(1)
+
+    print("No performance regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -31,14 +31,39 @@ class Simpyt:
     # class attribute, reference to the running app
     current = None
 
-    def __init__(self, root_configs_path, debug=False, web_debug=False):
+    def __init__(self, root_configs_path, debug=False, web_debug=False,
+                 joysticks_tick_rate=1000, web_workers=64, keys_hold=0.05, keys_interval=0,
+                 timer_spin=0.002, max_processes=16, max_processes_per_command=2,
+                 midi_capture_path=None):
         self.root_configs_path = root_configs_path
         self.root_code_path = Path(__file__).parent.absolute()
         self.debug = debug
         self.web_debug = web_debug
+        # max amount of reports per second sent to each virtual joystick driver
+        self.joysticks_tick_rate = joysticks_tick_rate
+        # max amount of requests the web app handles at once (the control channels of the open
+        # pages have their own threads, and don't count)
+        self.web_workers = web_workers
+        # global pacing of keys and buttons, in seconds (controls can override it): how long they
+        # are held down when tapped, and the time between consecutive keys (0 to send chords at
+        # once)
+        self.keys_hold = keys_hold
+        self.keys_interval = keys_interval
+        # seconds at the end of each wait in which the timer checks the clock instead of sleeping,
+        # for more precise waits. More precision, but more CPU usage
+        self.timer_spin = timer_spin
+        # max amount of processes launched by run actions that can be running at once, in total
+        # and for each command
+        self.max_processes = max_processes
+        self.max_processes_per_command = max_processes_per_command
+        # file where all the received midi messages are captured, to replay them later (None to
+        # not capture them)
+        self.midi_capture_path = midi_capture_path
 
         self.web_thread = None
         self.midi_thread = None
+        # the capture of midi messages in progress, if any
+        self.midi_capture = None
 
     @property
     def assets_path(self):
@@ -114,4 +139,15 @@ class Simpyt:
         print()
         print("Stopping Simpyt")
         print()
+
+        # imported here to prevent circular imports
+        from actions import Joystick
+
+        # virtual joysticks aren't removed by the OS when the process exits
+        Joystick.close_all()
+
+        # exiting skips the cleanup of the threads, so the capture would lose its buffered end
+        if self.midi_capture is not None:
+            self.midi_capture.close()
+
         os._exit(0)
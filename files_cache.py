@@ -0,0 +1,158 @@
+from collections import OrderedDict
+from hashlib import sha1
+from threading import Lock
+import mimetypes
+import os
+
+from flask import Response, request
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+
+# a year, the longest time clients are expected to respect
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+class BoundedCache:
+    """
+    A dict-like cache of bytes contents, that forgets the least recently used ones when their total
+    size goes over a max size.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+
+        self.items = OrderedDict()
+        self.size = 0
+        self.lock = Lock()
+
+    def get(self, key):
+        """
+        Get an item, or None if it's not in the cache.
+        """
+        with self.lock:
+            item_and_size = self.items.get(key)
+            if item_and_size is None:
+                return None
+
+            self.items.move_to_end(key)
+            return item_and_size[0]
+
+    def put(self, key, item, item_size):
+        """
+        Store an item, unless it's bigger than the whole cache.
+        """
+        with self.lock:
+            old_item_and_size = self.items.pop(key, None)
+            if old_item_and_size is not None:
+                self.size -= old_item_and_size[1]
+
+            if item_size <= self.max_size:
+                self.items[key] = item, item_size
+                self.size += item_size
+
+                while self.size > self.max_size:
+                    _, (_, forgotten_size) = self.items.popitem(last=False)
+                    self.size -= forgotten_size
+
+
+def versioned_response(content, mimetype, etag, version):
+    """
+    Build the response to serve some content, or a 304 if the client already has it.
+    If the client requested it with its version in the url, it's told to cache it forever.
+    """
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(content, mimetype=mimetype)
+
+    response.set_etag(etag)
+    if request.args.get("v") == version:
+        # this url will always point to this exact content
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+
+    return response
+
+
+class CachedFile:
+    """
+    The contents of a file, kept in memory.
+    """
+    def __init__(self, content, modified_at, file_size, mimetype):
+        self.content = content
+        self.modified_at = modified_at
+        self.file_size = file_size
+        self.mimetype = mimetype
+        self.version = sha1(content).hexdigest()[:16]
+
+
+class FilesCache:
+    """
+    Serves the files from a folder, keeping the most used ones in memory (up to a max total size),
+    and reading them again only when they change on disk.
+
+    Files are served with strong etags, and can also be requested with their version in the url
+    (see versioned_url), in which case clients are told to cache them forever.
+    """
+    def __init__(self, root_path, url_prefix, max_size=64 * 1024 * 1024):
+        self.root_path = root_path
+        self.url_prefix = url_prefix
+        self.files = BoundedCache(max_size)
+
+    def get(self, file_path):
+        """
+        Get a file, from memory if it didn't change since it was read, or from disk otherwise.
+        """
+        full_path = safe_join(str(self.root_path), file_path)
+        if full_path is None:
+            raise NotFound()
+
+        try:
+            stat = os.stat(full_path)
+        except (FileNotFoundError, NotADirectoryError):
+            raise NotFound()
+
+        cached_file = self.files.get(file_path)
+        if (cached_file is not None
+                and cached_file.modified_at == stat.st_mtime_ns
+                and cached_file.file_size == stat.st_size):
+            return cached_file
+
+        try:
+            with open(full_path, "rb") as file:
+                content = file.read()
+        except (IsADirectoryError, FileNotFoundError):
+            raise NotFound()
+
+        cached_file = CachedFile(
+            content=content,
+            modified_at=stat.st_mtime_ns,
+            file_size=stat.st_size,
+            mimetype=mimetypes.guess_type(file_path)[0] or "application/octet-stream",
+        )
+
+        self.files.put(file_path, cached_file, len(content))
+        return cached_file
+
+    def versioned_url(self, file_path):
+        """
+        Build the url of a file including its current version, so it can be cached forever by
+        clients. If the file doesn't exist, the plain url is returned.
+        """
+        try:
+            version = self.get(file_path).version
+        except NotFound:
+            return f"{self.url_prefix}/{file_path}"
+
+        return f"{self.url_prefix}/{file_path}?v={version}"
+
+    def response(self, file_path):
+        """
+        Build the response to serve a file, or a 304 if the client already has this version.
+        """
+        cached_file = self.get(file_path)
+        return versioned_response(cached_file.content, cached_file.mimetype,
+                                  etag=cached_file.version, version=cached_file.version)
@@ -0,0 +1,268 @@
+from hashlib import sha1
+from io import BytesIO
+from math import ceil
+
+from flask import request
+from werkzeug.exceptions import NotFound
+
+from files_cache import BoundedCache, versioned_response
+
+try:
+    from PIL import Image
+except ImportError:
+    # without pillow, images are always served in their original size and no atlases are built
+    Image = None
+
+
+# requested sizes are rounded up to multiples of these, so each image has just a few variants
+RESIZE_STEP = 128
+ATLAS_UNIT_STEP = 8
+ATLAS_MAX_UNIT = 128
+
+
+def round_up(value, step, max_value=None):
+    """
+    Round a value up to a multiple of step, and down to max_value if specified.
+    """
+    rounded = max(step, ceil(value / step) * step)
+    if max_value is not None:
+        rounded = min(rounded, max_value)
+
+    return rounded
+
+
+def fit_image(image, width, height, enlarge=False):
+    """
+    Resize an image to fit inside a box, preserving its aspect ratio (like "contain" in css).
+    Images are only enlarged if requested.
+    """
+    ratio = min(width / image.width, height / image.height)
+    if not enlarge:
+        ratio = min(ratio, 1)
+    if ratio == 1:
+        return image
+
+    if image.mode in ("1", "P"):
+        # palette images can't be resized smoothly
+        image = image.convert("RGBA")
+
+    new_size = max(1, round(image.width * ratio)), max(1, round(image.height * ratio))
+    return image.resize(new_size, Image.LANCZOS)
+
+
+def encode_image(image, image_format):
+    """
+    Encode an image in a specific format, returning its bytes.
+    """
+    if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    output = BytesIO()
+    image.save(output, format=image_format)
+    return output.getvalue()
+
+
+class ImagesResizer:
+    """
+    Serves the images from a files cache in the size requested by the clients (w and h url params),
+    so devices don't download more pixels than they can show. Resized variants are kept in memory.
+    """
+    def __init__(self, files_cache, max_size=64 * 1024 * 1024):
+        self.files_cache = files_cache
+        self.variants = BoundedCache(max_size)
+
+    def response(self, image_path):
+        """
+        Build the response to serve an image, resized if the client requested a size.
+        """
+        try:
+            width = int(request.args["w"])
+            height = int(request.args["h"])
+        except (KeyError, ValueError):
+            width = height = None
+
+        if Image is None or width is None or width <= 0 or height <= 0:
+            return self.files_cache.response(image_path)
+
+        width = round_up(width, RESIZE_STEP)
+        height = round_up(height, RESIZE_STEP)
+        cached_file = self.files_cache.get(image_path)
+
+        variant_key = image_path, cached_file.version, width, height
+        variant = self.variants.get(variant_key)
+        if variant is None:
+            try:
+                with Image.open(BytesIO(cached_file.content)) as image:
+                    image_format = image.format
+                    if getattr(image, "is_animated", False):
+                        # resizing would keep only the first frame
+                        resized_image = image
+                    else:
+                        resized_image = fit_image(image, width, height)
+
+                    if resized_image is image:
+                        # already smaller than requested, no need to re-encode it
+                        variant = cached_file.content
+                    else:
+                        variant = encode_image(resized_image, image_format)
+            except OSError:
+                # not an image pillow can decode (like svgs), served as it is
+                variant = cached_file.content
+
+            self.variants.put(variant_key, variant, len(variant))
+
+        return versioned_response(variant, cached_file.mimetype,
+                                  etag=f"{cached_file.version}-{width}x{height}",
+                                  version=cached_file.version)
+
+
+class SpriteAtlas:
+    """
+    All the images of the controls of a page packed in a single image, so they can be loaded in a
+    single request.
+
+    Each control gets a region of the atlas with its exact shape in grid cells, with its image
+    already fitted inside it. Positions and sizes are in grid cells, and the size in pixels of a
+    cell (the "unit") is chosen by the client, so the atlas matches the size of the page on screen.
+    """
+    def __init__(self, page, files_cache):
+        self.page = page
+        self.files_cache = files_cache
+
+        # regions of the atlas, by control id, as (col, row, width, height) in grid cells
+        self.regions = {}
+        self.width = 0
+        self.height = 0
+
+        self.pack_regions()
+
+    def pack_regions(self):
+        """
+        Place the controls in rows (shelves), from the tallest to the shortest, without going
+        wider than the page.
+        """
+        controls = sorted(
+            (control for control in self.page.controls
+             if control.image and self.can_include(control.image)),
+            key=lambda control: control.row_end - control.row,
+            reverse=True,
+        )
+
+        max_width = max([self.page.width] + [ctrl.col_end - ctrl.col for ctrl in controls])
+        shelf_col = shelf_row = shelf_height = 0
+
+        for control in controls:
+            width = control.col_end - control.col
+            height = control.row_end - control.row
+
+            if shelf_col + width > max_width:
+                shelf_row += shelf_height
+                shelf_col = shelf_height = 0
+
+            self.regions[control.id] = shelf_col, shelf_row, width, height
+            shelf_col += width
+            shelf_height = max(shelf_height, height)
+            self.width = max(self.width, shelf_col)
+
+        self.height = shelf_row + shelf_height
+
+    def can_include(self, image_path):
+        """
+        Check if an image can be part of the atlas. Images pillow can't decode (like svgs) and
+        animated images are left out, and served on their own instead.
+        """
+        try:
+            image_content = self.files_cache.get(image_path).content
+            with Image.open(BytesIO(image_content)) as image:
+                return not getattr(image, "is_animated", False)
+        except NotFound:
+            # still included, so the atlas changes if the image appears
+            return True
+        except OSError:
+            return False
+
+    @property
+    def version(self):
+        """
+        Version of the atlas, which changes when the layout or any of the images change.
+        """
+        parts = [f"{self.width}x{self.height}"]
+        for control in self.page.controls:
+            if control.id in self.regions:
+                parts.append(f"{control.id}:{self.files_cache.versioned_url(control.image)}")
+
+        return sha1(" ".join(parts).encode("utf-8")).hexdigest()[:16]
+
+    def render(self, unit):
+        """
+        Build the atlas image with a specific cell size in pixels, returning its png bytes.
+        """
+        atlas = Image.new("RGBA", (self.width * unit, self.height * unit))
+
+        for control in self.page.controls:
+            if control.id not in self.regions:
+                continue
+
+            col, row, width, height = self.regions[control.id]
+            try:
+                image_content = self.files_cache.get(control.image).content
+            except NotFound:
+                continue
+
+            try:
+                with Image.open(BytesIO(image_content)) as image:
+                    fitted_image = fit_image(image.convert("RGBA"), width * unit, height * unit,
+                                             enlarge=True)
+            except OSError as ex:
+                # not an image pillow can decode (like svgs), the rest of the atlas is still built
+                print(f"Can't include image {control.image} in the atlas of page "
+                      f"{self.page.name}: {ex}")
+                continue
+
+            # centered inside its region, like "contain" in css
+            x = col * unit + (width * unit - fitted_image.width) // 2
+            y = row * unit + (height * unit - fitted_image.height) // 2
+            atlas.paste(fitted_image, (x, y))
+
+        return encode_image(atlas, "PNG")
+
+
+class SpriteAtlasRenderer:
+    """
+    Serves the sprite atlases of pages, keeping the rendered ones in memory.
+    """
+    def __init__(self, files_cache, max_size=64 * 1024 * 1024):
+        self.files_cache = files_cache
+        self.atlases = BoundedCache(max_size)
+
+    def atlas_for(self, page):
+        """
+        Get the sprite atlas of a page, or None if the page doesn't use one (or can't).
+        """
+        if Image is None or not page.sprite_atlas:
+            return None
+
+        return SpriteAtlas(page, self.files_cache)
+
+    def response(self, page):
+        """
+        Build the response to serve the atlas of a page, in the cell size requested by the client
+        (unit url param).
+        """
+        atlas = self.atlas_for(page)
+        if atlas is None:
+            raise NotFound()
+
+        try:
+            unit = round_up(int(request.args["unit"]), ATLAS_UNIT_STEP, ATLAS_MAX_UNIT)
+        except (KeyError, ValueError):
+            unit = ATLAS_MAX_UNIT
+
+        version = atlas.version
+        atlas_key = page.name, version, unit
+        content = self.atlases.get(atlas_key)
+        if content is None:
+            content = atlas.render(unit)
+            self.atlases.put(atlas_key, content, len(content))
+
+        return versioned_response(content, "image/png", etag=f"{version}-{unit}", version=version)
@@ -1,6 +1,27 @@
+from collections import deque
+from threading import Condition, Lock, Thread
+from time import perf_counter, sleep
+
+from core import Simpyt
+from metrics import current_trace
+
+
+DEFAULT_TICK_RATE = 1000
+
+
 class BaseJoystick:
     """
     Base class for joystick implementations on different platforms.
+
+    Callers never touch the driver: their button and axis changes are queued, and a single output
+    thread per joystick applies them and sends a single report to the driver per tick, with all
+    the changes that happened during that tick.
+    A shadow copy of the state of the joystick is kept, so changes that don't really change
+    anything (like pressing an already pressed button) never reach the driver.
+
+    To implement a joystick on a new platform, inherit from this class and overwrite the driver
+    methods: set_button_state, set_axis_state and send_report, which are always called from the
+    output thread, and destroy (if the virtual device must be removed explicitly).
     """
 
     # these two should be defined to specify the list of supported buttons and axis. These names
@@ -22,28 +43,208 @@ class BaseJoystick:
         """
         # create any missing joysticks, including the requested one
         while len(cls._cache) < id_:
-            cls._cache.append(cls(id_))
+            cls._cache.append(cls(len(cls._cache) + 1))
 
         # return the requested joystick
         return cls._cache[id_ - 1]
 
-    def __init__(self, id_):
+    def __init__(self, id_, tick_rate=None):
         self.id = id_
 
+        if tick_rate is None:
+            if Simpyt.current is not None:
+                tick_rate = Simpyt.current.joysticks_tick_rate
+            else:
+                tick_rate = DEFAULT_TICK_RATE
+        self.tick_seconds = 1 / tick_rate
+
+        # the state of the joystick as requested by the callers, which might not be sent to the
+        # driver yet. Axes are None until they are moved for the first time
+        self._buttons_state = {number: False for number in range(1, len(self.BUTTONS) + 1)}
+        self._axes_state = {number: None for number in range(1, len(self.AXES) + 1)}
+
+        # changes waiting for the output thread. Button changes are kept in order, so quick
+        # presses and releases aren't lost. For axes, only the latest value of each axis matters
+        self._pending_buttons = deque()
+        self._pending_axes = {}
+        # traces of the interactions that caused the pending changes, to mark when they reach the
+        # driver (the output thread can't see them otherwise)
+        self._pending_traces = []
+        self._pending_condition = Condition()
+
+        # held while using the driver, so it's not destroyed in the middle of a report
+        self._driver_lock = Lock()
+        self._closed = False
+
+        self._output_thread = Thread(target=self._output_loop, daemon=True)
+        self._output_thread.start()
+
     def press_button(self, button_number):
         """
         Hold down a button.
         """
-        ...
+        self._change_button(button_number, True)
 
     def release_button(self, button_number):
         """
         Release a button.
         """
-        ...
+        self._change_button(button_number, False)
+
+    def _change_button(self, button_number, pressed):
+        """
+        Queue a change in the state of a button, if it really changes it.
+        """
+        with self._pending_condition:
+            if self._buttons_state.get(button_number) == pressed:
+                return
+
+            self._buttons_state[button_number] = pressed
+            self._pending_buttons.append((button_number, pressed))
+            self._queue_trace()
+            self._pending_condition.notify()
 
     def move_axis(self, axis_number, value):
         """
         Set the value of an axis, as a ratio from 0 to 1.
+        If the axis is moved again before the change is sent to the driver, only the latest value
+        is used.
+        """
+        if not 0 <= value <= 1:
+            raise ValueError(f"The value for axis {axis_number} in joystick {self.id} can't be "
+                             f"{value}, must be between 0 and 1")
+
+        with self._pending_condition:
+            if self._axes_state.get(axis_number) == value:
+                return
+
+            self._axes_state[axis_number] = value
+            self._pending_axes[axis_number] = value
+            self._queue_trace()
+            self._pending_condition.notify()
+
+    def _queue_trace(self):
+        """
+        Keep the trace of the interaction being handled (if any), to mark it once the pending
+        changes are sent. Must be called while holding the pending condition.
+        """
+        trace = current_trace.get()
+        if trace is not None:
+            self._pending_traces.append(trace)
+
+    def snapshot(self):
+        """
+        Get a copy of the current state of the joystick, without touching the driver. Returns a
+        dict with the id of the joystick, and the state of its buttons (pressed or not) and axes
+        (value from 0 to 1, or None if never moved) by number.
+        """
+        with self._pending_condition:
+            return dict(
+                id=self.id,
+                buttons=dict(self._buttons_state),
+                axes=dict(self._axes_state),
+            )
+
+    @classmethod
+    def snapshots(cls):
+        """
+        Get a copy of the current state of all the defined joysticks.
+        """
+        return [joystick.snapshot() for joystick in cls._cache]
+
+    def close(self):
+        """
+        Stop using the joystick, removing its virtual device. Changes made after closing it are
+        ignored.
+        """
+        with self._driver_lock:
+            if not self._closed:
+                self._closed = True
+                self.destroy()
+
+    @classmethod
+    def close_all(cls):
+        """
+        Close all the defined joysticks.
+        """
+        for joystick in cls._cache:
+            try:
+                joystick.close()
+            except Exception as ex:
+                print(f"Error closing joystick {joystick.id}: {ex}")
+
+    def set_button_state(self, button_number, pressed):
+        """
+        Driver method: set the state of a button, without sending it yet.
+        """
+        ...
+
+    def set_axis_state(self, axis_number, value):
+        """
+        Driver method: set the value of an axis, without sending it yet.
+        """
+        ...
+
+    def send_report(self):
+        """
+        Driver method: send all the state changes made since the last report.
+        """
+        ...
+
+    def destroy(self):
+        """
+        Driver method: remove the virtual device.
         """
         ...
+
+    def _output_loop(self):
+        """
+        Keep applying the pending changes and sending them to the driver, at most once per tick.
+        Sleeps until there's something to do.
+        """
+        while True:
+            with self._pending_condition:
+                self._pending_condition.wait_for(
+                    lambda: self._pending_buttons or self._pending_axes
+                )
+                pending_buttons, self._pending_buttons = self._pending_buttons, deque()
+                pending_axes, self._pending_axes = self._pending_axes, {}
+                pending_traces, self._pending_traces = self._pending_traces, []
+
+            tick_end = perf_counter() + self.tick_seconds
+
+            with self._driver_lock:
+                if self._closed:
+                    return
+
+                try:
+                    self._apply(pending_buttons, pending_axes)
+                except Exception as ex:
+                    print(f"Error updating joystick {self.id}: {ex}")
+                else:
+                    for trace in pending_traces:
+                        trace.mark("backend")
+
+            remaining = tick_end - perf_counter()
+            if remaining > 0:
+                sleep(remaining)
+
+    def _apply(self, pending_buttons, pending_axes):
+        """
+        Apply a batch of changes to the driver, in as few reports as possible.
+        """
+        changed_buttons = set()
+        for button_number, pressed in pending_buttons:
+            if button_number in changed_buttons:
+                # the button changed twice in this batch (a quick press and release), send the
+                # first change before applying the second one, or it would be lost
+                self.send_report()
+                changed_buttons.clear()
+
+            self.set_button_state(button_number, pressed)
+            changed_buttons.add(button_number)
+
+        for axis_number, value in pending_axes.items():
+            self.set_axis_state(axis_number, value)
+
+        self.send_report()
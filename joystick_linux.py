@@ -1,63 +1,223 @@
+import fcntl
+import os
+import struct
+
+from core import ImproperlyConfiguredException
 from joystick_base import BaseJoystick
-# TODO import some linux virtual joystick lib
+
+
+# constants from the linux kernel headers (input-event-codes.h and uinput.h)
+EV_SYN = 0x00
+EV_KEY = 0x01
+EV_ABS = 0x03
+SYN_REPORT = 0
+
+UI_SET_EVBIT = 0x40045564
+UI_SET_KEYBIT = 0x40045565
+UI_SET_ABSBIT = 0x40045567
+UI_DEV_CREATE = 0x5501
+UI_DEV_DESTROY = 0x5502
+
+BUS_VIRTUAL = 0x06
+ABS_CNT = 64
+
+# struct input_event: a timeval (filled by the kernel), type, code and value
+INPUT_EVENT_FORMAT = "llHHi"
+INPUT_EVENT_SIZE = struct.calcsize(INPUT_EVENT_FORMAT)
+# struct uinput_user_dev: name, input_id (bus, vendor, product, version), ff_effects_max, and
+# the absmax, absmin, absfuzz and absflat arrays
+UINPUT_USER_DEV_FORMAT = f"80sHHHHi{ABS_CNT}i{ABS_CNT}i{ABS_CNT}i{ABS_CNT}i"
+
+
+class UinputFile:
+    """
+    The /dev/uinput file, used to create virtual input devices in linux.
+    """
+    PATH = "/dev/uinput"
+
+    def __init__(self):
+        try:
+            self.fd = os.open(self.PATH, os.O_WRONLY | os.O_NONBLOCK)
+        except FileNotFoundError as ex:
+            raise ImproperlyConfiguredException(
+                f"Simpyt needs {self.PATH} to create virtual joysticks, but it doesn't exist. "
+                "You might need to load the uinput kernel module (sudo modprobe uinput)."
+            ) from ex
+        except PermissionError as ex:
+            raise ImproperlyConfiguredException(
+                f"Simpyt needs write permissions on {self.PATH} to create virtual joysticks. "
+                "You can add a udev rule to give them to your user, or run Simpyt as root."
+            ) from ex
+
+    def ioctl(self, request, arg=0):
+        """
+        Run an ioctl request.
+        """
+        fcntl.ioctl(self.fd, request, arg)
+
+    def write(self, data):
+        """
+        Write raw bytes.
+        """
+        os.write(self.fd, data)
+
+    def close(self):
+        """
+        Close the file.
+        """
+        os.close(self.fd)
+
+
+class RecordingUinputFile:
+    """
+    A stand-in for the /dev/uinput file, that doesn't create any device and instead records the
+    ioctl requests and the frames of events written to it. Useful for tests.
+    Each frame is a list of (type, code, value) tuples, the events sent in a single SYN_REPORT.
+    """
+    def __init__(self):
+        self.ioctls = []
+        self.device_setup = None
+        self.frames = []
+        self.closed = False
+
+    def ioctl(self, request, arg=0):
+        """
+        Record an ioctl request.
+        """
+        self.ioctls.append((request, arg))
+
+    def write(self, data):
+        """
+        Record the written data, either the device setup or frames of events.
+        """
+        if self.device_setup is None:
+            self.device_setup = struct.unpack(UINPUT_USER_DEV_FORMAT, data)
+            return
+
+        frame = []
+        for offset in range(0, len(data), INPUT_EVENT_SIZE):
+            _, _, type_, code, value = struct.unpack_from(INPUT_EVENT_FORMAT, data, offset)
+            if type_ == EV_SYN and code == SYN_REPORT:
+                self.frames.append(frame)
+                frame = []
+            else:
+                frame.append((type_, code, value))
+
+    def close(self):
+        """
+        Mark the file as closed.
+        """
+        self.closed = True
 
 
 class Joystick(BaseJoystick):
     """
-    Wrapper around ??? to have a unified Joystick interface in both linux and windows.
+    Virtual joystick created through the linux uinput module, to have a unified Joystick interface
+    in both linux and windows.
+    Events are written straight to the device, and all the changes of each report are grouped
+    under a single SYN_REPORT.
     """
-    # using the vgamepad lib, define the buttons and axes it supports
+    # class used to access /dev/uinput, can be replaced with RecordingUinputFile in tests
+    UINPUT_FILE_CLASS = UinputFile
 
-    # conversion from button number (1 to ??) to the internal ??? button id
+    # conversion from button number (1 to 15) to the linux button codes
     BUTTONS = (
-        "sample_fake_button_1",
-        "sample_fake_button_2",
-        "sample_fake_button_3",
-        "sample_fake_button_4",
-        "sample_fake_button_5",
-        "sample_fake_button_6",
-        "sample_fake_button_7",
-        "sample_fake_button_8",
-        "sample_fake_button_9",
-        "sample_fake_button_10",
-        "sample_fake_button_11",
-        "sample_fake_button_12",
-        "sample_fake_button_13",
-        "sample_fake_button_14",
-        "sample_fake_button_15",
+        0x120,  # BTN_TRIGGER
+        0x121,  # BTN_THUMB
+        0x122,  # BTN_THUMB2
+        0x123,  # BTN_TOP
+        0x124,  # BTN_TOP2
+        0x125,  # BTN_PINKIE
+        0x126,  # BTN_BASE
+        0x127,  # BTN_BASE2
+        0x128,  # BTN_BASE3
+        0x129,  # BTN_BASE4
+        0x12a,  # BTN_BASE5
+        0x12b,  # BTN_BASE6
+        0x2c0,  # BTN_TRIGGER_HAPPY1
+        0x2c1,  # BTN_TRIGGER_HAPPY2
+        0x2c2,  # BTN_TRIGGER_HAPPY3
     )
 
-    # conversion from axis number (1 to ??) to the internal ??? axis name
+    # conversion from axis number (1 to 5) to the linux axis codes
     AXES = (
-        "sample_fake_axis_1",
-        "sample_fake_axis_2",
-        "sample_fake_axis_3",
-        "sample_fake_axis_4",
-        "sample_fake_axis_5",
+        0x00,  # ABS_X
+        0x01,  # ABS_Y
+        0x02,  # ABS_Z
+        0x03,  # ABS_RX
+        0x04,  # ABS_RY
     )
 
+    # range of raw values for the axes, a 0 to 1 ratio is mapped to this range
+    AXIS_MAX = 65535
+
     def __init__(self, id_):
+        self.uinput = self.UINPUT_FILE_CLASS()
+        self.create_device(f"Simpyt virtual joystick {id_}")
+
+        # events waiting for the next report. Only used from the output thread
+        self.frame = []
+
         super().__init__(id_)
-        self.pad = None
 
-    def press_button(self, button_number):
+    def create_device(self, name):
         """
-        Hold down a button.
+        Register the buttons and axes we use, and create the virtual device.
         """
-        print("TODO: hold button", button_number)
+        self.uinput.ioctl(UI_SET_EVBIT, EV_KEY)
+        for button_code in self.BUTTONS:
+            self.uinput.ioctl(UI_SET_KEYBIT, button_code)
+
+        self.uinput.ioctl(UI_SET_EVBIT, EV_ABS)
+        for axis_code in self.AXES:
+            self.uinput.ioctl(UI_SET_ABSBIT, axis_code)
 
-    def release_button(self, button_number):
+        abs_max = [0] * ABS_CNT
+        abs_min = [0] * ABS_CNT
+        abs_fuzz = [0] * ABS_CNT
+        abs_flat = [0] * ABS_CNT
+        for axis_code in self.AXES:
+            abs_max[axis_code] = self.AXIS_MAX
+
+        device_setup = struct.pack(
+            UINPUT_USER_DEV_FORMAT,
+            name.encode("utf-8")[:79],
+            BUS_VIRTUAL, 0x1209, 0x5170, 1,  # bus, vendor, product, version
+            0,  # ff_effects_max
+            *abs_max, *abs_min, *abs_fuzz, *abs_flat,
+        )
+        self.uinput.write(device_setup)
+        self.uinput.ioctl(UI_DEV_CREATE)
+
+    def set_button_state(self, button_number, pressed):
         """
-        Release a button.
+        Set the state of a button, without sending it yet.
         """
-        print("TODO: release button", button_number)
+        self.frame.append((EV_KEY, self.BUTTONS[button_number - 1], int(pressed)))
 
-    def move_axis(self, axis_number, value):
+    def set_axis_state(self, axis_number, value):
         """
-        Set the value of an axis, as a ratio from 0 to 1.
+        Set the value of an axis, without sending it yet.
         """
-        if not 0 <= value <= 1:
-            raise ValueError("The value for axis {axis_number} in joystick {self.id} can't be "
-                             f"{value}, must be between 0 and 1")
+        self.frame.append((EV_ABS, self.AXES[axis_number - 1], round(value * self.AXIS_MAX)))
 
-        print("TODO: move axis", axis_number, "to value", value)
+    def send_report(self):
+        """
+        Send all the state changes made since the last report, in a single write.
+        """
+        if not self.frame:
+            return
+
+        self.frame.append((EV_SYN, SYN_REPORT, 0))
+        self.uinput.write(b"".join(
+            struct.pack(INPUT_EVENT_FORMAT, 0, 0, type_, code, value)
+            for type_, code, value in self.frame
+        ))
+        self.frame = []
+
+    def destroy(self):
+        """
+        Remove the virtual device, and close /dev/uinput.
+        """
+        self.uinput.ioctl(UI_DEV_DESTROY)
+        self.uinput.close()
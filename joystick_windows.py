@@ -37,34 +37,26 @@ class Joystick(BaseJoystick):
     )
 
     def __init__(self, id_):
-        super().__init__(id_)
         self.pad = VX360Gamepad()
-        # using the same names from vgamepad, to make things easier
+        # using the same names from vgamepad, to make things easier. Only used from the output
+        # thread
         self.current_params_left_joystick_float = dict(x_value_float=-1, y_value_float=1)
         self.current_params_right_joystick_float = dict(x_value_float=-1, y_value_float=1)
+        super().__init__(id_)
 
-    def press_button(self, button_number):
-        """
-        Hold down a button.
-        """
-        self.pad.press_button(button=self.BUTTONS[button_number - 1])
-        self.pad.update()
-
-    def release_button(self, button_number):
+    def set_button_state(self, button_number, pressed):
         """
-        Release a button.
+        Set the state of a button, without sending it yet.
         """
-        self.pad.release_button(button=self.BUTTONS[button_number - 1])
-        self.pad.update()
+        if pressed:
+            self.pad.press_button(button=self.BUTTONS[button_number - 1])
+        else:
+            self.pad.release_button(button=self.BUTTONS[button_number - 1])
 
-    def move_axis(self, axis_number, value):
+    def set_axis_state(self, axis_number, value):
         """
-        Set the value of an axis, as a ratio from 0 to 1.
+        Set the value of an axis, without sending it yet.
         """
-        if not 0 <= value <= 1:
-            raise ValueError("The value for axis {axis_number} in joystick {self.id} can't be "
-                             f"{value}, must be between 0 and 1")
-
         axis_name = self.AXES[axis_number - 1]
         if ":" in axis_name:
             value = value * 2 - 1
@@ -74,7 +66,6 @@ class Joystick(BaseJoystick):
             current_params = getattr(self, f"current_params_{axis_name}")
             current_params[param] = value
             getattr(self.pad, axis_name)(**current_params)
-            self.pad.update()
         else:
             if value >= 0.5:
                 # first half
@@ -84,4 +75,9 @@ class Joystick(BaseJoystick):
                 # second half
                 self.pad.left_trigger_float(value_float=0)
                 self.pad.right_trigger_float(value_float=1 - value * 2)
-            self.pad.update()
+
+    def send_report(self):
+        """
+        Send all the state changes made since the last report.
+        """
+        self.pad.update()
@@ -0,0 +1,104 @@
+from threading import Lock
+from time import perf_counter
+
+from metrics import mark
+
+
+class BaseKeyboard:
+    """
+    Base class for keyboard implementations on different platforms.
+
+    Keys are sent in batches: all the key events of a chord (like "ctrlright shiftright h") are
+    injected into the system in a single call, so they arrive together and in order, instead of
+    one round trip per key.
+
+    To implement a keyboard on a new platform, inherit from this class and overwrite the driver
+    methods: send_events and write. They are never called from more than one thread at a time.
+    """
+
+    # the keyboard in use, created when first needed
+    _current = None
+    _current_lock = Lock()
+
+    @classmethod
+    def get(cls):
+        """
+        Get the keyboard, creating it if it wasn't used before.
+        """
+        with cls._current_lock:
+            if cls._current is None:
+                cls._current = cls()
+
+            return cls._current
+
+    def __init__(self):
+        self._send_lock = Lock()
+
+    def press_keys(self, keys):
+        """
+        Hold down a list of keys, in order, in a single batch.
+        """
+        self.send_batch([(key, True) for key in keys])
+
+    def release_keys(self, keys):
+        """
+        Release a list of keys, in reverse order, in a single batch.
+        """
+        self.send_batch([(key, False) for key in reversed(keys)])
+
+    def send_batch(self, events):
+        """
+        Send a batch of key events, a list of (key, pressed) tuples.
+        """
+        if not events:
+            return
+
+        mark("backend")
+        with self._send_lock:
+            self.send_events(events)
+
+    def type_text(self, text, interval=0):
+        """
+        Type a text, character by character, with an interval in seconds between characters.
+        """
+        mark("backend")
+        with self._send_lock:
+            self.write(text, interval)
+
+    def send_events(self, events):
+        """
+        Driver method: inject a batch of key events, a list of (key, pressed) tuples, into the
+        system at once.
+        """
+        ...
+
+    def write(self, text, interval):
+        """
+        Driver method: type a text, with an interval in seconds between characters.
+        """
+        ...
+
+
+class RecordingKeyboard(BaseKeyboard):
+    """
+    A keyboard that doesn't send anything to the system, and instead records the batches of key
+    events sent to it, with the time at which they were sent. Useful for tests.
+    Each batch is a (timestamp, events) tuple, with events being a list of (key, pressed) tuples.
+    Written texts are recorded as (timestamp, text, interval) tuples.
+    """
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+        self.texts = []
+
+    def send_events(self, events):
+        """
+        Record a batch of key events.
+        """
+        self.batches.append((perf_counter(), list(events)))
+
+    def write(self, text, interval):
+        """
+        Record a written text.
+        """
+        self.texts.append((perf_counter(), text, interval))
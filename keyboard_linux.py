@@ -0,0 +1,129 @@
+from core import ImproperlyConfiguredException
+from keyboard_base import BaseKeyboard
+
+
+# conversion from the key names we use to X keysym names
+KEYSYMS = {
+    # top row
+    "escape": "Escape",
+    "esc": "Escape",
+    **{f"f{number}": f"F{number}" for number in range(1, 25)},
+    "printscreen": "Print",
+    "prntscrn": "Print",
+    "prtsc": "Print",
+    "prtscr": "Print",
+    "pause": "Pause",
+
+    # normal keys
+    **{char: char for char in "0123456789abcdefghijklmnopqrstuvwxyz"},
+    ";": "semicolon",
+    ",": "comma",
+    ".": "period",
+    "\\": "backslash",
+    "/": "slash",
+    "'": "apostrophe",
+    "[": "bracketleft",
+    "]": "bracketright",
+    "-": "minus",
+    "=": "equal",
+    "`": "grave",
+
+    # navigation block and spaces
+    "enter": "Return",
+    "return": "Return",
+    "space": "space",
+    "tab": "Tab",
+    "backspace": "BackSpace",
+    "del": "Delete",
+    "delete": "Delete",
+    "insert": "Insert",
+    "home": "Home",
+    "end": "End",
+    "pagedown": "Next",
+    "pgdn": "Next",
+    "pageup": "Prior",
+    "pgup": "Prior",
+    "up": "Up",
+    "down": "Down",
+    "left": "Left",
+    "right": "Right",
+
+    # numpad
+    **{f"num{number}": f"KP_{number}" for number in range(10)},
+
+    # modifiers
+    "shift": "Shift_L",
+    "shiftleft": "Shift_L",
+    "shiftright": "Shift_R",
+    "ctrl": "Control_L",
+    "ctrlleft": "Control_L",
+    "ctrlright": "Control_R",
+    "alt": "Alt_L",
+    "altleft": "Alt_L",
+    "altright": "Alt_R",
+    "win": "Super_L",
+    "winleft": "Super_L",
+    "winright": "Super_R",
+}
+
+
+class Keyboard(BaseKeyboard):
+    """
+    Keyboard that injects the key events with the XTest extension of the X server.
+    All the events of a batch are queued in the X connection and flushed together in a single
+    round trip.
+    """
+    def __init__(self):
+        super().__init__()
+
+        # imported here so Simpyt can be used without an X server, if no keys are ever sent
+        from Xlib import X, XK, display
+        from Xlib.error import DisplayError
+        from Xlib.ext import xtest
+
+        self.X = X
+        self.fake_input = xtest.fake_input
+
+        try:
+            self.display = display.Display()
+        except DisplayError as ex:
+            raise ImproperlyConfiguredException(
+                "Simpyt needs an X server to send keys, but couldn't connect to one. Check that "
+                "the DISPLAY environment variable is set."
+            ) from ex
+
+        if not self.display.has_extension("XTEST"):
+            raise ImproperlyConfiguredException(
+                "Simpyt needs the XTEST extension of the X server to send keys, but it's not "
+                "available."
+            )
+
+        # keys that don't exist in the current keyboard layout get no keycode, and are ignored
+        self.keycodes = {}
+        for key, keysym_name in KEYSYMS.items():
+            keycode = self.display.keysym_to_keycode(XK.string_to_keysym(keysym_name))
+            if keycode:
+                self.keycodes[key] = keycode
+
+    def send_events(self, events):
+        """
+        Inject a batch of key events at once.
+        """
+        for key, pressed in events:
+            keycode = self.keycodes.get(key)
+            if keycode is None:
+                continue
+
+            event_type = self.X.KeyPress if pressed else self.X.KeyRelease
+            self.fake_input(self.display, event_type, keycode)
+
+        self.display.sync()
+
+    def write(self, text, interval):
+        """
+        Type a text, with an interval in seconds between characters.
+        """
+        import pyautogui
+        # pyautogui sleeps after every call by default, but the pacing is up to us
+        pyautogui.PAUSE = 0
+        pyautogui.write(text, interval=interval)
@@ -0,0 +1,174 @@
+import ctypes
+from ctypes import wintypes
+
+from keyboard_base import BaseKeyboard
+
+
+# constants from the windows headers (winuser.h)
+INPUT_KEYBOARD = 1
+KEYEVENTF_EXTENDEDKEY = 0x0001
+KEYEVENTF_KEYUP = 0x0002
+KEYEVENTF_SCANCODE = 0x0008
+
+# conversion from the key names we use to keyboard scan codes, which unlike virtual key codes are
+# understood by games reading the keyboard with DirectInput. Codes starting with 0xE0 are
+# extended keys
+SCAN_CODES = {
+    # top row
+    "escape": 0x01,
+    "esc": 0x01,
+    **{f"f{number}": 0x3A + number for number in range(1, 11)},
+    "f11": 0x57,
+    "f12": 0x58,
+    **{f"f{number}": 0x64 + number - 13 for number in range(13, 24)},
+    "f24": 0x76,
+    "printscreen": 0xE037,
+    "prntscrn": 0xE037,
+    "prtsc": 0xE037,
+    "prtscr": 0xE037,
+
+    # normal keys
+    **{char: 0x02 + index for index, char in enumerate("1234567890")},
+    **{char: 0x10 + index for index, char in enumerate("qwertyuiop")},
+    **{char: 0x1E + index for index, char in enumerate("asdfghjkl")},
+    **{char: 0x2C + index for index, char in enumerate("zxcvbnm")},
+    ";": 0x27,
+    ",": 0x33,
+    ".": 0x34,
+    "\\": 0x2B,
+    "/": 0x35,
+    "'": 0x28,
+    "[": 0x1A,
+    "]": 0x1B,
+    "-": 0x0C,
+    "=": 0x0D,
+    "`": 0x29,
+
+    # navigation block and spaces
+    "enter": 0x1C,
+    "return": 0x1C,
+    "space": 0x39,
+    "tab": 0x0F,
+    "backspace": 0x0E,
+    "del": 0xE053,
+    "delete": 0xE053,
+    "insert": 0xE052,
+    "home": 0xE047,
+    "end": 0xE04F,
+    "pagedown": 0xE051,
+    "pgdn": 0xE051,
+    "pageup": 0xE049,
+    "pgup": 0xE049,
+    "up": 0xE048,
+    "down": 0xE050,
+    "left": 0xE04B,
+    "right": 0xE04D,
+
+    # numpad
+    "num0": 0x52,
+    "num1": 0x4F,
+    "num2": 0x50,
+    "num3": 0x51,
+    "num4": 0x4B,
+    "num5": 0x4C,
+    "num6": 0x4D,
+    "num7": 0x47,
+    "num8": 0x48,
+    "num9": 0x49,
+
+    # modifiers
+    "shift": 0x2A,
+    "shiftleft": 0x2A,
+    "shiftright": 0x36,
+    "ctrl": 0x1D,
+    "ctrlleft": 0x1D,
+    "ctrlright": 0xE01D,
+    "alt": 0x38,
+    "altleft": 0x38,
+    "altright": 0xE038,
+    "win": 0xE05B,
+    "winleft": 0xE05B,
+    "winright": 0xE05C,
+}
+
+# keys without a simple scan code, sent with their virtual key codes instead
+VIRTUAL_KEY_CODES = {
+    "pause": 0x13,
+}
+
+
+class KEYBDINPUT(ctypes.Structure):
+    _fields_ = [
+        ("wVk", wintypes.WORD),
+        ("wScan", wintypes.WORD),
+        ("dwFlags", wintypes.DWORD),
+        ("time", wintypes.DWORD),
+        ("dwExtraInfo", ctypes.c_size_t),
+    ]
+
+
+class MOUSEINPUT(ctypes.Structure):
+    # not used, but needed so the INPUT struct has the size windows expects
+    _fields_ = [
+        ("dx", wintypes.LONG),
+        ("dy", wintypes.LONG),
+        ("mouseData", wintypes.DWORD),
+        ("dwFlags", wintypes.DWORD),
+        ("time", wintypes.DWORD),
+        ("dwExtraInfo", ctypes.c_size_t),
+    ]
+
+
+class INPUT(ctypes.Structure):
+    class _INPUT(ctypes.Union):
+        _fields_ = [("ki", KEYBDINPUT), ("mi", MOUSEINPUT)]
+
+    _anonymous_ = ("_input",)
+    _fields_ = [("type", wintypes.DWORD), ("_input", _INPUT)]
+
+
+def build_input(key, pressed):
+    """
+    Build the INPUT struct for a key event.
+    """
+    flags = 0 if pressed else KEYEVENTF_KEYUP
+
+    if key in VIRTUAL_KEY_CODES:
+        keyboard_input = KEYBDINPUT(wVk=VIRTUAL_KEY_CODES[key], dwFlags=flags)
+    else:
+        scan_code = SCAN_CODES[key]
+        flags |= KEYEVENTF_SCANCODE
+        if scan_code & 0xE000 == 0xE000:
+            flags |= KEYEVENTF_EXTENDEDKEY
+        keyboard_input = KEYBDINPUT(wScan=scan_code & 0xFF, dwFlags=flags)
+
+    return INPUT(type=INPUT_KEYBOARD, ki=keyboard_input)
+
+
+class Keyboard(BaseKeyboard):
+    """
+    Keyboard that injects the key events with the SendInput function of windows.
+    All the events of a batch are sent in a single SendInput call, so windows inserts them in the
+    input stream together, without events from other sources in between.
+    """
+    def __init__(self):
+        super().__init__()
+        self.send_input = ctypes.windll.user32.SendInput
+
+    def send_events(self, events):
+        """
+        Inject a batch of key events at once.
+        """
+        inputs = (INPUT * len(events))(*(build_input(key, pressed) for key, pressed in events))
+        sent = self.send_input(len(events), inputs, ctypes.sizeof(INPUT))
+        if sent != len(events):
+            raise ctypes.WinError()
+
+    def write(self, text, interval):
+        """
+        Type a text, with an interval in seconds between characters.
+        """
+        import pydirectinput
+        # pydirectinput sleeps after every call by default, but the pacing is up to us
+        pydirectinput.PAUSE = 0
+        pydirectinput.write(text, interval=interval)
@@ -0,0 +1,203 @@
+from collections import deque
+from threading import Condition, Lock, Thread
+from time import perf_counter, time
+import platform
+import shlex
+import subprocess
+
+from core import Simpyt
+from metrics import Metrics, mark
+
+
+PLATFORM = platform.system()
+
+# characters that only mean something to a shell, so commands using them need one
+if PLATFORM == "Windows":
+    SHELL_CHARS = set("&|<>^%")
+else:
+    SHELL_CHARS = set("&|<>;$`*?[]{}()~!#\n")
+
+DEFAULT_MAX_PROCESSES = 16
+DEFAULT_MAX_PROCESSES_PER_COMMAND = 2
+
+
+def needs_shell(command):
+    """
+    Does this command use any syntax that only a shell understands?
+    """
+    return any(char in SHELL_CHARS for char in command)
+
+
+def split_command(command):
+    """
+    Get the arguments to launch a command without a shell, or None if it needs one.
+    """
+    if needs_shell(command):
+        return None
+
+    if PLATFORM == "Windows":
+        # windows parses the command line itself, and shlex would break paths with backslashes
+        return command
+
+    try:
+        return shlex.split(command)
+    except ValueError:
+        # unbalanced quotes or similar, let the shell complain about it
+        return None
+
+
+class Launch:
+    """
+    A single launch of a command, with its process and info about how it went.
+    """
+    def __init__(self, command, process, shell, launch_seconds):
+        self.command = command
+        self.process = process
+        self.shell = shell
+        self.launch_seconds = launch_seconds
+
+        self.started_at = time()
+        self.ended_at = None
+        self.exit_code = None
+
+    def snapshot(self):
+        """
+        Get a summary of the launch.
+        """
+        return dict(
+            command=self.command,
+            pid=self.process.pid,
+            shell=self.shell,
+            launch_seconds=self.launch_seconds,
+            started_at=self.started_at,
+            ended_at=self.ended_at,
+            exit_code=self.exit_code,
+        )
+
+
+class Launcher:
+    """
+    Launches the commands of run actions, without a shell when they don't need one, and limiting
+    how many processes can be running at once, both in total and for each command.
+    Finished processes are reaped by a single background thread, so they don't linger as
+    zombies. The last launches are kept, with their launch latency and exit code.
+    """
+
+    # time between checks for finished processes
+    REAP_INTERVAL = 0.2
+    # amount of finished launches kept
+    HISTORY_SIZE = 100
+
+    # the launcher in use, created when first needed
+    _current = None
+    _current_lock = Lock()
+
+    @classmethod
+    def get(cls):
+        """
+        Get the launcher, creating it if it wasn't used before.
+        """
+        with cls._current_lock:
+            if cls._current is None:
+                cls._current = cls()
+
+            return cls._current
+
+    def __init__(self, max_processes=None, max_processes_per_command=None):
+        if max_processes is None:
+            if Simpyt.current is not None:
+                max_processes = Simpyt.current.max_processes
+            else:
+                max_processes = DEFAULT_MAX_PROCESSES
+        if max_processes_per_command is None:
+            if Simpyt.current is not None:
+                max_processes_per_command = Simpyt.current.max_processes_per_command
+            else:
+                max_processes_per_command = DEFAULT_MAX_PROCESSES_PER_COMMAND
+
+        self.max_processes = max_processes
+        self.max_processes_per_command = max_processes_per_command
+
+        self.running = []
+        self.finished = deque(maxlen=self.HISTORY_SIZE)
+        self.condition = Condition()
+
+        self.reaper_thread = Thread(target=self._reap_loop, daemon=True, name="launcher_reaper")
+        self.reaper_thread.start()
+
+    def launch(self, command, args=None):
+        """
+        Launch a command, if the limits allow it. The arguments to run it without a shell can be
+        specified (see split_command), otherwise it's ran in a shell.
+        Returns the Launch, or None if the limits didn't allow it.
+        """
+        with self.condition:
+            if len(self.running) >= self.max_processes:
+                print(f"Not running command, too many processes running already: {command}")
+                return None
+
+            same_command = sum(1 for launch in self.running if launch.command == command)
+            if same_command >= self.max_processes_per_command:
+                print(f"Not running command, it's already running {same_command} times: {command}")
+                return None
+
+            started_at = perf_counter()
+            shell = args is None
+            if shell:
+                process = subprocess.Popen(command, shell=True)
+            else:
+                try:
+                    process = subprocess.Popen(args)
+                except FileNotFoundError:
+                    # not a program, maybe something the shell knows (a builtin, an alias, etc)
+                    shell = True
+                    process = subprocess.Popen(command, shell=True)
+
+            launch = Launch(command, process, shell, perf_counter() - started_at)
+            self.running.append(launch)
+            self.condition.notify()
+
+        mark("backend")
+        Metrics.get().observe("simpyt_command_launch_seconds", launch.launch_seconds,
+                              shell=str(shell).lower())
+
+        return launch
+
+    def _reap_loop(self):
+        """
+        Keep checking for finished processes, sleeping while none are running.
+        """
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.running)
+                self._reap()
+                self.condition.wait(self.REAP_INTERVAL)
+
+    def _reap(self):
+        """
+        Collect the exit codes of the finished processes.
+        """
+        still_running = []
+        for launch in self.running:
+            exit_code = launch.process.poll()
+            if exit_code is None:
+                still_running.append(launch)
+            else:
+                launch.exit_code = exit_code
+                launch.ended_at = time()
+                self.finished.append(launch)
+
+                if exit_code != 0 and Simpyt.current is not None and Simpyt.current.debug:
+                    print(f"Command finished with exit code {exit_code}: {launch.command}")
+
+        self.running = still_running
+
+    def snapshot(self):
+        """
+        Get a summary of the running processes, and the last finished ones.
+        """
+        with self.condition:
+            return dict(
+                running=[launch.snapshot() for launch in self.running],
+                finished=[launch.snapshot() for launch in self.finished],
+            )
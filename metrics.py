@@ -0,0 +1,186 @@
+from bisect import bisect_left
+from contextvars import ContextVar
+from threading import Lock
+from time import perf_counter
+
+
+# upper bounds of the histograms buckets, in seconds
+BUCKETS = (
+    0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5,
+    1, 2.5, 5,
+)
+
+# the trace of the interaction being handled in the current thread or coroutine, if any
+current_trace = ContextVar("current_trace", default=None)
+
+
+class Histogram:
+    """
+    Counts of observed values in buckets, plus their total sum, like prometheus histograms.
+    """
+    def __init__(self):
+        self.bucket_counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        """
+        Count a value.
+        """
+        bucket_index = bisect_left(BUCKETS, value)
+        if bucket_index < len(BUCKETS):
+            self.bucket_counts[bucket_index] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Metrics:
+    """
+    Histograms of the latencies and durations measured in Simpyt, that can be exported in the
+    prometheus text format.
+    Each metric has several histograms, one for each combination of labels used.
+    """
+    HELP = {
+        "simpyt_interaction_stage_seconds": "Time from receiving an interaction (midi message or "
+                                            "page button event) to reaching each stage of its "
+                                            "handling.",
+        "simpyt_wait_overshoot_seconds": "How late waits ended, compared to the requested time.",
+        "simpyt_command_launch_seconds": "Time spent launching the processes of run actions.",
+    }
+
+    # the metrics in use, created when first needed
+    _current = None
+    _current_lock = Lock()
+
+    @classmethod
+    def get(cls):
+        """
+        Get the metrics, creating them if they weren't used before.
+        """
+        with cls._current_lock:
+            if cls._current is None:
+                cls._current = cls()
+
+            return cls._current
+
+    def __init__(self):
+        # histograms by metric name, and then by labels (a tuple of (name, value) pairs)
+        self.histograms = {}
+        self.lock = Lock()
+
+    def observe(self, metric_name, value, **labels):
+        """
+        Count a value in the histogram of a metric with specific labels.
+        """
+        labels_key = tuple(sorted(labels.items()))
+        with self.lock:
+            metric_histograms = self.histograms.setdefault(metric_name, {})
+            histogram = metric_histograms.get(labels_key)
+            if histogram is None:
+                histogram = metric_histograms[labels_key] = Histogram()
+
+            histogram.observe(value)
+
+    def render(self):
+        """
+        Export all the metrics in the prometheus text format.
+        """
+        lines = []
+        with self.lock:
+            for metric_name, metric_histograms in sorted(self.histograms.items()):
+                lines.append(f"# HELP {metric_name} {self.HELP.get(metric_name, metric_name)}")
+                lines.append(f"# TYPE {metric_name} histogram")
+
+                for labels_key, histogram in sorted(metric_histograms.items()):
+                    cumulative_count = 0
+                    for upper_bound, bucket_count in zip(BUCKETS, histogram.bucket_counts):
+                        cumulative_count += bucket_count
+                        bucket_labels = format_labels(labels_key + (("le", str(upper_bound)),))
+                        lines.append(f"{metric_name}_bucket{bucket_labels} {cumulative_count}")
+
+                    bucket_labels = format_labels(labels_key + (("le", "+Inf"),))
+                    lines.append(f"{metric_name}_bucket{bucket_labels} {histogram.count}")
+                    lines.append(f"{metric_name}_sum{format_labels(labels_key)} {histogram.sum}")
+                    lines.append(f"{metric_name}_count{format_labels(labels_key)} {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels_key):
+    """
+    Format labels for the prometheus text format.
+    """
+    if not labels_key:
+        return ""
+
+    formatted_labels = []
+    for name, value in labels_key:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        formatted_labels.append(f'{name}="{value}"')
+
+    return "{" + ",".join(formatted_labels) + "}"
+
+
+class Trace:
+    """
+    Follows a single interaction with a control, from the moment it was received until it reaches
+    the keyboard, joystick or launcher, measuring how long it takes to reach each stage:
+
+        - dispatch: the control that should handle it was found.
+        - queue: it was sent to the scripts engine (only for scripts and unlinked actions).
+        - action_start: the first action started running.
+        - backend: the first action reached a backend (keys sent, joystick changed, etc).
+
+    Only the first time each stage is reached is measured.
+    While handling the interaction, the trace is activated with a "with" block, and code deeper
+    in the call chain marks stages with the mark function.
+    """
+    def __init__(self, origin, source, control, received_at=None):
+        # "midi" or "page", and the name of the device or page
+        self.origin = origin
+        self.source = source
+        self.control = control
+        self.received_at = received_at if received_at is not None else perf_counter()
+
+        self.action = None
+        self.marked_stages = set()
+        self._tokens = []
+
+    def mark(self, stage, action=None):
+        """
+        Measure the time it took to reach a stage, unless it was already reached before.
+        """
+        if action is not None:
+            self.action = action.PREFIX
+        if stage in self.marked_stages:
+            return
+
+        self.marked_stages.add(stage)
+        Metrics.get().observe(
+            "simpyt_interaction_stage_seconds",
+            perf_counter() - self.received_at,
+            origin=self.origin,
+            source=self.source,
+            control=self.control,
+            action=self.action or "",
+            stage=stage,
+        )
+
+    def __enter__(self):
+        self._tokens.append(current_trace.set(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        current_trace.reset(self._tokens.pop())
+
+
+def mark(stage, action=None):
+    """
+    Mark a stage in the trace of the interaction being handled, if any.
+    """
+    trace = current_trace.get()
+    if trace is not None:
+        trace.mark(stage, action)
@@ -1,13 +1,17 @@
+from queue import Queue
 from threading import Thread
-from time import sleep
+from time import perf_counter, sleep
 from uuid import uuid4
 import platform
 
 import mido
 import yaml
 
-from actions import Action, JoystickAction
+from actions import Action, JoystickAction, LinkedHold, Script
 from core import Simpyt, ImproperlyConfiguredException
+from metrics import Trace, mark
+from midi_capture import MidiCapture
+from scripts import OnRetrigger, ScriptsEngine
 
 
 USE_PYGAME = platform.system() == "Windows"
@@ -27,6 +31,115 @@ class MidiDevice:
         self.controls = controls
         self.port = port
 
+        self.dispatch_table = self.compile_dispatch_table(self.controls)
+
+    @classmethod
+    def compile_dispatch_table(cls, controls):
+        """
+        Build a dict to quickly find the controls that could match a midi message, instead of
+        asking every control if it matches. Keys are (type, channel, number) tuples, where None
+        means "any", and values are lists of (position, control) tuples, to be able to preserve
+        the order in which the controls were defined.
+        """
+        dispatch_table = {}
+        for position, control in enumerate(controls):
+            for key in control.dispatch_keys():
+                dispatch_table.setdefault(key, []).append((position, control))
+
+        return dispatch_table
+
+    def matching_controls(self, midi_message):
+        """
+        Get the controls that match a midi message, in the order they were defined. Equivalent
+        to filtering the controls with their .matches() method, but without going through all of
+        them.
+        """
+        # read once, a reconfigure could replace it in the middle of the lookups
+        dispatch_table = self.dispatch_table
+
+        candidates = []
+        for key in MidiControl.message_dispatch_keys(midi_message):
+            candidates.extend(dispatch_table.get(key, ()))
+
+        if len(candidates) > 1:
+            candidates.sort(key=lambda position_and_control: position_and_control[0])
+
+        return [control for _, control in candidates]
+
+    def handle_message(self, midi_message, received_at):
+        """
+        Run the controls matching a midi message received from this device. received_at is the
+        perf_counter of the moment the message arrived, to measure latencies.
+        """
+        if Simpyt.current.debug:
+            message_details = f"type={midi_message.type} "
+
+            channel = getattr(midi_message, "channel", None)
+            if channel:
+                message_details += f"channel={channel} "
+
+            if midi_message.type == "control_change":
+                message_details += f"control={midi_message.control} "
+
+            if midi_message.type in ("note_on", "note_off"):
+                message_details += f"note={midi_message.note} "
+
+            value = MidiControl.extract_midi_value(midi_message)
+            message_details += f"value={value}"
+
+            print("Interacted with midi device", self.name, message_details)
+
+        for control in self.matching_controls(midi_message):
+            try:
+                # jitter is discarded before doing any work for it
+                if not control.filter_jitter(midi_message):
+                    continue
+
+                with Trace("midi", self.name, control.source, received_at):
+                    mark("dispatch")
+                    control.run(midi_message)
+            except Exception as ex:
+                print(f"Error running midi control from device {self.name}: {ex}")
+
+    def release_controls(self):
+        """
+        Release everything held down by the controls of the device, as it won't send the messages
+        to release them.
+        """
+        for control in self.controls:
+            try:
+                control.release()
+            except Exception as ex:
+                print(f"Error releasing midi control from device {self.name}: {ex}")
+
+    def reconfigure(self, new_device):
+        """
+        Start using the controls of a new definition of this device, keeping its port. Messages
+        are dispatched using only the dispatch table, which is replaced in a single assignment, so
+        a message being dispatched at the same time runs either the old controls or the new ones,
+        never a mix of both.
+
+        New controls listening to the same midi control as old ones take their state, so anything
+        held down (or on, with hysteresis) is released when the device says so. Old controls
+        without a replacement, or replaced by one linked to a different action, release what they
+        held down right away.
+        """
+        old_controls_by_trigger = {}
+        for control in self.controls:
+            old_controls_by_trigger.setdefault(control.trigger, []).append(control)
+
+        for control in new_device.controls:
+            old_controls = old_controls_by_trigger.get(control.trigger)
+            if old_controls:
+                control.take_state(old_controls.pop(0))
+
+        for old_controls in old_controls_by_trigger.values():
+            for control in old_controls:
+                control.release()
+
+        self.controls = new_device.controls
+        self.dispatch_table = new_device.dispatch_table
+
     @classmethod
     def read(cls, name):
         """
@@ -63,8 +176,9 @@ class MidiControl:
     A control from a midi device, that can run some actions when interacted with.
     """
     def __init__(self, when_channel=None, when_is_program=False, when_control=None, when_note=None,
-                 when_value_between=None, when_value_surpasses=None, linked_action=None,
-                 script=None):
+                 when_value_between=None, when_value_surpasses=None, when_hysteresis=None,
+                 when_deadband=None, linked_action=None, script=None,
+                 on_retrigger=OnRetrigger.PARALLEL):
         self.id = uuid4().hex
 
         self.when_channel = when_channel
@@ -73,9 +187,22 @@ class MidiControl:
         self.when_note = when_note
         self.when_value_between = when_value_between
         self.when_value_surpasses = when_value_surpasses
+        # how far the value must go back beyond the condition to turn the control off again
+        self.when_hysteresis = when_hysteresis
+        # min change of the value (since the last one used) to use it, for axes
+        self.when_deadband = when_deadband
 
         self.linked_action = linked_action
         self.script = script
+        self.on_retrigger = on_retrigger
+
+        # state used to filter jitter, only needed with hysteresis or deadband
+        self.is_on = False
+        self.last_value = None
+        # is the linked action held down by this control?
+        self.pressed = False
+        # the run of the scripts engine holding it down, for actions that wait when linked
+        self.linked_hold = None
 
         if self.when_value_between is not None and self.when_value_surpasses is not None:
             raise ValueError("Only one of when_value_between and when_value_surpasses can "
@@ -85,6 +212,16 @@ class MidiControl:
             raise ValueError("When mapping a midi control to an axis, a range of values must be "
                              "specified instead of just a threshold")
 
+        if self.when_hysteresis is not None:
+            if self.when_value_between is None and self.when_value_surpasses is None:
+                raise ValueError("Hysteresis needs a range of values or a threshold")
+            if self.linked_to_axis():
+                raise ValueError("Hysteresis can't be used when mapping a midi control to an axis, "
+                                 "use a deadband instead")
+
+        if self.when_deadband is not None and self.when_value_between is None:
+            raise ValueError("A deadband needs a range of values")
+
     @classmethod
     def extract_midi_value(cls, midi_message):
         """
@@ -131,29 +268,136 @@ class MidiControl:
 
         return True
 
+    def condition_is_on(self, value):
+        """
+        Does a value satisfy the condition of the control? With hysteresis, a control that is on
+        stays on until the value goes back beyond the condition by the hysteresis amount.
+        """
+        margin = self.when_hysteresis if self.is_on and self.when_hysteresis else 0
+
+        if self.when_value_between is not None:
+            value_min, value_max = self.when_value_between
+            return value_min - margin <= value <= value_max + margin
+        else:
+            return value > self.when_value_surpasses - margin
+
+    def filter_jitter(self, midi_message):
+        """
+        Apply the hysteresis and deadband of the control (if any) to a message, updating its
+        state. Returns False if the message is just jitter, and the control shouldn't run.
+        With hysteresis, only the messages that turn the control on or off are let through.
+        With a deadband, only the messages that change the value enough since the last one are let
+        through (or the ones reaching the limits of the range).
+        """
+        if self.when_hysteresis is None and self.when_deadband is None:
+            return True
+
+        value = self.extract_midi_value(midi_message)
+
+        if self.when_deadband is not None and self.last_value is not None:
+            value_min, value_max = self.when_value_between
+            reached_limit = value != self.last_value and (value <= value_min or value >= value_max)
+            if abs(value - self.last_value) < self.when_deadband and not reached_limit:
+                return False
+
+        if self.when_hysteresis is not None:
+            is_on = self.condition_is_on(value)
+            if is_on == self.is_on:
+                return False
+            self.is_on = is_on
+
+        self.last_value = value
+        return True
+
+    def dispatch_keys(self):
+        """
+        The keys under which this control must be registered in the dispatch table of its device.
+        Each key is a (type, channel, number) tuple, with None meaning "any". The number is the
+        control id for control changes, and the note for notes.
+        """
+        # the message types (and the number in them) that satisfy each one of our conditions
+        conditions = []
+        if self.when_is_program:
+            conditions.append(({"program_change"}, None))
+        if self.when_control is not None:
+            conditions.append(({"control_change"}, self.when_control))
+        if self.when_note is not None:
+            conditions.append(({"note_on", "note_off"}, self.when_note))
+
+        if not conditions:
+            # no conditions on the type of message, any message will do
+            return [(None, self.when_channel, None)]
+
+        types = set.intersection(*[condition_types for condition_types, _ in conditions])
+        numbers = {number for _, number in conditions if number is not None}
+        if len(numbers) > 1:
+            # a control and a note at the same time, impossible to match
+            return []
+
+        number = numbers.pop() if numbers else None
+        return [(type_, self.when_channel, number) for type_ in sorted(types)]
+
+    @classmethod
+    def message_dispatch_keys(cls, midi_message):
+        """
+        The keys to look for in a dispatch table, to find the controls that match a midi message.
+        """
+        type_ = midi_message.type
+        channel = getattr(midi_message, "channel", None)
+
+        if type_ == "control_change":
+            number = midi_message.control
+        elif type_ in ("note_on", "note_off"):
+            number = midi_message.note
+        else:
+            number = None
+
+        keys = [(type_, None, number), (None, None, None)]
+        if channel is not None:
+            keys.extend([(type_, channel, number), (None, channel, None)])
+
+        return keys
+
     def linked_to_axis(self):
         """
         Is this control linked to an axis in a joystick?
         """
         return (
             isinstance(self.linked_action, JoystickAction)
-            and self.linked_action.ControlType == JoystickAction.ControlType.AXIS
+            and self.linked_action.control_type == JoystickAction.ControlType.AXIS
         )
 
+    @property
+    def source(self):
+        """
+        A description of the control, to know where running scripts come from.
+        """
+        if self.when_control is not None:
+            return f"midi control {self.when_control}"
+        elif self.when_note is not None:
+            return f"midi note {self.when_note}"
+        elif self.when_is_program:
+            return "midi program change"
+        else:
+            return "midi control"
+
     def run(self, midi_message):
         """
-        Simulate buttons or axes in a virtual joystick.
+        Simulate buttons or axes in a virtual joystick. Linked actions are quick, so they are ran
+        right away (unless they wait, see press_linked_action). Anything else is ran together as a
+        single script by the scripts engine.
         """
         input_value = self.extract_midi_value(midi_message)
 
-        if self.when_value_between is not None:
+        if self.when_hysteresis is not None:
+            # already decided when filtering the jitter
+            is_on = self.is_on
+        elif self.when_value_between is not None:
             is_on = self.when_value_between[0] <= input_value <= self.when_value_between[1]
         elif self.when_value_surpasses is not None:
             is_on = input_value > self.when_value_surpasses
 
-        # scripts are just on/off
-        if self.script and is_on:
-            self.script.run()
+        background_actions = []
 
         # linked actions are more complex, depending on their type
         if self.linked_action:
@@ -161,18 +405,95 @@ class MidiControl:
                 # convert input midi control value to output joystick value
                 input_min, input_max = self.when_value_between
                 axis_value = (input_value - input_min) / (input_max - input_min)
+                axis_value = min(max(axis_value, 0), 1)
+                mark("action_start", self.linked_action)
                 self.linked_action.run(Action.Mode.LINKED_CONTROL_MOVE, axis_value)
             else:
                 if is_on:
                     # linked actions simulate the pressing down, and then releasing
                     # unlinked actions just run in the press down phase
                     if self.linked_action.CAN_BE_LINKED:
-                        self.linked_action.run(Action.Mode.LINKED_CONTROL_PRESS)
+                        self.press_linked_action()
                     else:
-                        self.linked_action.run(Action.Mode.UNLINKED)
+                        background_actions.append(self.linked_action)
                 else:
                     if self.linked_action.CAN_BE_LINKED:
-                        self.linked_action.run(Action.Mode.LINKED_CONTROL_RELEASE)
+                        self.release_linked_action()
+
+        # scripts are just on/off
+        if self.script and is_on:
+            background_actions.extend(self.script.actions)
+
+        if background_actions:
+            ScriptsEngine.get().start(Script(background_actions), self.source,
+                                      self.id, self.on_retrigger)
+
+    @property
+    def trigger(self):
+        """
+        The midi control this control listens to, to find equivalent controls in other configs.
+        """
+        return self.when_channel, self.when_is_program, self.when_control, self.when_note
+
+    def take_state(self, old_control):
+        """
+        Continue from the state of an old version of this control. What the old control holds
+        down is only kept if this one holds down the same, otherwise it's released now.
+        """
+        self.is_on = old_control.is_on
+        self.last_value = old_control.last_value
+
+        if (old_control.pressed and self.linked_action is not None
+                and self.linked_action.holds_same_as(old_control.linked_action)):
+            # this control will release it
+            self.pressed = True
+            self.linked_hold = old_control.linked_hold
+        else:
+            # a different action would release something else
+            old_control.release()
+
+    def press_linked_action(self):
+        """
+        Press the linked action. Actions that wait while pressed or released (like keys with an
+        interval between them) are held by the scripts engine instead, so they don't block the
+        dispatch of the messages of all the devices.
+        """
+        if self.linked_action.waits_when_linked():
+            if self.linked_hold is not None:
+                # pressed again without a release in between
+                self.linked_hold.release()
+
+            self.linked_hold = LinkedHold(self.linked_action)
+            # queued, so each hold releases the action before the next one presses it again
+            if ScriptsEngine.get().start(self.linked_hold, self.source, f"{self.id}_linked",
+                                         OnRetrigger.QUEUE) is None:
+                self.linked_hold = None
+        else:
+            mark("action_start", self.linked_action)
+            self.linked_action.run(Action.Mode.LINKED_CONTROL_PRESS)
+
+        self.pressed = True
+
+    def release_linked_action(self):
+        """
+        Release the linked action.
+        """
+        if self.linked_hold is not None:
+            self.linked_hold.release()
+            self.linked_hold = None
+        elif not self.linked_action.waits_when_linked():
+            mark("action_start", self.linked_action)
+            self.linked_action.run(Action.Mode.LINKED_CONTROL_RELEASE)
+
+        self.pressed = False
+
+    def release(self):
+        """
+        Release the linked action, if this control is holding it down (for instance, when its
+        device is disconnected in the middle of a press).
+        """
+        if self.pressed:
+            self.release_linked_action()
 
     @classmethod
     def parse_when(cls, raw_when):
@@ -183,33 +504,34 @@ class MidiControl:
         when_control = None
         when_note = None
         when_is_program = False
-        value_condition_start_at = None
 
         when_value_between = None
         when_value_surpasses = None
 
+        when_hysteresis = None
+        when_deadband = None
+
         try:
             parts = raw_when.split()
 
             midi_type = parts.pop(0)
 
             if midi_type == "control":
-                assert len(parts) == 3
                 when_control = int(parts[0])
                 condition_parts = parts[1:]
             elif midi_type == "note":
-                assert len(parts) == 3
                 when_note = int(parts[0])
                 condition_parts = parts[1:]
             elif midi_type == "program":
-                assert len(parts) == 2
                 when_is_program = True
                 condition_parts = parts
             else:
                 raise ValueError(f"Unknown midi event type: {midi_type}")
 
-            assert len(condition_parts) == 2
-            condition_type, condition_value = condition_parts
+            # the condition, optionally followed by a filter for jitter
+            assert len(condition_parts) in (2, 4)
+            condition_type, condition_value = condition_parts[:2]
+            filter_parts = condition_parts[2:]
 
             if condition_type == "between":
                 value1, value2 = condition_value.split("-")
@@ -217,7 +539,20 @@ class MidiControl:
             elif condition_type == "surpasses":
                 when_value_surpasses = int(condition_value)
             else:
-                raise ValueError(f"Unknown condition: {parts[value_condition_start_at]}")
+                raise ValueError(f"Unknown condition: {condition_type}")
+
+            if filter_parts:
+                filter_type, filter_value = filter_parts
+                filter_value = int(filter_value)
+                assert filter_value >= 0
+
+                if filter_type == "hysteresis":
+                    when_hysteresis = filter_value
+                elif filter_type == "deadband":
+                    assert when_value_between is not None
+                    when_deadband = filter_value
+                else:
+                    raise ValueError(f"Unknown filter: {filter_type}")
 
         except Exception as ex:
             raise ImproperlyConfiguredException(
@@ -233,6 +568,8 @@ class MidiControl:
             when_note=when_note,
             when_value_between=when_value_between,
             when_value_surpasses=when_value_surpasses,
+            when_hysteresis=when_hysteresis,
+            when_deadband=when_deadband,
         )
 
     @classmethod
@@ -247,76 +584,302 @@ class MidiControl:
 
         when_args = cls.parse_when(raw_config.pop("when"))
         linked_action, script = Action.deserialize(raw_config)
+        on_retrigger = OnRetrigger.deserialize(raw_config.pop("on_retrigger", "parallel"))
 
-        return cls(**when_args, linked_action=linked_action, script=script)
+        try:
+            return cls(**when_args, linked_action=linked_action, script=script,
+                       on_retrigger=on_retrigger)
+        except ValueError as ex:
+            raise ImproperlyConfiguredException(f"Incorrect midi control: {ex}") from ex
 
 
-def midi_integration_loop():
+class MidiReceiver:
     """
-    Run the main loop of the midi integration.
+    Receives the messages from all the connected midi devices into a single queue, so the
+    dispatcher can block on it and only wake up when a message actually arrives.
+
+    Backends that support callbacks (rtmidi) push their messages directly into the queue from
+    their own threads. The rest (pygame) get a reader thread per port, doing blocking reads.
     """
-    if USE_PYGAME:
-        pygame.init()
-        pgm.init()
-        midi_backend = mido.Backend('mido.backends.pygame')
-    else:
-        midi_backend = mido.Backend('mido.backends.rtmidi')
+    def __init__(self, midi_backend, use_callbacks):
+        self.midi_backend = midi_backend
+        self.use_callbacks = use_callbacks
+        self.messages = Queue()
 
-    devices = []
+    def connect(self, device):
+        """
+        Open the port of a device, and start receiving its messages.
+        """
+        if self.use_callbacks:
+            device.port = self.midi_backend.open_input(
+                device.name,
+                callback=lambda message: self.messages.put((device, message, perf_counter())),
+            )
+        else:
+            device.port = self.midi_backend.open_input(device.name)
+            reader_thread = Thread(target=self.read_port, args=[device], daemon=True)
+            reader_thread.start()
 
-    for device_name in MidiDevice.configured_devices():
+    def disconnect(self, device, port=None):
+        """
+        Close the port of a device (only if it's still the specified port, if any), to stop
+        receiving its messages. Messages already received are still dispatched, followed by a
+        None message telling the dispatcher the device was disconnected.
+        """
+        if port is not None and device.port is not port:
+            return
+
+        port, device.port = device.port, None
+        if port is not None:
+            try:
+                port.close()
+            except Exception as ex:
+                # probably already broken, it was unplugged
+                print(f"Error closing midi device {device.name}: {ex}")
+
+            self.messages.put((device, None, perf_counter()))
+
+    def read_port(self, device):
+        """
+        Read all the messages from the port of a device, until it's closed or fails.
+        """
+        port = device.port
         try:
-            device = MidiDevice.read(device_name)
-            device.port = midi_backend.open_input(device.name)
-            devices.append(device)
+            for message in port:
+                self.messages.put((device, message, perf_counter()))
+        except (OSError, ValueError) as ex:
+            # closed ports are expected to fail, the rest probably got unplugged
+            if not port.closed:
+                print(f"Lost connection with midi device {device.name}: {ex}")
+                self.disconnect(device, port)
+
+    def __iter__(self):
+        """
+        Iterate over the received messages as (device, message, received_at) tuples, blocking
+        until new ones arrive. received_at is the perf_counter of the moment they arrived.
+        The message is None when the device was disconnected.
+        """
+        while True:
+            yield self.messages.get()
+
+
+class MidiDevicesWatcher:
+    """
+    Keeps the midi devices in sync with their config files and with the devices plugged to the
+    computer, so configs can be edited and devices plugged and unplugged while Simpyt runs.
+    A background thread periodically checks the modification times of the config files, and the
+    names of the midi inputs the backend sees. All the changes are applied from that thread, so
+    the dispatch of the messages of the rest of the devices never waits for them.
+
+    When a device keeps its name, its new controls replace the old ones in place (see
+    MidiDevice.reconfigure), without reopening its port or touching the messages waiting to be
+    dispatched. New devices are connected, and removed or renamed devices are disconnected.
+
+    Devices that aren't connected stay configured, and the watcher keeps trying to connect them
+    while the backend lists their inputs. Devices whose input disappears, or fails, are
+    disconnected (releasing everything their controls held down), waiting to be connected again.
+    Polling can't tell devices unplugged and plugged again between two checks apart from devices
+    that were never unplugged, so those are only reconnected if their port fails.
+    """
+
+    # time between checks of the config files and plugged devices
+    CHECK_INTERVAL = 1
+
+    def __init__(self, receiver):
+        self.receiver = receiver
+
+        # configured devices (connected or waiting to be plugged), by the name of their config
+        # file
+        self.devices = {}
+        # last seen modification time of each config file
+        self.mtimes = {}
+        # configs of the devices that failed to connect, to not report them on every check
+        self.failing = set()
+
+        self.thread = None
 
-            print("Midi device found and configured:", device_name)
+    @staticmethod
+    def config_mtimes():
+        """
+        Get the modification times of the midi device config files, by config name.
+        """
+        mtimes = {}
+        for midi_path in Simpyt.current.midis_path.glob("*.midi_device"):
+            try:
+                mtimes[midi_path.name[:-12]] = midi_path.stat().st_mtime_ns
+            except OSError:
+                # removed while checking
+                pass
+
+        return mtimes
+
+    def check(self):
+        """
+        Apply the changes in the config files and plugged devices since the last check.
+        """
+        self.check_configs()
+        self.check_plugged()
+
+    def check_configs(self):
+        """
+        Apply the changes in the config files since the last check.
+        """
+        mtimes = self.config_mtimes()
+
+        for config_name in self.mtimes.keys() - mtimes.keys():
+            self.unload(config_name)
+
+        for config_name, mtime in mtimes.items():
+            if self.mtimes.get(config_name) != mtime:
+                # remembered even if it fails to load, to not retry until the file changes again
+                self.mtimes[config_name] = mtime
+                self.load(config_name)
+
+    def load(self, config_name):
+        """
+        Read a device config, and connect the device or update the already connected one.
+        """
+        try:
+            device = MidiDevice.read(config_name)
         except ImproperlyConfiguredException as ex:
-            print(f"Midi device found but with problems in its config!: {device_name}\n"
+            print(f"Midi device found but with problems in its config!: {config_name}\n"
                   f"{ex.as_user_friendly_text()}")
-        except OSError:
-            print("Midi device found, but couldn't connect to it! Is it plugged?:", device_name)
+            return
         except Exception as ex:
-            print(f"Midi device found but failed to read its config!: {device_name}\n{ex}")
-
-    if not devices:
-        print("No midi devices configured, won't run the midi module of Simpyt")
-        return
+            print(f"Midi device found but failed to read its config!: {config_name}\n{ex}")
+            return
+
+        old_device = self.devices.get(config_name)
+        if old_device is not None and old_device.name == device.name:
+            old_device.reconfigure(device)
+            print("Midi device config reloaded:", config_name)
+            return
+
+        if old_device is not None:
+            # renamed, the old device is replaced (but its config file is still the same)
+            self.receiver.disconnect(old_device)
+
+        self.devices[config_name] = device
+        if self.connect(device):
+            self.failing.discard(config_name)
+            print("Midi device found and configured:", config_name)
+        else:
+            self.failing.add(config_name)
+            print("Midi device configured, but couldn't connect to it! It will be used as soon "
+                  "as it's plugged:", config_name)
 
-    devices_by_port_name = {device.port.name: device for device in devices}
-    ports = [device.port for device in devices_by_port_name.values()]
+    def connect(self, device):
+        """
+        Try to connect a configured device. Returns True if it worked.
+        """
+        try:
+            self.receiver.connect(device)
+            return True
+        except OSError:
+            return False
 
-    try:
+    def check_plugged(self):
+        """
+        Disconnect the devices that were unplugged since the last check, and try to connect the
+        ones that aren't connected but are listed by the backend.
+        """
+        input_names = set(self.receiver.midi_backend.get_input_names())
+
+        for config_name, device in list(self.devices.items()):
+            # other devices being plugged or unplugged don't matter, only this one's own input
+            if device.port is not None and device.name not in input_names:
+                self.receiver.disconnect(device)
+                print("Midi device unplugged, waiting for it to be plugged again:", config_name)
+
+            if device.port is None and device.name in input_names:
+                if self.connect(device):
+                    self.failing.discard(config_name)
+                    print("Midi device connected:", config_name)
+                elif config_name not in self.failing:
+                    self.failing.add(config_name)
+                    print("Midi device plugged, but couldn't connect to it! Will keep trying:",
+                          config_name)
+
+    def unload(self, config_name):
+        """
+        Disconnect the device of a config that no longer exists.
+        """
+        self.mtimes.pop(config_name, None)
+        self.failing.discard(config_name)
+        device = self.devices.pop(config_name, None)
+        if device is not None:
+            self.receiver.disconnect(device)
+            print("Midi device config removed:", config_name)
+
+    def watch(self):
+        """
+        Keep checking the config files.
+        """
         while True:
-            for port, message in mido.ports.multi_receive(ports, yield_ports=True):
-                device = devices_by_port_name[port.name]
+            sleep(self.CHECK_INTERVAL)
+            try:
+                self.check()
+            except Exception as ex:
+                print(f"Error checking midi devices: {ex}")
 
-                if Simpyt.current.debug:
-                    message_details = f"type={message.type} "
+    def start(self):
+        """
+        Start checking the config files in a background thread.
+        """
+        self.thread = Thread(target=self.watch, daemon=True, name="midi_devices_watcher")
+        self.thread.start()
 
-                    channel = getattr(message, "channel", None)
-                    if channel:
-                        message_details += f"channel={channel} "
 
-                    if message.type == "control_change":
-                        message_details += f"control={message.control} "
+def midi_integration_loop():
+    """
+    Run the main loop of the midi integration.
+    """
+    if USE_PYGAME:
+        pygame.init()
+        pgm.init()
+        midi_backend = mido.Backend('mido.backends.pygame')
+    else:
+        midi_backend = mido.Backend('mido.backends.rtmidi')
 
-                    if message.type in ("note_on", "note_off"):
-                        message_details += f"note={message.note} "
+    # pygame doesn't support callbacks, so in that case we use a thread reading from each port
+    receiver = MidiReceiver(midi_backend, use_callbacks=not USE_PYGAME)
 
-                    value = MidiControl.extract_midi_value(message)
-                    message_details += f"value={value}"
+    # the first check is done right away, so the devices are ready when Simpyt starts
+    watcher = MidiDevicesWatcher(receiver)
+    watcher.check()
+    watcher.start()
 
-                    print("Interacted with midi device", device.name, message_details)
+    if not watcher.devices:
+        print("No midi devices configured yet, they will be used as soon as they are configured "
+              "in:", Simpyt.current.midis_path)
 
-                for control in device.controls:
-                    if control.matches(message):
-                        control_run_thread = Thread(target=control.run, args=[message])
-                        control_run_thread.start()
+    capture = None
+    if Simpyt.current.midi_capture_path is not None:
+        capture = Simpyt.current.midi_capture = MidiCapture(Simpyt.current.midi_capture_path)
+        print("Capturing midi messages to:", Simpyt.current.midi_capture_path)
 
-            sleep(0.01)
+    try:
+        for device, message, received_at in receiver:
+            if message is None:
+                # disconnected, it won't send the messages to release what its controls held
+                device.release_controls()
+                continue
+
+            if capture is not None:
+                try:
+                    capture.write(device.name, message, received_at)
+                except (OSError, ValueError) as ex:
+                    # the capture is just a tool, the devices must keep working without it
+                    print(f"Error writing the midi capture, capture stopped: {ex}")
+                    capture.close()
+                    capture = Simpyt.current.midi_capture = None
+
+            device.handle_message(message, received_at)
     except KeyboardInterrupt:
         pass
+    finally:
+        if capture is not None:
+            capture.close()
 
     if USE_PYGAME:
         pgm.quit()
@@ -0,0 +1,234 @@
+"""
+Capture of the midi messages received by Simpyt, and replay of those captures, to reproduce real
+sessions without the physical devices (and without a human at the controls).
+
+Captures are compact binary files: a header, and then a sequence of records. Each device gets a
+record with its name the first time one of its messages is captured, and each message gets a
+record with its timestamp (seconds since the capture started), the index of its device and its
+raw midi bytes.
+
+To replay a capture through the configured midi devices, from the root of the repo:
+
+    python midi_capture.py session.midicap              # at the original speed
+    python midi_capture.py session.midicap --speed 2    # twice as fast
+    python midi_capture.py session.midicap --fast       # as fast as possible
+"""
+from pathlib import Path
+from threading import Event, Lock, Thread
+from time import perf_counter
+import argparse
+import struct
+
+import mido
+
+from core import Simpyt, ImproperlyConfiguredException
+from timing import Timer
+
+
+HEADER = b"SIMPYT-MIDI-CAPTURE 2\n"
+
+DEVICE_RECORD = 0
+MESSAGE_RECORD = 1
+
+# kind, name length
+DEVICE_STRUCT = struct.Struct("<BH")
+# kind, timestamp, device index, message length (sysex messages can be long)
+MESSAGE_STRUCT = struct.Struct("<BdHI")
+
+# max seconds between flushes of the capture file, so a killed Simpyt loses little of it
+FLUSH_INTERVAL = 1
+
+
+class MidiCapture:
+    """
+    Writes the received midi messages to a capture file. Writes are buffered, and a background
+    thread flushes them periodically, so the dispatch of messages doesn't wait for the disk.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "wb")
+        self.file.write(HEADER)
+
+        self.started_at = perf_counter()
+        self.device_indexes = {}
+
+        # the file is used by the dispatch and flush threads
+        self.file_lock = Lock()
+        self.closed = Event()
+        self.flush_thread = Thread(target=self.flush_loop, daemon=True, name="midi_capture_flush")
+        self.flush_thread.start()
+
+    def write(self, device_name, midi_message, received_at):
+        """
+        Capture a message received from a device. received_at is the perf_counter of the moment it
+        arrived.
+        """
+        message_bytes = bytes(midi_message.bytes())
+
+        with self.file_lock:
+            device_index = self.device_indexes.get(device_name)
+            if device_index is None:
+                device_index = self.device_indexes[device_name] = len(self.device_indexes)
+                encoded_name = device_name.encode("utf-8")
+                self.file.write(DEVICE_STRUCT.pack(DEVICE_RECORD, len(encoded_name)))
+                self.file.write(encoded_name)
+
+            self.file.write(MESSAGE_STRUCT.pack(MESSAGE_RECORD, received_at - self.started_at,
+                                                device_index, len(message_bytes)))
+            self.file.write(message_bytes)
+
+    def flush_loop(self):
+        """
+        Flush the written messages every once in a while, until the capture is closed.
+        """
+        while not self.closed.wait(FLUSH_INTERVAL):
+            try:
+                with self.file_lock:
+                    self.file.flush()
+            except OSError as ex:
+                print(f"Error writing the midi capture {self.path}: {ex}")
+
+    def close(self):
+        """
+        Finish the capture, writing everything that's still buffered. Can be called more than
+        once.
+        """
+        with self.file_lock:
+            self.closed.set()
+            try:
+                self.file.close()
+            except OSError as ex:
+                print(f"Error writing the midi capture {self.path}: {ex}")
+
+
+def read_capture(path):
+    """
+    Read a capture file, yielding (timestamp, device_name, midi_message) tuples.
+    """
+    with open(path, "rb") as capture_file:
+        if capture_file.read(len(HEADER)) != HEADER:
+            raise ValueError(f"Not a Simpyt midi capture file: {path}")
+
+        device_names = []
+        while True:
+            kind = capture_file.read(1)
+            if not kind:
+                break
+
+            if kind[0] == DEVICE_RECORD:
+                record = kind + capture_file.read(DEVICE_STRUCT.size - 1)
+                if len(record) < DEVICE_STRUCT.size:
+                    # the capture was interrupted while writing
+                    break
+
+                _, name_length = DEVICE_STRUCT.unpack(record)
+                encoded_name = capture_file.read(name_length)
+                if len(encoded_name) < name_length:
+                    break
+
+                device_names.append(encoded_name.decode("utf-8"))
+            elif kind[0] == MESSAGE_RECORD:
+                record = kind + capture_file.read(MESSAGE_STRUCT.size - 1)
+                if len(record) < MESSAGE_STRUCT.size:
+                    # the capture was interrupted while writing
+                    break
+
+                _, timestamp, device_index, message_length = MESSAGE_STRUCT.unpack(record)
+                message_bytes = capture_file.read(message_length)
+                if len(message_bytes) < message_length:
+                    break
+
+                yield timestamp, device_names[device_index], mido.Message.from_bytes(message_bytes)
+            else:
+                raise ValueError(f"Corrupted Simpyt midi capture file: {path}")
+
+
+def replay(records, devices, speed=1):
+    """
+    Send captured messages through the dispatch of the devices (a dict by device name), keeping
+    their original timing, multiplied by the speed (0 to send them as fast as possible).
+    Messages of unknown devices are skipped.
+    Returns the handling time of each message, measured from the moment it should have been
+    received (so falling behind the capture shows up as latency).
+    """
+    timer = Timer.get()
+    handling_times = []
+
+    started_at = perf_counter()
+    for timestamp, device_name, midi_message in records:
+        device = devices.get(device_name)
+        if device is None:
+            continue
+
+        if speed:
+            received_at = started_at + timestamp / speed
+            remaining = received_at - perf_counter()
+            if remaining > 0:
+                timer.sleep(remaining)
+        else:
+            received_at = perf_counter()
+
+        device.handle_message(midi_message, received_at)
+        handling_times.append(perf_counter() - received_at)
+
+    return handling_times
+
+
+def load_devices():
+    """
+    Read the configured midi devices, as a dict by device name.
+    """
+    # imported here to prevent circular imports
+    from midi import MidiDevice
+
+    devices = {}
+    for device_name in MidiDevice.configured_devices():
+        try:
+            device = MidiDevice.read(device_name)
+            devices[device.name] = device
+        except ImproperlyConfiguredException as ex:
+            print(f"Midi device with problems in its config!: {device_name}\n"
+                  f"{ex.as_user_friendly_text()}")
+
+    return devices
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a capture of midi messages in Simpyt.")
+    parser.add_argument("capture_path", type=Path, help="the capture file to replay")
+    parser.add_argument("--speed", type=float, default=1,
+                        help="multiplier of the original speed of the capture")
+    parser.add_argument("--fast", action="store_true",
+                        help="send the messages as fast as possible")
+    parser.add_argument("--configs", type=Path,
+                        default=Path(__file__).parent / "simpyt_configs",
+                        help="folder with the Simpyt configs")
+    parser.add_argument("-d", "--debug", action="store_true", help="show the replayed messages")
+    args = parser.parse_args()
+
+    Simpyt.current = Simpyt(args.configs.absolute(), debug=args.debug)
+
+    records = list(read_capture(args.capture_path))
+    devices = load_devices()
+
+    for device_name in sorted({device_name for _, device_name, _ in records} - set(devices)):
+        print("Midi device in the capture isn't configured, skipping its messages:", device_name)
+
+    started_at = perf_counter()
+    handling_times = sorted(replay(records, devices, speed=0 if args.fast else args.speed))
+    elapsed = perf_counter() - started_at
+
+    if not handling_times:
+        print("No messages replayed")
+        return
+
+    print("Messages replayed:", len(handling_times))
+    print(f"Seconds: {elapsed:.3f} ({len(handling_times) / elapsed:.0f} messages per second)")
+    for name, ratio in (("p50", 0.5), ("p99", 0.99)):
+        index = min(len(handling_times) - 1, int(len(handling_times) * ratio))
+        print(f"Handling time {name}: {handling_times[index] * 1000:.3f} ms")
+    print(f"Handling time max: {handling_times[-1] * 1000:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
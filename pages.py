@@ -1,10 +1,13 @@
-from uuid import uuid4
-from threading import Thread
+from collections import Counter
+from hashlib import sha1
+from threading import Lock, Thread
 
 import yaml
 
-from actions import Action
+from actions import Action, Script
 from core import Simpyt, ImproperlyConfiguredException
+from metrics import mark
+from scripts import OnRetrigger, ScriptsEngine
 
 DEFAULT_GRID_WIDTH = 20
 DEFAULT_GRID_HEIGHT = 10
@@ -14,14 +17,52 @@ class Page:
     """
     A collection of controls to show together, mapped to actions.
     """
+    # already read pages, by name, as (modification time of the file, page) tuples
+    _cache = {}
+    # already listed page names, as a (modification time of the folder, names) tuple
+    _names_cache = (None, [])
+    # controls of all the already read pages, by id
+    _controls_by_id = {}
+    # pages can be requested from many web server threads at the same time
+    _cache_lock = Lock()
+
     def __init__(self, name, controls, background_color=None, background_image=None,
-                 width=DEFAULT_GRID_WIDTH, height=DEFAULT_GRID_HEIGHT):
+                 width=DEFAULT_GRID_WIDTH, height=DEFAULT_GRID_HEIGHT, sprite_atlas=False):
         self.name = name
         self.background_color = background_color
         self.background_image = background_image
         self.width = width
         self.height = height
         self.controls = controls
+        self.sprite_atlas = sprite_atlas
+
+        self.assign_controls_ids()
+
+    def images(self):
+        """
+        The names of all the images used in the page.
+        """
+        images = [control.image for control in self.controls if control.image]
+        if self.background_image:
+            images.insert(0, self.background_image)
+
+        return images
+
+    def assign_controls_ids(self):
+        """
+        Give each control an id derived from the page name and the position of the control, so
+        ids are the same each time the page is read, even after restarting Simpyt.
+        """
+        ids_count = Counter()
+        for control in self.controls:
+            base_id = sha1(
+                f"{self.name}:{control.col}:{control.row}:{control.col_end}:{control.row_end}"
+                .encode("utf-8")
+            ).hexdigest()[:16]
+
+            # controls placed in the exact same position are told apart by their order
+            control.id = f"{base_id}_{ids_count[base_id]}"
+            ids_count[base_id] += 1
 
     @classmethod
     def read(cls, name):
@@ -44,15 +85,65 @@ class Page:
 
         return cls(**raw_config)
 
+    @classmethod
+    def get(cls, name):
+        """
+        Get a page, reading its definition only if it wasn't read before or if the file changed
+        since then.
+        """
+        page_path = Simpyt.current.pages_path / (name + ".page")
+        modified_at = page_path.stat().st_mtime_ns
+
+        cached = cls._cache.get(name)
+        if cached is not None and cached[0] == modified_at:
+            return cached[1]
+
+        with cls._cache_lock:
+            # another thread could have read it while we waited
+            cached = cls._cache.get(name)
+            if cached is not None and cached[0] == modified_at:
+                return cached[1]
+
+            page = cls.read(name)
+
+            if cached is not None:
+                for old_control in cached[1].controls:
+                    cls._controls_by_id.pop(old_control.id, None)
+            cls._controls_by_id.update((control.id, control) for control in page.controls)
+
+            cls._cache[name] = modified_at, page
+            return page
+
+    @classmethod
+    def get_control(cls, page_name, control_id):
+        """
+        Get a control of a page by its id, with a single lookup.
+        """
+        control = cls._controls_by_id.get(control_id)
+        if control is None:
+            # maybe the page wasn't read yet
+            cls.get(page_name)
+            control = cls._controls_by_id[control_id]
+
+        return control
+
     @classmethod
     def configured_pages(cls):
         """
-        List all the configured (config files) pages.
+        List all the configured (config files) pages. The folder is only listed again when its
+        contents change.
         """
-        return [
-            page_path.name[:-5]
-            for page_path in Simpyt.current.pages_path.glob("*.page")
-        ]
+        modified_at = Simpyt.current.pages_path.stat().st_mtime_ns
+
+        cached_modified_at, names = cls._names_cache
+        if cached_modified_at != modified_at:
+            names = [
+                page_path.name[:-5]
+                for page_path in Simpyt.current.pages_path.glob("*.page")
+            ]
+            cls._names_cache = modified_at, names
+
+        return names
 
 
 class PageButton:
@@ -64,8 +155,9 @@ class PageButton:
                  border_width=None, border_color="black",
                  text_size="16px", text_font="Verdana", text_color="black",
                  text_horizontal_align="center", text_vertical_align="center",
-                 linked_action=None, script=None):
-        self.id = uuid4().hex
+                 linked_action=None, script=None, on_retrigger=OnRetrigger.PARALLEL):
+        # assigned by the page, as it depends on the page and the other controls
+        self.id = None
 
         self.row = row
         self.col = col
@@ -87,27 +179,75 @@ class PageButton:
 
         self.linked_action = linked_action
         self.script = script
+        self.on_retrigger = on_retrigger
 
         if Simpyt.current.debug and self.border_width is None:
             # when in debug mode, show all hidden buttons
             self.border_width = "2px"
             self.border_color = "green"
 
+    @property
+    def source(self):
+        """
+        A description of the button, to know where running scripts come from.
+        """
+        return f"page button at {self.col} {self.row}"
+
     def press_button(self):
         """
-        The button was pressed.
+        The button was clicked (pressed and released). Used by clients that can't hold buttons
+        pressed, so everything is just ran in UNLINKED mode, as a single script.
+        """
+        if Simpyt.current.debug:
+            print("Clicked button at", self.col, self.row)
+
+        actions = []
+        if self.linked_action:
+            actions.append(self.linked_action)
+        if self.script:
+            actions.extend(self.script.actions)
+
+        if actions:
+            ScriptsEngine.get().start(Script(actions), self.source, self.id, self.on_retrigger)
+
+    def hold_down(self):
+        """
+        The button started being held down. Linked actions are quick, so they are ran right away
+        to preserve the order of presses and releases. Anything else is ran together as a single
+        script by the scripts engine.
         """
         if Simpyt.current.debug:
             print("Pressed button at", self.col, self.row)
 
-        # TODO right now I don't have a way to hold buttons pressed on the web, so I can't
-        # implement something like in the midi controls where you can hold down a button. So
-        # everything is just ran on press and in UNLINKED mode, no hold vs release logic
+        background_actions = []
+
+        # linked actions simulate the pressing down, and then releasing
+        # unlinked actions just run in the press down phase
         if self.linked_action:
-            self.linked_action.run(Action.Mode.UNLINKED)
+            if self.linked_action.CAN_BE_LINKED:
+                mark("action_start", self.linked_action)
+                self.linked_action.run(Action.Mode.LINKED_CONTROL_PRESS)
+            else:
+                background_actions.append(self.linked_action)
 
+        # scripts are just on/off
         if self.script:
-            self.script.run()
+            background_actions.extend(self.script.actions)
+
+        if background_actions:
+            ScriptsEngine.get().start(Script(background_actions), self.source,
+                                      self.id, self.on_retrigger)
+
+    def release(self):
+        """
+        The button stopped being held down.
+        """
+        if Simpyt.current.debug:
+            print("Released button at", self.col, self.row)
+
+        if self.linked_action and self.linked_action.CAN_BE_LINKED:
+            mark("action_start", self.linked_action)
+            self.linked_action.run(Action.Mode.LINKED_CONTROL_RELEASE)
 
     @classmethod
     def parse_at(cls, raw_at):
@@ -152,8 +292,10 @@ class PageButton:
 
         at_args = cls.parse_at(raw_config.pop("at"))
         linked_action, script = Action.deserialize(raw_config)
+        on_retrigger = OnRetrigger.deserialize(raw_config.pop("on_retrigger", "parallel"))
 
-        return cls(**at_args, linked_action=linked_action, script=script, **raw_config)
+        return cls(**at_args, linked_action=linked_action, script=script,
+                   on_retrigger=on_retrigger, **raw_config)
 
 
 def web_app_loop():
@@ -161,11 +303,11 @@ def web_app_loop():
     Run the main loop of the web app integration.
     """
     # imported here to prevent circular imports
-    from pages_web_app import initialize_web_app
+    from pages_web_app import initialize_web_app, serve_web_app
 
     for page_name in Page.configured_pages():
         try:
-            Page.read(page_name)
+            Page.get(page_name)
 
             print("Page found and configured:", page_name)
         except ImproperlyConfiguredException as ex:
@@ -174,8 +316,8 @@ def web_app_loop():
         except Exception as ex:
             print(f"Page found but failed to read its config!: {page_name}\n{ex}")
 
-    web_app = initialize_web_app()
-    web_app.run(host="0.0.0.0", port=9999)
+    initialize_web_app()
+    serve_web_app(host="0.0.0.0", port=9999)
 
 
 def launch_pages_server():
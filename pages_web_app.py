@@ -1,20 +1,296 @@
-from threading import Thread
+from hashlib import sha1
+from queue import Full, Queue
+from threading import Thread, local
+from time import perf_counter
+import gzip
+import json
 import logging
 
-from flask import Flask, render_template, redirect, send_from_directory, cli
+from flask import Flask, Response, render_template, redirect, request, cli
+from flask_sock import Sock
+from werkzeug.exceptions import NotFound
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+from werkzeug.wsgi import LimitedStream
 
+from actions import Joystick
+from files_cache import FilesCache
+from launcher import Launcher
+from metrics import Metrics, Trace, mark
+from images import ImagesResizer, SpriteAtlasRenderer, RESIZE_STEP, ATLAS_UNIT_STEP, ATLAS_MAX_UNIT
 from pages import Page
 from core import Simpyt
+from scripts import ScriptsEngine
+from timing import Timer
+
+try:
+    import brotli
+except ImportError:
+    # without brotli, pages are still served compressed with gzip
+    brotli = None
 
 
 web_app = Flask("simpyt")
+sock = Sock(web_app)
+
+# clients of the control channel send a keepalive message every few seconds. If we don't receive
+# anything for this long, we consider the connection dropped
+CONTROL_CHANNEL_TIMEOUT = 5
+
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    """
+    Request handler that keeps connections open between requests, until they are idle for a while.
+
+    The Werkzeug handler always closes connections, because after each response it discards
+    anything else the client sent, which could be the next request. Here we only discard what's
+    left of the body of the current request instead.
+    """
+    protocol_version = "HTTP/1.1"
+
+    # seconds a connection can go without sending anything while handling a request. Must be
+    # longer than the keepalive interval of the control channel, or its connections would be
+    # closed
+    timeout = 15
+    # seconds a connection is kept open (and its worker busy) waiting for its next request
+    idle_timeout = 3
+
+    def handle_one_request(self):
+        """
+        Wait for the next request of the connection, and handle it.
+        """
+        self.connection.settimeout(self.idle_timeout)
+        super().handle_one_request()
+
+    def run_wsgi(self):
+        """
+        Run the web app for the current request, and write its response.
+        """
+        self.connection.settimeout(self.timeout)
+
+        if self.headers.get("Expect", "").lower().strip() == "100-continue":
+            self.wfile.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+
+        self.environ = environ = self.make_environ()
+
+        if environ.get("HTTP_UPGRADE"):
+            # upgraded connections (websockets) are taken over by the app for as long as the page
+            # is open, so they get their own thread instead of holding a worker of the pool
+            self.server.detach_worker()
+
+        if environ.get("wsgi.input_terminated") or environ.get("HTTP_UPGRADE"):
+            # chunked bodies can't be easily skipped, and upgraded connections are taken over by
+            # the app, so none of them can be reused
+            self.close_connection = True
+            request_body = None
+        else:
+            request_body = LimitedStream(self.rfile, int(environ.get("CONTENT_LENGTH") or 0))
+            environ["wsgi.input"] = request_body
+
+        response_status_and_headers = []
+        response_sent = []
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response_sent:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response_status_and_headers[:] = [status, headers]
+            return write
+
+        def write(data):
+            if not response_sent:
+                status, headers = response_status_and_headers
+                code, _, message = status.partition(" ")
+                self.send_response(int(code), message)
+
+                headers_names = set()
+                for name, value in headers:
+                    self.send_header(name, value)
+                    headers_names.add(name.lower())
+
+                # 1xx, 204 and 304 responses never have a body (nor HEAD responses), so they
+                # don't need a length either
+                has_body = not (
+                    environ["REQUEST_METHOD"] == "HEAD"
+                    or 100 <= int(code) < 200
+                    or int(code) in (204, 304)
+                )
+                if has_body and "content-length" not in headers_names:
+                    # without a length, the only way for the client to know where the
+                    # response ends is to close the connection
+                    self.close_connection = True
+                elif self.server.is_busy():
+                    # other connections are waiting for a worker, don't keep this one
+                    self.close_connection = True
+
+                if self.close_connection:
+                    self.send_header("Connection", "close")
+                self.end_headers()
+                response_sent.append(True)
+
+            self.wfile.write(data)
+            self.wfile.flush()
+
+        try:
+            response_iter = self.server.app(environ, start_response)
+            try:
+                for data in response_iter:
+                    write(data)
+                if not response_sent:
+                    write(b"")
+            finally:
+                if hasattr(response_iter, "close"):
+                    response_iter.close()
+
+            if request_body is not None:
+                request_body.exhaust()
+        except (ConnectionError, TimeoutError) as ex:
+            self.connection_dropped(ex, environ)
+        except Exception as ex:
+            self.close_connection = True
+            if not response_sent and not environ.get("HTTP_UPGRADE"):
+                response_status_and_headers[:] = ["500 INTERNAL SERVER ERROR", []]
+                write(b"")
+            self.server.log("error", f"Error on request {self.path}: {ex!r}")
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """
+    WSGI server handling the connections in a bounded pool of worker threads, instead of a new
+    thread per connection like the Flask development server does.
+
+    Connections wait in line when all the workers are busy, and are rejected if the line is too
+    long. Connections taken over by the app for a long time (websockets) leave the pool, and a
+    new worker takes their place.
+    """
+    multithread = True
+
+    # max amount of connections waiting for a worker
+    QUEUE_LIMIT = 256
+
+    REJECTED_RESPONSE = (b"HTTP/1.1 503 Service Unavailable\r\n"
+                         b"Content-Length: 0\r\n"
+                         b"Connection: close\r\n\r\n")
+
+    def __init__(self, host, port, app, workers):
+        super().__init__(host, port, app, handler=KeepAliveRequestHandler)
+        self.connections = Queue(maxsize=self.QUEUE_LIMIT)
+        # each worker knows if it was detached from the pool
+        self.worker_state = local()
+
+        for _ in range(workers):
+            self.start_worker()
+
+    def start_worker(self):
+        """
+        Start a worker thread of the pool.
+        """
+        Thread(target=self.worker_loop, daemon=True, name="web_worker").start()
+
+    def worker_loop(self):
+        """
+        Keep serving connections, until the worker is detached from the pool.
+        """
+        self.worker_state.detached = False
+        while not self.worker_state.detached:
+            request, client_address = self.connections.get()
+            self.process_request_in_worker(request, client_address)
+
+    def detach_worker(self):
+        """
+        Take the current worker out of the pool when its connection ends, replacing it with a new
+        worker right away.
+        """
+        if not self.worker_state.detached:
+            self.worker_state.detached = True
+            self.start_worker()
+
+    def is_busy(self):
+        """
+        Are there connections waiting for a worker?
+        """
+        return not self.connections.empty()
+
+    def process_request(self, request, client_address):
+        """
+        Hand the connection to the workers, or reject it if too many are waiting already.
+        """
+        try:
+            self.connections.put_nowait((request, client_address))
+        except Full:
+            try:
+                request.sendall(self.REJECTED_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+
+    def process_request_in_worker(self, request, client_address):
+        """
+        Serve all the requests of a connection, and then close it.
+        """
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+class RenderedPage:
+    """
+    The html of a page, rendered only once and kept in memory, together with its compressed
+    variants, ready to be served.
+    """
+    def __init__(self, html):
+        body = html.encode("utf-8")
+
+        self.bodies_by_encoding = {
+            "identity": body,
+            "gzip": gzip.compress(body),
+        }
+        if brotli is not None:
+            self.bodies_by_encoding["br"] = brotli.compress(body)
+
+        self.etag = sha1(body).hexdigest()
+
+    def response(self):
+        """
+        Build the response for the current request, in the best encoding the client accepts, or
+        a 304 if the client already has this version.
+        """
+        encoding = request.accept_encodings.best_match(
+            ["br", "gzip", "identity"] if brotli is not None else ["gzip", "identity"],
+            default="identity",
+        )
+        # each encoding is a different representation, so they need different etags
+        etag = f"{self.etag}-{encoding}"
+
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(self.bodies_by_encoding[encoding], mimetype="text/html")
+            if encoding != "identity":
+                response.content_encoding = encoding
+
+        response.set_etag(etag)
+        response.vary.add("Accept-Encoding")
+        # clients can keep the page, but must check it's still the same version before using it
+        response.cache_control.no_cache = True
+
+        return response
 
 
 def initialize_web_app():
     """
     Configure the web app to run in the Simpyt context.
     """
-    web_app.pages_cache = {}
+    # already rendered pages, by name, as (page, versions of its images, rendered page) tuples
+    web_app.rendered_pages = {}
+
+    web_app.images_cache = FilesCache(Simpyt.current.images_path, "/image")
+    web_app.assets_cache = FilesCache(Simpyt.current.assets_path, "/assets")
+    web_app.images_resizer = ImagesResizer(web_app.images_cache)
+    web_app.atlas_renderer = SpriteAtlasRenderer(web_app.images_cache)
+    web_app.jinja_env.globals["image_url"] = web_app.images_cache.versioned_url
+    web_app.jinja_env.globals["asset_url"] = web_app.assets_cache.versioned_url
 
     if not Simpyt.current.web_debug:
         web_app.logger.disabled = True
@@ -24,6 +300,18 @@ def initialize_web_app():
     return web_app
 
 
+def serve_web_app(host, port):
+    """
+    Serve the web app, with a pool of workers able to handle many clients at once. In web debug
+    mode, the Flask development server is used instead.
+    """
+    if Simpyt.current.web_debug:
+        web_app.run(host=host, port=port)
+    else:
+        server = PooledWSGIServer(host, port, web_app, workers=Simpyt.current.web_workers)
+        server.serve_forever()
+
+
 @web_app.route("/")
 def home():
     """
@@ -43,10 +331,27 @@ def page_show(page_name):
     Show a particular page with controls.
     """
     try:
-        page = Page.read(page_name)
-        web_app.pages_cache[page_name] = page
+        page = Page.get(page_name)
+
+        # the html includes the urls of the current versions of the images
+        images_urls = [web_app.images_cache.versioned_url(image) for image in page.images()]
 
-        return render_template("page.html", page=page)
+        rendered_page_page, rendered_images_urls, rendered_page = web_app.rendered_pages.get(
+            page_name, (None, None, None)
+        )
+        if rendered_page_page is not page or rendered_images_urls != images_urls:
+            # first visit, or the page or its images changed since it was rendered
+            rendered_page = RenderedPage(render_template(
+                "page.html",
+                page=page,
+                atlas=web_app.atlas_renderer.atlas_for(page),
+                resize_step=RESIZE_STEP,
+                atlas_unit_step=ATLAS_UNIT_STEP,
+                atlas_max_unit=ATLAS_MAX_UNIT,
+            ))
+            web_app.rendered_pages[page_name] = page, images_urls, rendered_page
+
+        return rendered_page.response()
     except Exception as err:
         return render_template("page_error.html", error=str(err),
                                simpyt=Simpyt.current)
@@ -57,21 +362,126 @@ def activate_control(page_name, control_id):
     """
     Run the actions associated to a particular control of a particular page.
     """
-    page = web_app.pages_cache[page_name]
-    control, = [ctrl for ctrl in page.controls if ctrl.id == control_id]
+    received_at = perf_counter()
+    control = Page.get_control(page_name, control_id)
 
-    control_run_thread = Thread(target=control.press_button)
-    control_run_thread.start()
+    with Trace("page", page_name, control.source, received_at):
+        mark("dispatch")
+        control.press_button()
 
     return {"result": "ok"}
 
 
+@sock.route("/control_channel/<string:page_name>")
+def control_channel(ws, page_name):
+    """
+    Persistent channel used by pages to hold down and release controls. Clients send json
+    messages with an "event" (press, release or keepalive) and the "control" id.
+    Any control still held down when the connection drops is released.
+    """
+    held_controls = {}
+
+    try:
+        while True:
+            raw_message = ws.receive(timeout=CONTROL_CHANNEL_TIMEOUT)
+            if raw_message is None:
+                # no keepalive, the client is gone
+                break
+            received_at = perf_counter()
+
+            try:
+                message = json.loads(raw_message)
+                event = message["event"]
+
+                if event == "press":
+                    control = Page.get_control(page_name, message["control"])
+                    held_controls[control.id] = control
+                    with Trace("page", page_name, control.source, received_at):
+                        mark("dispatch")
+                        control.hold_down()
+                elif event == "release":
+                    control = held_controls.pop(message["control"], None)
+                    if control is not None:
+                        with Trace("page", page_name, control.source, received_at):
+                            mark("dispatch")
+                            control.release()
+            except Exception as ex:
+                print(f"Error handling a control event in page {page_name}: {ex}")
+    finally:
+        for control in held_controls.values():
+            control.release()
+
+
+@web_app.route("/joysticks")
+def joysticks_state():
+    """
+    Current state of the buttons and axes of all the virtual joysticks.
+    """
+    return Joystick.snapshots()
+
+
+@web_app.route("/scripts")
+def scripts_list():
+    """
+    Scripts that are currently running or waiting to start.
+    """
+    return ScriptsEngine.get().snapshot()
+
+
+@web_app.route("/scripts/<int:run_id>/cancel")
+def script_cancel(run_id):
+    """
+    Cancel a script that is running or waiting to start.
+    """
+    if not ScriptsEngine.get().cancel(run_id):
+        raise NotFound()
+
+    return {"result": "ok"}
+
+
+@web_app.route("/commands")
+def commands_list():
+    """
+    Processes launched by run actions, running or recently finished.
+    """
+    return Launcher.get().snapshot()
+
+
+@web_app.route("/metrics")
+def metrics_export():
+    """
+    Latency metrics, in the prometheus text format.
+    """
+    return Response(Metrics.get().render(), mimetype="text/plain; version=0.0.4")
+
+
+@web_app.route("/timing")
+def timing_stats():
+    """
+    Stats about the precision of the waits done by actions.
+    """
+    return Timer.get().stats()
+
+
 @web_app.route("/image/<path:image_path>")
 def image_show(image_path):
     """
-    Serve a particular image.
+    Serve a particular image, resized if a size was requested.
     """
-    return send_from_directory(Simpyt.current.images_path, image_path)
+    return web_app.images_resizer.response(image_path)
+
+
+@web_app.route("/atlas/<string:page_name>")
+def atlas_show(page_name):
+    """
+    Serve the sprite atlas with the images of the controls of a page.
+    """
+    try:
+        page = Page.get(page_name)
+    except FileNotFoundError:
+        raise NotFound()
+
+    return web_app.atlas_renderer.response(page)
 
 
 @web_app.route("/assets/<path:asset_path>")
@@ -79,7 +489,7 @@ def assets_send(asset_path):
     """
     Serve the assets.
     """
-    return send_from_directory(Simpyt.current.assets_path, asset_path)
+    return web_app.assets_cache.response(asset_path)
 
 
 @web_app.route("/stop")
@@ -0,0 +1,239 @@
+from concurrent.futures import Future
+from enum import Enum
+from itertools import count
+from threading import Lock, Thread
+from time import time
+import asyncio
+
+from core import ImproperlyConfiguredException
+from metrics import current_trace, mark
+
+
+class OnRetrigger(Enum):
+    """
+    What to do when a control triggers its script again, while previous runs of it haven't
+    finished.
+    """
+    # run it after the previous runs finish
+    QUEUE = "queue"
+    # ignore the new trigger
+    DROP = "drop"
+    # cancel the previous runs, and start again
+    RESTART = "restart"
+    # run it at the same time as the previous runs
+    PARALLEL = "parallel"
+
+    @classmethod
+    def deserialize(cls, raw_config):
+        """
+        Read the 'on_retrigger' attribute of a control.
+        """
+        try:
+            return cls(raw_config)
+        except ValueError as ex:
+            valid_values = ", ".join(on_retrigger.value for on_retrigger in cls)
+            raise ImproperlyConfiguredException(
+                f"The 'on_retrigger' attribute of a control must be one of: {valid_values}\n"
+                f"on_retrigger: {raw_config}"
+            ) from ex
+
+
+class ScriptRun:
+    """
+    A single run of a script, started by some control (the source).
+    """
+    QUEUED = "queued"
+    RUNNING = "running"
+
+    def __init__(self, id_, script, source, control_id=None):
+        self.id = id_
+        self.script = script
+        self.source = source
+        self.control_id = control_id
+
+        self.state = self.QUEUED
+        self.queued_at = time()
+        self.started_at = None
+
+        # set by the engine once the run is scheduled: the event loop running it, its task in
+        # that loop, and a future to wait for it from other threads (done only after the run
+        # finished its cleanup, like releasing keys)
+        self.loop = None
+        self.task = None
+        self.future = Future()
+
+    def cancel(self):
+        """
+        Stop the run, or prevent it from starting if it's still queued. Can be called from any
+        thread.
+        """
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._cancel_task)
+
+    def _cancel_task(self):
+        """
+        Cancel the task of the run, from the event loop.
+        """
+        if self.task is not None:
+            self.task.cancel()
+
+    def snapshot(self):
+        """
+        Get a summary of the run, with its id, source, state and times.
+        """
+        return dict(
+            id=self.id,
+            source=self.source,
+            state=self.state,
+            queued_at=self.queued_at,
+            started_at=self.started_at,
+        )
+
+
+class ScriptsEngine:
+    """
+    Runs all the scripts as coroutines in a single event loop, with its own thread. Scripts
+    waiting (like in wait actions) don't use any thread, so thousands of them can be running at
+    the same time.
+    Runs that haven't finished can be listed and cancelled.
+
+    Controls decide what happens when they trigger their script again while previous runs haven't
+    finished (see OnRetrigger). Queues are limited, so mashing a button can't pile up work.
+    """
+
+    # max amount of unfinished runs of the same control, when queueing them
+    QUEUE_LIMIT = 8
+
+    # the engine in use, created when first needed
+    _current = None
+    _current_lock = Lock()
+
+    @classmethod
+    def get(cls):
+        """
+        Get the scripts engine, creating and starting it if it wasn't used before.
+        """
+        with cls._current_lock:
+            if cls._current is None:
+                cls._current = cls()
+
+            return cls._current
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+
+        # runs that haven't finished, by id, and by control (in the order they were started)
+        self.runs = {}
+        self.runs_by_control = {}
+        self.runs_lock = Lock()
+        self.ids = count(1)
+
+        self.thread = Thread(target=self.loop.run_forever, daemon=True, name="scripts_engine")
+        self.thread.start()
+
+    def start(self, script, source, control_id=None, on_retrigger=OnRetrigger.PARALLEL):
+        """
+        Start running a script (from any thread), returning its ScriptRun. If the control that
+        triggered it is specified, its on_retrigger policy is applied, and the returned run might
+        be None if it was dropped.
+        """
+        # tasks don't inherit the context of other threads, so the trace is passed explicitly
+        trace = current_trace.get()
+
+        with self.runs_lock:
+            previous_runs = list(self.runs_by_control.get(control_id, [])) if control_id else []
+
+            if previous_runs:
+                if on_retrigger == OnRetrigger.DROP:
+                    return None
+                if on_retrigger == OnRetrigger.QUEUE and len(previous_runs) >= self.QUEUE_LIMIT:
+                    return None
+
+            script_run = ScriptRun(next(self.ids), script, source, control_id)
+            self.runs[script_run.id] = script_run
+            if control_id:
+                self.runs_by_control.setdefault(control_id, []).append(script_run)
+
+            wait_for = []
+            if on_retrigger == OnRetrigger.QUEUE:
+                # all of them and not just the last one, as any of them could be cancelled
+                wait_for = previous_runs
+            elif on_retrigger == OnRetrigger.RESTART:
+                # the new run waits for the cancelled runs to finish their cleanup, so they
+                # release their keys before the new one presses them again
+                for previous_run in previous_runs:
+                    previous_run.cancel()
+                wait_for = previous_runs
+
+            # the loop runs its callbacks in order, so the tasks of the previous runs already
+            # exist when this one is created, and cancelling any of them finds its task
+            script_run.loop = self.loop
+            self.loop.call_soon_threadsafe(self._create_task, script_run, wait_for, trace)
+
+        mark("queue")
+        return script_run
+
+    def _create_task(self, script_run, wait_for, trace):
+        """
+        Create the task of a run, from the event loop.
+        """
+        script_run.task = self.loop.create_task(self._run(script_run, wait_for, trace))
+        script_run.task.add_done_callback(lambda _: self._finish(script_run))
+
+    async def _run(self, script_run, wait_for, trace):
+        """
+        Run a script, after the runs it's queued behind (if any), reporting its errors.
+        """
+        # each task has its own context, so this trace is only seen by this run
+        current_trace.set(trace)
+
+        if wait_for:
+            # asyncio.wait doesn't raise if the other runs fail or are cancelled
+            await asyncio.wait([previous_run.task for previous_run in wait_for])
+
+        script_run.state = ScriptRun.RUNNING
+        script_run.started_at = time()
+
+        try:
+            await script_run.script.run()
+        except Exception as ex:
+            print(f"Error running script from {script_run.source}: {ex}")
+
+    def _finish(self, script_run):
+        """
+        Forget a run that finished or was cancelled (after its cleanup), and let the ones
+        waiting for it know.
+        """
+        with self.runs_lock:
+            self.runs.pop(script_run.id, None)
+
+            control_runs = self.runs_by_control.get(script_run.control_id)
+            if control_runs is not None:
+                control_runs.remove(script_run)
+                if not control_runs:
+                    del self.runs_by_control[script_run.control_id]
+
+        if script_run.task.cancelled():
+            script_run.future.cancel()
+        else:
+            script_run.future.set_result(None)
+
+    def cancel(self, run_id):
+        """
+        Cancel a run by id. Returns False if there's no unfinished run with that id.
+        """
+        with self.runs_lock:
+            script_run = self.runs.get(run_id)
+
+        if script_run is None:
+            return False
+
+        script_run.cancel()
+        return True
+
+    def snapshot(self):
+        """
+        Get a summary of all the runs that haven't finished, queued or running.
+        """
+        with self.runs_lock:
+            return [script_run.snapshot() for script_run in self.runs.values()]
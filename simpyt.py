@@ -13,5 +13,10 @@ if __name__ == "__main__":
         root_configs_path=(used_executable_dir_path / "simpyt_configs").absolute(),
         debug="-d" in sys.argv,
         web_debug="-wd" in sys.argv,
+        midi_capture_path=next(
+            (Path(arg.split("=", 1)[1]).absolute()
+             for arg in sys.argv if arg.startswith("--capture-midi=")),
+            None,
+        ),
     )
     simpyt_app.run()
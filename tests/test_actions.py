@@ -0,0 +1,58 @@
+import pytest
+
+from actions import Action, JoystickAction, KeysAction, RunCommand, Wait
+from core import ImproperlyConfiguredException
+
+
+def test_available_actions():
+    assert Action.ACTIONS_BY_PREFIX["keys"] is KeysAction
+    assert Action.ACTIONS_BY_PREFIX["wait"] is Wait
+    assert Action.ACTIONS_BY_PREFIX["run"] is RunCommand
+    assert Action.ACTIONS_BY_PREFIX["joystick"] is JoystickAction
+
+
+@pytest.mark.parametrize(
+    "raw_config,expected_action",
+    [("keys a", KeysAction), ("run notepad.exe", RunCommand), ("wait 1", Wait)],
+)
+def test_find_and_deserialize(raw_config, expected_action):
+    assert isinstance(Action.find_and_deserialize(raw_config), expected_action)
+
+
+@pytest.mark.parametrize("raw_config", ["press a", "keys", "keys notakey", "wait soon"])
+def test_find_and_deserialize_incorrect(raw_config):
+    with pytest.raises(ImproperlyConfiguredException):
+        Action.find_and_deserialize(raw_config)
+
+
+def test_deserialize_control_actions():
+    control_config = {
+        "some_random_config": 42,
+        "action": "keys ctrl a",
+        "script": [
+            "keys a b",
+            "wait 1.5",
+            "run /path/to/executable.exe",
+            "keys esc",
+        ],
+    }
+    linked_action, script = Action.deserialize(control_config)
+
+    assert isinstance(linked_action, KeysAction)
+    assert linked_action.keys == ["ctrl", "a"]
+
+    press_action, wait_action, run_action, press_action2 = script.actions
+    assert isinstance(press_action, KeysAction)
+    assert press_action.keys == ["a", "b"]
+
+    assert isinstance(wait_action, Wait)
+    assert wait_action.seconds_to_wait == 1.5
+
+    assert isinstance(run_action, RunCommand)
+    assert run_action.command == "/path/to/executable.exe"
+
+    assert isinstance(press_action2, KeysAction)
+    assert press_action2.keys == ["esc"]
+
+    # the rest of the config is left for the control
+    assert control_config == {"some_random_config": 42}
@@ -0,0 +1,103 @@
+import os
+
+import pytest
+from flask import Flask
+from werkzeug.exceptions import NotFound
+
+from files_cache import BoundedCache, FilesCache
+
+
+app = Flask("test")
+
+
+def test_cache_forgets_the_least_recently_used_items():
+    cache = BoundedCache(max_size=10)
+    cache.put("a", "A", 4)
+    cache.put("b", "B", 4)
+    # now "a" is the most recently used
+    cache.get("a")
+
+    cache.put("c", "C", 4)
+
+    assert cache.get("a") == "A"
+    assert cache.get("b") is None
+    assert cache.get("c") == "C"
+    assert cache.size == 8
+
+
+def test_cache_doesnt_store_items_bigger_than_itself():
+    cache = BoundedCache(max_size=10)
+    cache.put("a", "A", 4)
+
+    cache.put("b", "B", 11)
+
+    assert cache.get("a") == "A"
+    assert cache.get("b") is None
+
+
+def test_cache_replaces_items():
+    cache = BoundedCache(max_size=10)
+    cache.put("a", "A", 4)
+
+    cache.put("a", "AA", 8)
+
+    assert cache.get("a") == "AA"
+    assert cache.size == 8
+
+
+@pytest.fixture
+def files(tmp_path):
+    files_path = tmp_path / "files"
+    files_path.mkdir()
+    (tmp_path / "secret.txt").write_text("secret")
+    return files_path
+
+
+def write_file(files_path, name, content, mtime=1000):
+    file_path = files_path / name
+    file_path.write_text(content)
+    os.utime(file_path, (mtime, mtime))
+
+
+def test_files_are_read_again_when_they_change(files):
+    files_cache = FilesCache(files, "/files")
+    write_file(files, "a.txt", "first")
+    assert files_cache.get("a.txt").content == b"first"
+
+    # same size, only the modification time tells it changed
+    write_file(files, "a.txt", "secnd", mtime=2000)
+    assert files_cache.get("a.txt").content == b"secnd"
+
+
+def test_files_arent_read_again_while_they_dont_change(files):
+    files_cache = FilesCache(files, "/files")
+    write_file(files, "a.txt", "first")
+    cached_file = files_cache.get("a.txt")
+
+    assert files_cache.get("a.txt") is cached_file
+
+
+def test_files_outside_the_folder_arent_served(files):
+    files_cache = FilesCache(files, "/files")
+
+    with pytest.raises(NotFound):
+        files_cache.get("../secret.txt")
+    with pytest.raises(NotFound):
+        files_cache.get("missing.txt")
+
+
+def test_files_requested_with_their_version_are_cached_forever(files):
+    files_cache = FilesCache(files, "/files")
+    write_file(files, "a.txt", "first")
+    url = files_cache.versioned_url("a.txt")
+    assert url == f"/files/a.txt?v={files_cache.get('a.txt').version}"
+
+    with app.test_request_context(url):
+        response = files_cache.response("a.txt")
+    assert response.cache_control.immutable
+    assert response.get_data() == b"first"
+
+    with app.test_request_context("/files/a.txt"):
+        response = files_cache.response("a.txt")
+    assert not response.cache_control.immutable
+    assert response.cache_control.no_cache
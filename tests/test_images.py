@@ -0,0 +1,79 @@
+from io import BytesIO
+from types import SimpleNamespace
+
+import pytest
+from flask import Flask
+from PIL import Image
+
+from files_cache import FilesCache
+from images import ImagesResizer, SpriteAtlas
+
+
+app = Flask("test")
+
+SVG = b'<svg xmlns="http://www.w3.org/2000/svg" width="500" height="500"></svg>'
+
+
+def png(width, height, color="red"):
+    output = BytesIO()
+    Image.new("RGB", (width, height), color).save(output, format="PNG")
+    return output.getvalue()
+
+
+def animated_gif(width, height):
+    frames = [Image.new("P", (width, height), color) for color in (1, 2, 3)]
+    output = BytesIO()
+    frames[0].save(output, format="GIF", save_all=True, append_images=frames[1:])
+    return output.getvalue()
+
+
+@pytest.fixture
+def images(tmp_path):
+    (tmp_path / "big.png").write_bytes(png(1000, 500))
+    (tmp_path / "icon.svg").write_bytes(SVG)
+    (tmp_path / "animated.gif").write_bytes(animated_gif(1000, 500))
+    return FilesCache(tmp_path, "/image")
+
+
+def resized(images, image_path, width, height):
+    with app.test_request_context(f"/image/{image_path}?w={width}&h={height}"):
+        return ImagesResizer(images).response(image_path).get_data()
+
+
+def test_images_are_resized_to_the_requested_size(images):
+    with Image.open(BytesIO(resized(images, "big.png", 100, 100))) as image:
+        # rounded up to the resize step, keeping the aspect ratio
+        assert image.size == (128, 64)
+
+
+def test_images_pillow_cant_decode_are_served_as_they_are(images):
+    assert resized(images, "icon.svg", 100, 100) == SVG
+
+
+def test_animated_images_are_served_as_they_are(images):
+    assert resized(images, "animated.gif", 100, 100) == images.get("animated.gif").content
+
+
+def fake_page(*images_names):
+    controls = [
+        SimpleNamespace(id=f"control_{i}", image=image_name,
+                        col=i, row=0, col_end=i + 1, row_end=1)
+        for i, image_name in enumerate(images_names)
+    ]
+    return SimpleNamespace(name="test_page", controls=controls, width=len(controls))
+
+
+def test_atlas_leaves_out_images_pillow_cant_decode(images):
+    atlas = SpriteAtlas(fake_page("big.png", "icon.svg", "animated.gif"), images)
+
+    assert list(atlas.regions) == ["control_0"]
+    with Image.open(BytesIO(atlas.render(8))) as image:
+        assert image.size == (8, 8)
+
+
+def test_atlas_skips_images_that_break_after_packing(images):
+    atlas = SpriteAtlas(fake_page("big.png", "other.png"), images)
+    (images.root_path / "other.png").write_bytes(b"not really a png")
+
+    with Image.open(BytesIO(atlas.render(8))) as image:
+        assert image.size == (16, 8)
@@ -0,0 +1,85 @@
+import time
+
+import pytest
+
+from joystick_linux import (
+    Joystick, RecordingUinputFile, EV_KEY, EV_ABS, UI_DEV_CREATE, UI_DEV_DESTROY,
+)
+
+
+@pytest.fixture
+def joystick(mocker):
+    mocker.patch.object(Joystick, "UINPUT_FILE_CLASS", RecordingUinputFile)
+    return Joystick(1)
+
+
+def wait_for_frames(joystick, count, timeout=1):
+    deadline = time.monotonic() + timeout
+    while len(joystick.uinput.frames) < count and time.monotonic() < deadline:
+        time.sleep(0.001)
+    return joystick.uinput.frames
+
+
+def test_device_created(joystick):
+    assert joystick.uinput.ioctls[-1] == (UI_DEV_CREATE, 0)
+    assert joystick.uinput.device_setup[0].rstrip(b"\0") == b"Simpyt virtual joystick 1"
+
+
+def test_changes_grouped_in_a_single_frame(joystick):
+    with joystick._pending_condition:
+        # hold the output thread until all the changes are queued
+        joystick.press_button(1)
+        joystick.press_button(15)
+        joystick.move_axis(2, 0.25)
+        joystick.move_axis(2, 1)
+
+    frames = wait_for_frames(joystick, 1)
+    assert frames == [[
+        (EV_KEY, 0x120, 1),
+        (EV_KEY, 0x2c2, 1),
+        (EV_ABS, 0x01, Joystick.AXIS_MAX),
+    ]]
+
+
+def test_quick_press_and_release_not_lost(joystick):
+    with joystick._pending_condition:
+        joystick.press_button(3)
+        joystick.release_button(3)
+
+    frames = wait_for_frames(joystick, 2)
+    assert frames == [[(EV_KEY, 0x122, 1)], [(EV_KEY, 0x122, 0)]]
+
+
+def test_redundant_changes_not_sent(joystick):
+    joystick.press_button(1)
+    wait_for_frames(joystick, 1)
+    joystick.press_button(1)
+    joystick.move_axis(1, 0)
+
+    frames = wait_for_frames(joystick, 2)
+    assert frames == [[(EV_KEY, 0x120, 1)], [(EV_ABS, 0x00, 0)]]
+
+
+def test_device_destroyed_when_closed(joystick):
+    joystick.close()
+    assert joystick.uinput.ioctls[-1] == (UI_DEV_DESTROY, 0)
+    assert joystick.uinput.closed
+
+    # changes after closing it never reach the device
+    joystick.press_button(1)
+    assert wait_for_frames(joystick, 1, timeout=0.05) == []
+
+
+def test_get_creates_missing_joysticks_in_order(mocker):
+    mocker.patch.object(Joystick, "UINPUT_FILE_CLASS", RecordingUinputFile)
+    mocker.patch.object(Joystick, "_cache", [])
+
+    joystick = Joystick.get(3)
+
+    assert [snapshot["id"] for snapshot in Joystick.snapshots()] == [1, 2, 3]
+    assert [joystick.uinput.device_setup[0].rstrip(b"\0") for joystick in Joystick._cache] == [
+        b"Simpyt virtual joystick 1",
+        b"Simpyt virtual joystick 2",
+        b"Simpyt virtual joystick 3",
+    ]
+    assert Joystick.get(3) is joystick
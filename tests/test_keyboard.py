@@ -0,0 +1,71 @@
+import pytest
+
+import actions
+from actions import Action, KeysAction, Pacing
+from core import ImproperlyConfiguredException
+from keyboard_base import RecordingKeyboard
+from keyboard_linux import KEYSYMS
+from keyboard_windows import SCAN_CODES, VIRTUAL_KEY_CODES, build_input, KEYEVENTF_EXTENDEDKEY
+
+
+@pytest.fixture
+def keyboard(mocker):
+    keyboard = RecordingKeyboard()
+    mocker.patch.object(actions.Keyboard, "get", return_value=keyboard)
+    return keyboard
+
+
+def test_chord_sent_in_single_batches(keyboard):
+    action = KeysAction.deserialize("ctrlright shiftright h")
+    action.run(action.Mode.LINKED_CONTROL_PRESS)
+    action.run(action.Mode.LINKED_CONTROL_RELEASE)
+
+    assert [events for _, events in keyboard.batches] == [
+        [("ctrlright", True), ("shiftright", True), ("h", True)],
+        [("h", False), ("shiftright", False), ("ctrlright", False)],
+    ]
+
+
+def test_unlinked_keys_held_down_for_pacing_hold(keyboard):
+    action = Action.find_and_deserialize("keys a b", Pacing(hold=0.2))
+    action.run(action.Mode.UNLINKED)
+
+    (pressed_at, _), (released_at, _) = keyboard.batches
+    assert 0.2 <= released_at - pressed_at < 0.3
+
+
+def test_key_interval_sends_keys_one_by_one(keyboard):
+    action = Action.find_and_deserialize("keys ctrl a", Pacing(key_interval=0.05))
+    action.run(action.Mode.LINKED_CONTROL_PRESS)
+
+    (first_at, first_events), (second_at, second_events) = keyboard.batches
+    assert first_events == [("ctrl", True)]
+    assert second_events == [("a", True)]
+    assert second_at - first_at >= 0.05
+
+
+def test_control_pacing_used_by_all_its_actions():
+    raw_config = dict(action="keys a", script=["keys b", "write hi"], pacing=dict(hold=0.01))
+    linked_action, script = Action.deserialize(raw_config)
+
+    assert linked_action.pacing.hold_seconds == 0.01
+    assert all(action.pacing.hold_seconds == 0.01 for action in script.actions)
+    # not specified, so the global one is used
+    assert linked_action.pacing.key_interval_seconds == Pacing.DEFAULT_KEY_INTERVAL
+
+
+@pytest.mark.parametrize("raw_pacing", [dict(hold=-1), dict(hold="slow"), dict(speed=1), 0.1])
+def test_incorrect_pacing(raw_pacing):
+    with pytest.raises(ImproperlyConfiguredException):
+        Action.deserialize(dict(action="keys a", pacing=raw_pacing))
+
+
+@pytest.mark.parametrize("key", KeysAction.VALID_KEYS)
+def test_all_valid_keys_supported_in_all_platforms(key):
+    assert key in KEYSYMS
+    assert key in SCAN_CODES or key in VIRTUAL_KEY_CODES
+
+
+def test_extended_keys_flagged():
+    assert build_input("ctrlright", True).ki.dwFlags & KEYEVENTF_EXTENDEDKEY
+    assert not build_input("ctrlleft", True).ki.dwFlags & KEYEVENTF_EXTENDEDKEY
@@ -0,0 +1,65 @@
+from time import sleep
+import platform
+
+import pytest
+
+from launcher import Launcher, split_command
+
+
+# the commands used in these tests only exist in unix-like systems
+pytestmark = pytest.mark.skipif(platform.system() == "Windows", reason="needs unix commands")
+
+
+@pytest.fixture
+def launcher():
+    return Launcher(max_processes=3, max_processes_per_command=2)
+
+
+def wait_finished(launcher):
+    for _ in range(50):
+        if not launcher.snapshot()["running"]:
+            return
+        sleep(0.1)
+
+
+@pytest.mark.parametrize("command,expected_args", [
+    ("notepad.exe", ["notepad.exe"]),
+    ("firefox --new-tab 'http://localhost:9999'", ["firefox", "--new-tab", "http://localhost:9999"]),
+    ("ls | grep py", None),
+    ("echo $HOME", None),
+    ("sleep 1; echo done", None),
+])
+def test_split_command(command, expected_args):
+    assert split_command(command) == expected_args
+
+
+def test_processes_reaped_with_exit_code(launcher):
+    launch = launcher.launch("false", split_command("false"))
+    wait_finished(launcher)
+
+    assert not launch.shell
+    assert launch.process.returncode == launch.exit_code == 1
+    assert launch.launch_seconds > 0
+    finished, = launcher.snapshot()["finished"]
+    assert finished["exit_code"] == 1
+
+
+def test_shell_used_when_needed(launcher):
+    launch = launcher.launch("exit 3", split_command("exit 3"))
+    wait_finished(launcher)
+
+    # exit is a shell builtin, not a program
+    assert launch.shell
+    assert launch.exit_code == 3
+
+
+def test_limits(launcher):
+    sleep_1 = [launcher.launch("sleep 1", ["sleep", "1"]) for _ in range(3)]
+    sleep_2 = [launcher.launch("sleep 2", ["sleep", "2"]) for _ in range(2)]
+
+    # max 2 per command, and 3 in total
+    assert [launch is not None for launch in sleep_1] == [True, True, False]
+    assert [launch is not None for launch in sleep_2] == [True, False]
+
+    for launch in sleep_1[:2] + sleep_2[:1]:
+        launch.process.kill()
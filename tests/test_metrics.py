@@ -0,0 +1,67 @@
+from time import perf_counter, sleep
+
+import actions
+from actions import Action
+from joystick_linux import Joystick, RecordingUinputFile
+from keyboard_base import RecordingKeyboard
+from metrics import Metrics, Trace, mark
+
+
+def test_trace_marks_each_stage_once(mocker):
+    metrics = Metrics()
+    mocker.patch.object(Metrics, "get", return_value=metrics)
+    mocker.patch.object(actions.Keyboard, "get", return_value=RecordingKeyboard())
+
+    action = Action.find_and_deserialize("keys a")
+    with Trace("midi", "TEST-DEVICE", "midi note 40", received_at=0):
+        mark("dispatch")
+        mark("action_start", action)
+        action.run(action.Mode.LINKED_CONTROL_PRESS)
+        action.run(action.Mode.LINKED_CONTROL_RELEASE)
+
+    # outside of the trace, nothing is measured
+    action.run(action.Mode.LINKED_CONTROL_PRESS)
+
+    histograms = metrics.histograms["simpyt_interaction_stage_seconds"]
+    stages = {dict(labels)["stage"]: histogram.count for labels, histogram in histograms.items()}
+    assert stages == {"dispatch": 1, "action_start": 1, "backend": 1}
+
+
+def test_render_prometheus_format():
+    metrics = Metrics()
+    metrics.observe("simpyt_interaction_stage_seconds", 0.003, origin="page", source='a "page"')
+    metrics.observe("simpyt_interaction_stage_seconds", 10, origin="page", source='a "page"')
+
+    lines = metrics.render().splitlines()
+    labels = 'origin="page",source="a \\"page\\""'
+    assert "# TYPE simpyt_interaction_stage_seconds histogram" in lines
+    assert f'simpyt_interaction_stage_seconds_bucket{{{labels},le="0.0025"}} 0' in lines
+    assert f'simpyt_interaction_stage_seconds_bucket{{{labels},le="0.005"}} 1' in lines
+    assert f'simpyt_interaction_stage_seconds_bucket{{{labels},le="+Inf"}} 2' in lines
+    assert f"simpyt_interaction_stage_seconds_count{{{labels}}} 2" in lines
+
+
+def test_joystick_backend_marked_when_sent(mocker):
+    metrics = Metrics()
+    mocker.patch.object(Metrics, "get", return_value=metrics)
+    mocker.patch.object(Joystick, "UINPUT_FILE_CLASS", RecordingUinputFile)
+    joystick = Joystick(1)
+
+    sent_trace = Trace("midi", "TEST-DEVICE", "midi note 40", received_at=0)
+    redundant_trace = Trace("midi", "TEST-DEVICE", "midi note 40", received_at=0)
+    with joystick._pending_condition:
+        # hold the output thread until all the changes are queued
+        with sent_trace:
+            joystick.press_button(1)
+        with redundant_trace:
+            joystick.press_button(1)
+        # nothing was sent yet
+        assert sent_trace.marked_stages == set()
+
+    deadline = perf_counter() + 1
+    while not joystick.uinput.frames and perf_counter() < deadline:
+        sleep(0.001)
+    sleep(0.01)
+
+    assert sent_trace.marked_stages == {"backend"}
+    assert redundant_trace.marked_stages == set()
@@ -0,0 +1,381 @@
+from time import perf_counter, sleep
+import os
+
+import mido
+import pytest
+
+import actions
+from core import ImproperlyConfiguredException, Simpyt
+from keyboard_base import RecordingKeyboard
+from midi import MidiControl, MidiDevice, MidiDevicesWatcher, MidiReceiver
+
+
+CONTROLS_CONDITIONS = [
+    dict(when_control=1),
+    dict(when_control=1, when_channel=2),
+    dict(when_control=7),
+    dict(when_note=40),
+    dict(when_note=40, when_channel=0),
+    dict(when_note=1),
+    dict(when_is_program=True),
+    dict(when_is_program=True, when_channel=3),
+    dict(when_channel=2),
+    dict(),
+    dict(when_control=1, when_note=1),
+    dict(when_is_program=True, when_control=1),
+]
+
+MESSAGES = [
+    mido.Message("control_change", control=1, value=64),
+    mido.Message("control_change", control=1, value=0, channel=2),
+    mido.Message("control_change", control=7, value=127, channel=5),
+    mido.Message("control_change", control=40, value=127),
+    mido.Message("note_on", note=40, velocity=100),
+    mido.Message("note_off", note=40, velocity=0, channel=0),
+    mido.Message("note_on", note=1, velocity=100, channel=2),
+    mido.Message("note_on", note=7, velocity=100),
+    mido.Message("program_change", program=1),
+    mido.Message("program_change", program=1, channel=3),
+    mido.Message("pitchwheel", pitch=100, channel=2),
+    mido.Message("sysex", data=[1, 2, 3]),
+]
+
+
+@pytest.fixture
+def device():
+    controls = [MidiControl(**conditions) for conditions in CONTROLS_CONDITIONS]
+    return MidiDevice(name="TEST-DEVICE", controls=controls)
+
+
+@pytest.mark.parametrize("message", MESSAGES, ids=str)
+def test_matching_controls_same_as_matches(device, message):
+    expected = [control for control in device.controls if control.matches(message)]
+    assert device.matching_controls(message) == expected
+
+
+def test_dispatch_table_only_has_candidates(device):
+    message = mido.Message("control_change", control=7, value=127)
+    # the control 7 plus the two controls without conditions on the type of message
+    assert len(device.matching_controls(message)) == 2
+
+
+class FakePort:
+    def __init__(self, name):
+        self.name = name
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    def __iter__(self):
+        # like a port whose device was unplugged, when reading from it
+        raise OSError("Device not available")
+        yield
+
+
+class FakeMidiBackend:
+    def __init__(self, input_names=()):
+        self.input_names = list(input_names)
+        # ports that can't be opened, as if another program was using them
+        self.busy_names = set()
+        self.opened_ports = []
+
+    def get_input_names(self):
+        return self.input_names
+
+    def open_input(self, name, callback=None):
+        if name not in self.input_names or name in self.busy_names:
+            raise OSError(f"Can't open port: {name}")
+
+        port = FakePort(name)
+        self.opened_ports.append(port)
+        return port
+
+
+@pytest.fixture
+def watcher(tmp_path, mocker):
+    mocker.patch.object(Simpyt, "current", Simpyt(tmp_path))
+    (tmp_path / "midis").mkdir()
+
+    backend = FakeMidiBackend(input_names=["PIANO-XYZ", "PIANO-ABC"])
+    return MidiDevicesWatcher(MidiReceiver(backend, use_callbacks=True))
+
+
+def write_device_config(name, device_name, note, mtime):
+    path = Simpyt.current.midis_path / f"{name}.midi_device"
+    path.write_text(f"name: {device_name}\n"
+                    f"controls:\n"
+                    f"- when: note {note} surpasses 0\n"
+                    f"  action: keys a\n")
+    # explicit times, as the file system might not notice changes that happen too fast
+    os.utime(path, ns=(mtime, mtime))
+
+
+def test_watcher_reconfigures_devices_in_place(watcher):
+    write_device_config("piano", "PIANO-XYZ", note=40, mtime=1)
+    watcher.check()
+    device = watcher.devices["piano"]
+    port = device.port
+
+    write_device_config("piano", "PIANO-XYZ", note=41, mtime=2)
+    watcher.check()
+
+    assert watcher.devices["piano"] is device
+    assert device.port is port and not port.closed
+    assert device.matching_controls(mido.Message("note_on", note=40)) == []
+    assert device.matching_controls(mido.Message("note_on", note=41)) == device.controls
+    assert len(watcher.receiver.midi_backend.opened_ports) == 1
+
+
+def test_watcher_connects_and_disconnects_devices(watcher):
+    write_device_config("piano", "PIANO-XYZ", note=40, mtime=1)
+    watcher.check()
+    old_port = watcher.devices["piano"].port
+
+    # renamed device
+    write_device_config("piano", "PIANO-ABC", note=40, mtime=2)
+    watcher.check()
+    assert old_port.closed
+    assert watcher.devices["piano"].port.name == "PIANO-ABC"
+
+    # the renamed config isn't seen as changed again
+    renamed_device = watcher.devices["piano"]
+    watcher.check()
+    assert watcher.devices["piano"] is renamed_device
+    assert len(watcher.receiver.midi_backend.opened_ports) == 2
+
+    # broken config, keeps the device as it was
+    (Simpyt.current.midis_path / "piano.midi_device").write_text("controls: 42")
+    watcher.check()
+    assert watcher.devices["piano"].port.name == "PIANO-ABC"
+
+    (Simpyt.current.midis_path / "piano.midi_device").unlink()
+    watcher.check()
+    assert watcher.devices == {}
+    assert all(port.closed for port in watcher.receiver.midi_backend.opened_ports)
+
+
+def test_watcher_follows_plugged_devices(watcher):
+    backend = watcher.receiver.midi_backend
+    backend.input_names = ["OTHER-DEVICE"]
+
+    # configured while unplugged
+    write_device_config("piano", "PIANO-XYZ", note=40, mtime=1)
+    watcher.check()
+    device = watcher.devices["piano"]
+    assert device.port is None
+
+    backend.input_names = ["OTHER-DEVICE", "PIANO-XYZ"]
+    watcher.check()
+    port = device.port
+    assert port.name == "PIANO-XYZ"
+
+    # still plugged, nothing changes
+    watcher.check()
+    assert device.port is port
+
+    backend.input_names = ["OTHER-DEVICE"]
+    watcher.check()
+    assert port.closed
+    assert device.port is None
+    assert watcher.devices["piano"] is device
+
+    backend.input_names = ["PIANO-XYZ"]
+    watcher.check()
+    assert device.port is not None and not device.port.closed
+    assert len(backend.opened_ports) == 2
+
+
+def test_watcher_ignores_other_devices_being_plugged(watcher):
+    backend = watcher.receiver.midi_backend
+    backend.input_names = ["OTHER-DEVICE", "PIANO-XYZ"]
+
+    write_device_config("piano", "PIANO-XYZ", note=40, mtime=1)
+    watcher.check()
+    device = watcher.devices["piano"]
+    port = device.port
+
+    # its input moves in the list, but it's still the same healthy port
+    for input_names in (["PIANO-XYZ"], ["NEW-DEVICE", "PIANO-XYZ", "OTHER-DEVICE"]):
+        backend.input_names = input_names
+        watcher.check()
+
+        assert device.port is port and not port.closed
+        assert len(backend.opened_ports) == 1
+        assert watcher.receiver.messages.empty()
+
+
+def test_watcher_retries_busy_ports(watcher):
+    backend = watcher.receiver.midi_backend
+    backend.busy_names = {"PIANO-XYZ"}
+
+    write_device_config("piano", "PIANO-XYZ", note=40, mtime=1)
+    watcher.check()
+    watcher.check()
+    device = watcher.devices["piano"]
+    assert device.port is None
+
+    backend.busy_names = set()
+    watcher.check()
+    assert device.port is not None
+
+
+def test_failed_ports_are_reconnected(watcher):
+    # backends like pygame don't stop listing inputs that were unplugged
+    watcher.receiver.use_callbacks = False
+    write_device_config("piano", "PIANO-XYZ", note=40, mtime=1)
+    watcher.check()
+    device = watcher.devices["piano"]
+
+    # the reader thread fails right away
+    watcher.receiver.messages.get(timeout=1)
+    assert device.port is None
+
+    watcher.check()
+    assert len(watcher.receiver.midi_backend.opened_ports) == 2
+
+
+def test_unplugged_devices_release_held_controls(watcher, mocker):
+    keyboard = RecordingKeyboard()
+    mocker.patch.object(actions.Keyboard, "get", return_value=keyboard)
+
+    write_device_config("piano", "PIANO-XYZ", note=40, mtime=1)
+    watcher.check()
+    device = watcher.devices["piano"]
+    device.handle_message(mido.Message("note_on", note=40, velocity=100), 0)
+
+    watcher.receiver.midi_backend.input_names = []
+    watcher.check()
+
+    # the dispatcher learns about it after the messages received before unplugging it
+    disconnected_device, message, _ = watcher.receiver.messages.get_nowait()
+    assert disconnected_device is device and message is None
+    device.release_controls()
+
+    assert [events for _, events in keyboard.batches] == [[("a", True)], [("a", False)]]
+
+
+@pytest.mark.parametrize("raw_when,expected", [
+    ("note 40 surpasses 64", dict(when_hysteresis=None, when_deadband=None)),
+    ("note 40 surpasses 64 hysteresis 5", dict(when_hysteresis=5, when_deadband=None)),
+    ("control 7 between 0-127 deadband 2", dict(when_hysteresis=None, when_deadband=2)),
+    ("program between 10-20 hysteresis 3", dict(when_hysteresis=3, when_deadband=None)),
+])
+def test_parse_when_filters(raw_when, expected):
+    when_args = MidiControl.parse_when(raw_when)
+    assert {name: when_args[name] for name in expected} == expected
+
+
+@pytest.mark.parametrize("raw_when", [
+    "note 40 surpasses 64 hysteresis",
+    "note 40 surpasses 64 hysteresis -1",
+    "note 40 surpasses 64 deadband 2",
+    "control 7 between 0-127 smoothing 2",
+])
+def test_parse_when_incorrect_filters(raw_when):
+    with pytest.raises(ImproperlyConfiguredException):
+        MidiControl.parse_when(raw_when)
+
+
+def filtered_values(control, values):
+    return [
+        value for value in values
+        if control.filter_jitter(mido.Message("control_change", control=7, value=value))
+    ]
+
+
+def test_hysteresis_ignores_jitter_around_threshold():
+    control = MidiControl(when_control=7, when_value_surpasses=64, when_hysteresis=5)
+
+    values = [10, 65, 63, 66, 62, 64, 59, 64, 65, 70]
+    # turns on at 65, and only turns off when going back to 59
+    assert filtered_values(control, values) == [65, 59, 65]
+
+
+def test_deadband_ignores_small_changes():
+    control = MidiControl(when_control=7, when_value_between=(0, 127), when_deadband=3)
+
+    values = [60, 61, 62, 63, 64, 50, 1, 0, 0, 126, 127]
+    # small changes are ignored, except when they reach the limits of the range
+    assert filtered_values(control, values) == [60, 63, 50, 1, 0, 126, 127]
+
+
+def test_reconfigure_keeps_hysteresis_state(mocker):
+    keyboard = RecordingKeyboard()
+    mocker.patch.object(actions.Keyboard, "get", return_value=keyboard)
+    mocker.patch.object(Simpyt, "current", Simpyt(None))
+
+    def build_device(with_control_8=True):
+        controls = [MidiControl.deserialize(dict(when="control 7 surpasses 64 hysteresis 5",
+                                                 action="keys a"))]
+        if with_control_8:
+            controls.append(MidiControl.deserialize(dict(when="control 8 surpasses 64",
+                                                         action="keys b")))
+        return MidiDevice(name="TEST-DEVICE", controls=controls)
+
+    device = build_device()
+    device.handle_message(mido.Message("control_change", control=7, value=100), 0)
+    device.handle_message(mido.Message("control_change", control=8, value=100), 0)
+
+    # the config changes while both are held down, and control 8 is removed
+    device.reconfigure(build_device(with_control_8=False))
+
+    device.handle_message(mido.Message("control_change", control=7, value=0), 0)
+
+    assert [events for _, events in keyboard.batches] == [
+        [("a", True)], [("b", True)], [("b", False)], [("a", False)],
+    ]
+
+
+def test_paced_linked_actions_dont_block_the_dispatch(mocker):
+    keyboard = RecordingKeyboard()
+    mocker.patch.object(actions.Keyboard, "get", return_value=keyboard)
+    mocker.patch.object(Simpyt, "current", Simpyt(None))
+
+    control = MidiControl.deserialize(dict(when="note 40 surpasses 0", action="keys a b c",
+                                           pacing=dict(key_interval=0.05)))
+    device = MidiDevice(name="TEST-DEVICE", controls=[control])
+
+    started_at = perf_counter()
+    device.handle_message(mido.Message("note_on", note=40, velocity=100), 0)
+    device.handle_message(mido.Message("note_off", note=40, velocity=0), 0)
+    # the keys are pressed and released by the scripts engine, with their intervals
+    assert perf_counter() - started_at < 0.05
+
+    while len(keyboard.batches) < 6 and perf_counter() - started_at < 2:
+        sleep(0.01)
+
+    assert [events for _, events in keyboard.batches] == [
+        [("a", True)], [("b", True)], [("c", True)],
+        [("c", False)], [("b", False)], [("a", False)],
+    ]
+
+
+@pytest.mark.parametrize("new_action,expected_batches", [
+    # the same keys, released by the new control
+    ("keys a", [[("a", True)], [("a", False)]]),
+    # different keys, the old ones are released right away
+    ("keys b", [[("a", True)], [("a", False)], [("b", False)]]),
+    # nothing linked anymore
+    (None, [[("a", True)], [("a", False)]]),
+])
+def test_reconfigure_releases_changed_linked_actions(mocker, new_action, expected_batches):
+    keyboard = RecordingKeyboard()
+    mocker.patch.object(actions.Keyboard, "get", return_value=keyboard)
+    mocker.patch.object(Simpyt, "current", Simpyt(None))
+
+    def build_device(action):
+        control_config = dict(when="control 7 surpasses 64")
+        if action is not None:
+            control_config["action"] = action
+        else:
+            control_config["script"] = ["write hello"]
+        return MidiDevice(name="TEST-DEVICE", controls=[MidiControl.deserialize(control_config)])
+
+    device = build_device("keys a")
+    device.handle_message(mido.Message("control_change", control=7, value=100), 0)
+
+    device.reconfigure(build_device(new_action))
+    device.handle_message(mido.Message("control_change", control=7, value=0), 0)
+
+    assert [events for _, events in keyboard.batches] == expected_batches
@@ -0,0 +1,95 @@
+from time import perf_counter, sleep
+
+import mido
+import pytest
+
+from midi_capture import MidiCapture, read_capture, replay
+
+
+MESSAGES = [
+    ("DEVICE-A", mido.Message("note_on", note=40, velocity=100), 10.0),
+    ("DEVICE-B", mido.Message("control_change", control=7, value=64, channel=3), 10.01),
+    ("DEVICE-A", mido.Message("note_off", note=40, velocity=0), 10.02),
+    # longer than the 64 KiB a 16 bits length could handle
+    ("DEVICE-A", mido.Message("sysex", data=list(range(100)) * 1000), 10.03),
+]
+
+
+class RecordingDevice:
+    """
+    A device that just keeps the messages it has to handle.
+    """
+    def __init__(self):
+        self.messages = []
+
+    def handle_message(self, midi_message, received_at):
+        self.messages.append(midi_message)
+
+
+@pytest.fixture
+def capture_path(tmp_path, mocker):
+    path = tmp_path / "session.midicap"
+    mocker.patch("midi_capture.perf_counter", return_value=10.0)
+
+    capture = MidiCapture(path)
+    for device_name, midi_message, received_at in MESSAGES:
+        capture.write(device_name, midi_message, received_at)
+    capture.close()
+
+    return path
+
+
+def test_capture_and_read(capture_path):
+    records = list(read_capture(capture_path))
+
+    assert [(device_name, message) for _, device_name, message in records] == [
+        (device_name, message) for device_name, message, _ in MESSAGES
+    ]
+    assert [timestamp for timestamp, _, _ in records] == pytest.approx([0, 0.01, 0.02, 0.03])
+
+
+def test_read_interrupted_capture(capture_path):
+    content = capture_path.read_bytes()
+    capture_path.write_bytes(content[:-5])
+
+    assert len(list(read_capture(capture_path))) == 3
+
+    # interrupted inside the record of the second device, and inside its name
+    name_start = content.index(b"DEVICE-B")
+    for cut_at in (name_start - 1, name_start + 4):
+        capture_path.write_bytes(content[:cut_at])
+
+        assert [device_name for _, device_name, _ in read_capture(capture_path)] == ["DEVICE-A"]
+
+
+def test_replay_skips_unknown_devices(capture_path):
+    device = RecordingDevice()
+
+    handling_times = replay(read_capture(capture_path), {"DEVICE-A": device}, speed=0)
+
+    assert device.messages == [message for name, message, _ in MESSAGES if name == "DEVICE-A"]
+    assert len(handling_times) == 3
+
+
+def test_replay_keeps_timing(capture_path, mocker):
+    sleep = mocker.patch("timing.Timer.sleep")
+
+    replay(read_capture(capture_path), {"DEVICE-A": RecordingDevice()}, speed=2)
+
+    # the clock is frozen by the fixture, so each message waits for its whole offset (the first
+    # one is sent right away)
+    waits = [call.args[0] for call in sleep.call_args_list]
+    assert waits == pytest.approx([0.01, 0.015])
+
+
+def test_capture_flushed_periodically(tmp_path, mocker):
+    mocker.patch("midi_capture.FLUSH_INTERVAL", 0.01)
+    path = tmp_path / "session.midicap"
+
+    capture = MidiCapture(path)
+    capture.write("DEVICE-A", mido.Message("note_on", note=40), perf_counter())
+    sleep(0.1)
+
+    # readable even if the capture is never closed (like when Simpyt is killed)
+    assert len(list(read_capture(path))) == 1
+    capture.close()
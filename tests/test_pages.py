@@ -0,0 +1,92 @@
+import os
+
+import pytest
+
+from core import Simpyt
+from pages import Page
+
+
+PAGE_CONFIG = """
+controls:
+- at: 1 1 size 2 2
+  action: keys a
+- at: 3 1 size 2 2
+  action: keys {key}
+"""
+
+
+@pytest.fixture
+def pages_path(tmp_path, mocker):
+    mocker.patch.object(Simpyt, "current", Simpyt(tmp_path))
+    mocker.patch.object(Page, "_cache", {})
+    mocker.patch.object(Page, "_names_cache", (None, []))
+    mocker.patch.object(Page, "_controls_by_id", {})
+
+    pages_path = tmp_path / "pages"
+    pages_path.mkdir()
+    return pages_path
+
+
+def write_page(pages_path, name, key="b", mtime=1000):
+    page_path = pages_path / (name + ".page")
+    page_path.write_text(PAGE_CONFIG.format(key=key))
+    os.utime(page_path, (mtime, mtime))
+
+
+def test_page_is_reused_while_its_file_doesnt_change(pages_path, mocker):
+    write_page(pages_path, "test")
+    page = Page.get("test")
+
+    read = mocker.spy(Page, "read")
+    assert Page.get("test") is page
+    read.assert_not_called()
+
+
+def test_page_is_read_again_when_its_file_changes(pages_path):
+    write_page(pages_path, "test")
+    page = Page.get("test")
+
+    write_page(pages_path, "test", key="c", mtime=2000)
+    new_page = Page.get("test")
+
+    assert new_page is not page
+    assert new_page.controls[1].linked_action.keys == ["c"]
+
+
+def test_pages_list_is_updated_when_the_folder_changes(pages_path):
+    write_page(pages_path, "first")
+    os.utime(pages_path, (1000, 1000))
+    assert Page.configured_pages() == ["first"]
+
+    write_page(pages_path, "second")
+    os.utime(pages_path, (2000, 2000))
+    assert sorted(Page.configured_pages()) == ["first", "second"]
+
+
+def test_controls_ids_are_the_same_each_time_the_page_is_read(pages_path):
+    write_page(pages_path, "test")
+
+    first_ids = [control.id for control in Page.read("test").controls]
+    second_ids = [control.id for control in Page.read("test").controls]
+
+    assert first_ids == second_ids
+    assert len(set(first_ids)) == 2
+
+
+def test_controls_are_found_by_id_after_the_page_is_reloaded(pages_path):
+    write_page(pages_path, "test")
+    control_id = Page.get("test").controls[1].id
+
+    write_page(pages_path, "test", key="c", mtime=2000)
+    page = Page.get("test")
+    control = Page.get_control("test", control_id)
+
+    assert control is page.controls[1]
+    assert control.linked_action.keys == ["c"]
+
+
+def test_controls_are_found_by_id_before_the_page_is_read(pages_path):
+    write_page(pages_path, "test")
+    control_id = Page.read("test").controls[0].id
+
+    assert Page.get_control("test", control_id) is Page.get("test").controls[0]
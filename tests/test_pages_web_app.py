@@ -0,0 +1,218 @@
+from http.client import HTTPConnection
+from threading import Event, Thread
+import gzip
+import json
+import socket
+
+import pytest
+
+from pages import Page
+from pages_web_app import KeepAliveRequestHandler, PooledWSGIServer, RenderedPage, web_app
+
+
+def app(environ, start_response):
+    """
+    A tiny wsgi app: /not_modified answers with a 304, /slow waits until it's released, and the
+    rest answer with a short text.
+    """
+    if environ["PATH_INFO"] == "/not_modified":
+        start_response("304 NOT MODIFIED", [("ETag", '"abc"')])
+        return []
+
+    if environ["PATH_INFO"] == "/slow":
+        app.slow_started.set()
+        app.release.wait(timeout=5)
+
+    body = b"hello"
+    start_response("200 OK", [("Content-Type", "text/plain"),
+                              ("Content-Length", str(len(body)))])
+    return [body]
+
+
+@pytest.fixture
+def server():
+    app.slow_started = Event()
+    app.release = Event()
+    servers = []
+
+    def start(workers):
+        server = PooledWSGIServer("127.0.0.1", 0, app, workers=workers)
+        Thread(target=server.serve_forever, kwargs=dict(poll_interval=0.01), daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+
+    app.release.set()
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def connect(server):
+    return HTTPConnection("127.0.0.1", server.server_address[1], timeout=2)
+
+
+def test_not_modified_responses_keep_connection_alive(server):
+    connection = connect(server(workers=2))
+
+    connection.request("GET", "/not_modified")
+    response = connection.getresponse()
+    response.read()
+    assert response.status == 304
+    assert response.getheader("Connection") is None
+
+    connection.request("GET", "/")
+    response = connection.getresponse()
+    assert response.read() == b"hello"
+    # still the same socket
+    assert connection.sock is not None
+
+
+def test_idle_connections_dont_hold_workers(server, mocker):
+    mocker.patch.object(KeepAliveRequestHandler, "idle_timeout", 0.1)
+    running_server = server(workers=1)
+
+    # the only worker is kept by this connection, until it's idle for too long
+    idle_connection = connect(running_server)
+    idle_connection.request("GET", "/")
+    idle_connection.getresponse().read()
+
+    connection = connect(running_server)
+    connection.request("GET", "/")
+    assert connection.getresponse().read() == b"hello"
+
+
+def test_upgraded_connections_leave_the_pool(server):
+    running_server = server(workers=1)
+
+    # like a websocket, taken over by the app until the page is closed
+    upgraded_connection = connect(running_server)
+    upgraded_connection.request("GET", "/slow", headers={"Connection": "Upgrade",
+                                                          "Upgrade": "websocket"})
+
+    connection = connect(running_server)
+    connection.request("GET", "/")
+    assert connection.getresponse().read() == b"hello"
+
+
+def test_waiting_connections_are_limited(server, mocker):
+    mocker.patch.object(PooledWSGIServer, "QUEUE_LIMIT", 1)
+    running_server = server(workers=1)
+
+    busy_connection = connect(running_server)
+    busy_connection.request("GET", "/slow")
+    assert app.slow_started.wait(timeout=2)
+
+    # waits in line
+    waiting_connection = connect(running_server)
+    waiting_connection.request("GET", "/")
+
+    # no room left in the line
+    rejected_socket = socket.create_connection(("127.0.0.1", running_server.server_address[1]),
+                                               timeout=2)
+    assert rejected_socket.recv(1024).startswith(b"HTTP/1.1 503")
+
+    app.release.set()
+    assert busy_connection.getresponse().read() == b"hello"
+    assert waiting_connection.getresponse().read() == b"hello"
+
+
+def rendered_page_response(rendered_page, headers):
+    with web_app.test_request_context(headers=headers):
+        return rendered_page.response()
+
+
+def test_rendered_page_is_served_in_the_accepted_encoding():
+    rendered_page = RenderedPage("<html>hello</html>")
+
+    response = rendered_page_response(rendered_page, {"Accept-Encoding": "gzip"})
+    assert response.content_encoding == "gzip"
+    assert gzip.decompress(response.get_data()) == b"<html>hello</html>"
+
+    response = rendered_page_response(rendered_page, {})
+    assert response.content_encoding is None
+    assert response.get_data() == b"<html>hello</html>"
+
+
+def test_rendered_page_has_a_different_etag_per_encoding():
+    rendered_page = RenderedPage("<html>hello</html>")
+
+    gzip_etag, _ = rendered_page_response(rendered_page, {"Accept-Encoding": "gzip"}).get_etag()
+    identity_etag, _ = rendered_page_response(rendered_page, {}).get_etag()
+
+    assert gzip_etag != identity_etag
+
+
+def test_rendered_page_isnt_sent_again_to_clients_that_have_it():
+    rendered_page = RenderedPage("<html>hello</html>")
+    etag, _ = rendered_page_response(rendered_page, {"Accept-Encoding": "gzip"}).get_etag()
+
+    response = rendered_page_response(rendered_page, {"Accept-Encoding": "gzip",
+                                                      "If-None-Match": f'"{etag}"'})
+    assert response.status_code == 304
+    assert response.get_data() == b""
+
+    # a client with the page in another encoding still gets it
+    response = rendered_page_response(rendered_page, {"If-None-Match": f'"{etag}"'})
+    assert response.status_code == 200
+
+
+class FakeWebSocket:
+    """
+    Websocket that receives the given messages, and then times out.
+    """
+    def __init__(self, messages):
+        self.messages = [json.dumps(message) for message in messages]
+
+    def receive(self, timeout=None):
+        if self.messages:
+            return self.messages.pop(0)
+        return None
+
+
+class FakeControl:
+    """
+    Page control that records when it's held down and released.
+    """
+    def __init__(self, control_id):
+        self.id = control_id
+        self.source = control_id
+        self.events = []
+
+    def hold_down(self):
+        self.events.append("hold_down")
+
+    def release(self):
+        self.events.append("release")
+
+
+@pytest.fixture
+def control(mocker):
+    control = FakeControl("control_1")
+    mocker.patch.object(Page, "get_control", return_value=control)
+    return control
+
+
+def run_control_channel(messages):
+    # the route is registered wrapped by flask-sock, which builds the real websocket
+    control_channel = web_app.view_functions["control_channel"].__wrapped__
+    control_channel(FakeWebSocket(messages), "test_page")
+
+
+def test_control_channel_releases_controls(control):
+    run_control_channel([
+        {"event": "press", "control": "control_1"},
+        {"event": "keepalive", "control": None},
+        {"event": "release", "control": "control_1"},
+    ])
+
+    assert control.events == ["hold_down", "release"]
+
+
+def test_control_channel_releases_held_controls_when_the_client_is_gone(control):
+    run_control_channel([
+        {"event": "press", "control": "control_1"},
+    ])
+
+    assert control.events == ["hold_down", "release"]
@@ -0,0 +1,142 @@
+from threading import active_count
+from time import perf_counter, sleep
+
+import pytest
+
+import actions
+from actions import Action, Script
+from core import ImproperlyConfiguredException
+from keyboard_base import RecordingKeyboard
+from scripts import OnRetrigger, ScriptRun, ScriptsEngine
+
+
+@pytest.fixture
+def engine():
+    return ScriptsEngine()
+
+
+@pytest.fixture
+def keyboard(mocker):
+    keyboard = RecordingKeyboard()
+    mocker.patch.object(actions.Keyboard, "get", return_value=keyboard)
+    return keyboard
+
+
+def script(*raw_actions):
+    return Script([Action.find_and_deserialize(raw_action) for raw_action in raw_actions])
+
+
+def test_many_waiting_scripts_share_a_thread(engine):
+    threads_before = active_count()
+    started_at = perf_counter()
+
+    runs = [engine.start(script("wait 0.2"), "test") for _ in range(1000)]
+    assert active_count() == threads_before
+
+    for script_run in runs:
+        script_run.future.result()
+
+    assert perf_counter() - started_at < 1
+    assert engine.snapshot() == []
+
+
+def test_running_scripts_listed(engine):
+    script_run = engine.start(script("wait 0.5"), "test")
+    sleep(0.1)
+
+    snapshot, = engine.snapshot()
+    assert snapshot["id"] == script_run.id
+    assert snapshot["source"] == "test"
+    assert snapshot["state"] == ScriptRun.RUNNING
+
+
+def test_cancelled_script_releases_keys(engine, keyboard):
+    script_run = engine.start(script("keys ctrl a", "wait 5"), "test")
+    sleep(0.01)
+    assert engine.cancel(script_run.id)
+
+    sleep(0.1)
+    assert engine.snapshot() == []
+    assert [events for _, events in keyboard.batches] == [
+        [("ctrl", True), ("a", True)],
+        [("a", False), ("ctrl", False)],
+    ]
+
+
+def test_cancel_unknown_run(engine):
+    assert not engine.cancel(42)
+
+
+def test_retrigger_drop(engine):
+    first_run = engine.start(script("wait 0.5"), "test", "control", OnRetrigger.DROP)
+    assert engine.start(script("wait 0.5"), "test", "control", OnRetrigger.DROP) is None
+
+    assert [run["id"] for run in engine.snapshot()] == [first_run.id]
+
+
+def test_retrigger_restart(engine):
+    first_run = engine.start(script("wait 0.5"), "test", "control", OnRetrigger.RESTART)
+    second_run = engine.start(script("wait 0.5"), "test", "control", OnRetrigger.RESTART)
+
+    sleep(0.05)
+    assert first_run.future.cancelled()
+    assert [run["id"] for run in engine.snapshot()] == [second_run.id]
+
+
+def test_retrigger_queue(engine):
+    runs = [engine.start(script("wait 0.1"), "test", "control", OnRetrigger.QUEUE)
+            for _ in range(ScriptsEngine.QUEUE_LIMIT + 2)]
+
+    # the queue is full, new triggers are dropped
+    assert runs[-2:] == [None, None]
+    runs = runs[:-2]
+
+    sleep(0.05)
+    states = [run["state"] for run in engine.snapshot()]
+    assert states == [ScriptRun.RUNNING] + [ScriptRun.QUEUED] * (len(runs) - 1)
+
+    runs[-1].future.result()
+    # one after the other
+    for previous_run, next_run in zip(runs, runs[1:]):
+        assert next_run.started_at - previous_run.started_at >= 0.1
+
+
+def test_retrigger_parallel(engine):
+    for _ in range(3):
+        engine.start(script("wait 0.5"), "test", "control", OnRetrigger.PARALLEL)
+
+    sleep(0.05)
+    assert [run["state"] for run in engine.snapshot()] == [ScriptRun.RUNNING] * 3
+
+
+def test_incorrect_retrigger():
+    with pytest.raises(ImproperlyConfiguredException):
+        OnRetrigger.deserialize("twice")
+
+
+def test_retrigger_queue_survives_cancelled_runs(engine):
+    runs = [engine.start(script("wait 0.1"), "test", "control", OnRetrigger.QUEUE)
+            for _ in range(3)]
+
+    # cancelling the run in the middle doesn't let the last one start before the first ends
+    runs[1].cancel()
+    runs[2].future.result()
+
+    assert runs[1].future.cancelled()
+    assert runs[2].started_at - runs[0].started_at >= 0.1
+
+
+def test_cancelled_runs_listed_until_cleaned_up(engine):
+    script_run = engine.start(script("wait 5"), "test", "control", OnRetrigger.DROP)
+    sleep(0.01)
+
+    # keep the event loop busy, so the cancelled run can't do its cleanup yet
+    engine.loop.call_soon_threadsafe(sleep, 0.1)
+    engine.cancel(script_run.id)
+
+    assert [run["id"] for run in engine.snapshot()] == [script_run.id]
+    assert engine.start(script("wait 5"), "test", "control", OnRetrigger.DROP) is None
+
+    sleep(0.2)
+    assert script_run.future.cancelled()
+    assert engine.snapshot() == []
@@ -0,0 +1,65 @@
+import asyncio
+from time import perf_counter
+
+from timing import Timer
+
+
+def test_sleep_ends_precisely():
+    timer = Timer(spin_seconds=0.005)
+
+    started_at = perf_counter()
+    timer.sleep(0.02)
+    elapsed = perf_counter() - started_at
+
+    # only the lower bound is exact, how late it ends depends on the load of the machine
+    assert 0.02 <= elapsed < 1
+    stats = timer.stats()
+    assert stats["waits"] == 1
+    assert 0 <= stats["overshoot_max"] <= elapsed - 0.02
+
+
+def test_async_sleep_ends_precisely():
+    timer = Timer(spin_seconds=0.005)
+
+    async def wait_several():
+        await asyncio.gather(*[timer.sleep_async(0.02) for _ in range(100)])
+
+    started_at = perf_counter()
+    asyncio.run(wait_several())
+    elapsed = perf_counter() - started_at
+
+    assert 0.02 <= elapsed < 1
+    assert timer.stats()["waits"] == 100
+
+
+def test_async_spin_lets_other_coroutines_run():
+    # all the wait is spinning
+    timer = Timer(spin_seconds=1)
+    other_steps = 0
+    finished = False
+
+    async def other_coroutine():
+        nonlocal other_steps
+        while not finished:
+            other_steps += 1
+            await asyncio.sleep(0)
+
+    async def wait_while_other_runs():
+        nonlocal finished
+        other_task = asyncio.create_task(other_coroutine())
+        await timer.sleep_async(0.01)
+        finished = True
+        await other_task
+
+    asyncio.run(wait_while_other_runs())
+    assert other_steps > 1
+
+
+def test_overshoot_recorded():
+    timer = Timer(spin_seconds=0)
+    timer.sleep(0.01)
+    timer.sleep(0)
+
+    stats = timer.stats()
+    assert stats["waits"] == 2
+    assert 0 <= stats["overshoot_p50"] <= stats["overshoot_max"]
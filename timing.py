@@ -0,0 +1,131 @@
+from collections import deque
+from threading import Lock
+from time import perf_counter, sleep
+import asyncio
+
+from core import Simpyt
+from metrics import Metrics
+
+
+DEFAULT_SPIN_SECONDS = 0.002
+
+
+class Timer:
+    """
+    Waits with high precision. Sleeping alone wakes up late by a variable amount of time that
+    depends on the OS, so the timer sleeps until shortly before the end of the wait, and then
+    spins checking the clock for the last stretch (the spin time, which is the max CPU time spent
+    per wait).
+
+    The overshoot of each wait (how late it really ended) is recorded, to know how precise the
+    waits are in practice.
+    """
+
+    # amount of recent overshoots kept to calculate stats
+    OVERSHOOTS_HISTORY = 1000
+
+    # the timer in use, created when first needed
+    _current = None
+    _current_lock = Lock()
+
+    @classmethod
+    def get(cls):
+        """
+        Get the timer, creating it if it wasn't used before.
+        """
+        with cls._current_lock:
+            if cls._current is None:
+                cls._current = cls()
+
+            return cls._current
+
+    def __init__(self, spin_seconds=None):
+        if spin_seconds is None:
+            if Simpyt.current is not None:
+                spin_seconds = Simpyt.current.timer_spin
+            else:
+                spin_seconds = DEFAULT_SPIN_SECONDS
+        self.spin_seconds = spin_seconds
+
+        self.overshoots = deque(maxlen=self.OVERSHOOTS_HISTORY)
+        self.waits_count = 0
+        self.max_overshoot = 0
+        self.stats_lock = Lock()
+
+    def sleep(self, seconds):
+        """
+        Wait some seconds, blocking the current thread.
+        """
+        deadline = perf_counter() + seconds
+
+        coarse_seconds = seconds - self.spin_seconds
+        if coarse_seconds > 0:
+            sleep(coarse_seconds)
+
+        self._spin_until(deadline)
+
+    async def sleep_async(self, seconds):
+        """
+        Wait some seconds, inside a coroutine. While spinning, the coroutine keeps yielding to the
+        event loop, so the rest of the coroutines can still run.
+        """
+        deadline = perf_counter() + seconds
+
+        coarse_seconds = seconds - self.spin_seconds
+        if coarse_seconds > 0:
+            await asyncio.sleep(coarse_seconds)
+
+        now = perf_counter()
+        while now < deadline:
+            # let other coroutines (and threads) run while spinning
+            await asyncio.sleep(0)
+            now = perf_counter()
+
+        self._record(now - deadline)
+
+    def _spin_until(self, deadline):
+        """
+        Check the clock until the deadline, and record the overshoot.
+        """
+        now = perf_counter()
+        while now < deadline:
+            # let other threads run while spinning
+            sleep(0)
+            now = perf_counter()
+
+        self._record(now - deadline)
+
+    def _record(self, overshoot):
+        """
+        Record the overshoot of a wait.
+        """
+        with self.stats_lock:
+            self.overshoots.append(overshoot)
+            self.waits_count += 1
+            self.max_overshoot = max(self.max_overshoot, overshoot)
+
+        Metrics.get().observe("simpyt_wait_overshoot_seconds", overshoot)
+
+    def stats(self):
+        """
+        Get stats about the overshoot of the waits, in seconds: the median and 99th percentile of
+        the recent waits, and the max of all of them.
+        """
+        with self.stats_lock:
+            overshoots = sorted(self.overshoots)
+            waits_count = self.waits_count
+            max_overshoot = self.max_overshoot
+
+        if overshoots:
+            p50 = overshoots[len(overshoots) // 2]
+            p99 = overshoots[min(len(overshoots) - 1, int(len(overshoots) * 0.99))]
+        else:
+            p50 = p99 = None
+
+        return dict(
+            spin_seconds=self.spin_seconds,
+            waits=waits_count,
+            overshoot_p50=p50,
+            overshoot_p99=p99,
+            overshoot_max=max_overshoot,
+        )